@@ -0,0 +1,257 @@
+'''
+@author: shylent
+
+An C{async}/C{await} interface to the sessions for the applications, that are
+built on C{asyncio}. Twisted runs on the same event loop (see L{install}), so
+no second loop or thread is involved: every L{Deferred} is simply handed over
+as an C{asyncio} future.
+
+    from texpect_cisco import aio
+    aio.install()
+
+    async def collect(device):
+        async with aio.session(device) as inst:
+            version = await inst.run_command('show version')
+            async for line in inst.stream('show running-config', lines=True):
+                ...
+
+The awaitables are bound to the running loop, so everything here is meant to
+be used from the coroutines, that run on it.
+
+@note: Requires Python 3 (the rest of the package runs on both Python 2 and 3,
+see L{texpect_cisco.compat}) and a Twisted version, that has C{Deferred.asFuture}.
+'''
+import asyncio
+from collections import deque
+from twisted.python.failure import Failure
+from twisted.internet.defer import Deferred, maybeDeferred
+from texpect_cisco.fleet import connect as fleet_connect
+
+
+def install(loop=None):
+    """Install the C{asyncio} reactor, so that Twisted runs on the loop. Must be
+    called before the reactor is imported anywhere else.
+
+    @param loop: The event loop. Default: the one, that Twisted picks
+
+    """
+    from twisted.internet import asyncioreactor
+    asyncioreactor.install(loop)
+
+
+def as_future(d):
+    """Must be called while the loop is running (from a coroutine, normally).
+
+    @return: An C{asyncio} future, that is resolved with the result of the
+    L{Deferred}
+    @rtype: C{asyncio.Future}"""
+    return d.asFuture(asyncio.get_running_loop())
+
+
+class AsyncSession(object):
+    """Wraps a L{Cisco<texpect_cisco.cisco.Cisco>} session, the methods return
+    awaitables instead of L{Deferred}s. The arguments and the exceptions are the
+    same as those of the session.
+
+    @ivar session: The session
+    @type session: L{Cisco<texpect_cisco.cisco.Cisco>}
+
+    """
+
+    def __init__(self, session):
+        self.session = session
+
+    @property
+    def device(self):
+        return self.session.device
+
+    @property
+    def enabled(self):
+        return self.session.enabled
+
+    @property
+    def eof(self):
+        return self.session.eof
+
+    def _call(self, method, *args, **kwargs):
+        return as_future(maybeDeferred(method, *args, **kwargs))
+
+    def login(self):
+        return self._call(self.session.login)
+
+    def enable(self, timeout=None):
+        return self._call(self.session.enable, timeout)
+
+    def bring_up(self, enable=True, timeout=None):
+        return self._call(self.session.bring_up, enable, timeout)
+
+    def run_command(self, command, **kwargs):
+        return self._call(self.session.run_command, command, **kwargs)
+
+    def run_commands(self, commands, **kwargs):
+        return self._call(self.session.run_commands, commands, **kwargs)
+
+    def exit(self, **kwargs):
+        return self._call(self.session.exit, **kwargs)
+
+    def stream(self, command, lines=False, max_pending=64, **kwargs):
+        """Run the command, streaming its output (see
+        L{stream_command<texpect_cisco.cisco.Cisco.stream_command>}).
+
+        @param lines: If C{True}, the output is iterated over line by line,
+        otherwise chunk by chunk. Default: C{False}
+        @type lines: C{bool}
+
+        @param max_pending: Number of items, that may be waiting to be consumed.
+        When there are this many, reading from the device is paused until the
+        consumer catches up. Default: 64
+        @type max_pending: C{int}
+
+        @return: An asynchronous iterator over the output
+        @rtype: L{OutputStream}
+
+        """
+        return OutputStream(self.session, command, lines, max_pending, kwargs)
+
+    def close(self):
+        """Drop the connection."""
+        if not self.session.eof:
+            self.session.transport.loseConnection()
+
+
+class OutputStream(object):
+    """An asynchronous iterator over the output of a command, that is being
+    streamed. The errors, reported by the session, are raised by the iteration.
+
+    @ivar count: Number of characters of the output, once it is complete, or
+    C{None}
+    @type count: C{int}
+
+    """
+
+    def __init__(self, session, command, lines, max_pending, kwargs):
+        self.lines = lines
+        self.max_pending = max_pending
+        self.count = None
+        self._items = deque()
+        self._failure = None
+        self._done = False
+        self._waiter = None
+        self._resume = None
+        d = session.stream_command(command, self._consume, lines=lines, **kwargs)
+        d.addBoth(self._finished)
+
+    def _consume(self, data):
+        if self.lines:
+            self._items.extend(data)
+        else:
+            self._items.append(data)
+        self._wake()
+        if len(self._items) >= self.max_pending:
+            self._resume = Deferred()
+            return self._resume
+
+    def _finished(self, res):
+        self._done = True
+        if isinstance(res, Failure):
+            self._failure = res
+        else:
+            self.count = res
+        self._wake()
+
+    def _wake(self):
+        waiter, self._waiter = self._waiter, None
+        if waiter is not None and not waiter.done():
+            waiter.set_result(None)
+
+    def __aiter__(self):
+        return self
+
+    def __anext__(self):
+        result = asyncio.get_running_loop().create_future()
+        self._next(result)
+        return result
+
+    def _next(self, result):
+        if result.done():
+            # Cancelled by the consumer
+            return
+        if self._items:
+            result.set_result(self._items.popleft())
+            if self._resume is not None and len(self._items) < self.max_pending:
+                resume, self._resume = self._resume, None
+                resume.callback(None)
+        elif self._failure is not None:
+            failure, self._failure = self._failure, None
+            result.set_exception(failure.value)
+        elif self._done:
+            result.set_exception(StopAsyncIteration())
+        else:
+            self._waiter = asyncio.get_running_loop().create_future()
+            self._waiter.add_done_callback(lambda ign: self._next(result))
+
+
+class _SessionContext(object):
+
+    def __init__(self, device, enable, exit, connect, kwargs):
+        self.device = device
+        self.enable = enable
+        self.exit = exit
+        self.connect = connect
+        self.kwargs = kwargs
+        self.inst = None
+
+    def __aenter__(self):
+        d = maybeDeferred(self.connect, self.device, **self.kwargs)
+        def connected(session):
+            self.inst = AsyncSession(session)
+            d = session.bring_up(self.enable)
+            def failed(failure):
+                self.inst.close()
+                return failure
+            d.addCallbacks(lambda ign: self.inst, failed)
+            return d
+        d.addCallback(connected)
+        return as_future(d)
+
+    def __aexit__(self, exc_type, exc, tb):
+        inst = self.inst
+        if self.exit and exc_type is None and not inst.eof:
+            d = maybeDeferred(inst.session.exit)
+        else:
+            d = maybeDeferred(lambda: None)
+        def close(res):
+            inst.close()
+            return res
+        d.addBoth(close)
+        # Never suppress the exception, raised in the block
+        d.addCallback(lambda ign: False)
+        return as_future(d)
+
+
+def session(device, enable=True, exit=True, connect=fleet_connect, **kwargs):
+    """Open a session to the device for the duration of an C{async with} block:
+    connect, log in and (optionally) enter privileged EXEC mode (see
+    L{bring_up<texpect_cisco.cisco.Cisco.bring_up>}), then leave and close the
+    connection, when the block is done.
+
+    @param device: A L{Device<texpect_cisco.cisco.Device>} instance
+    @type device: C{dict}
+
+    @param enable: Whether or not to enter privileged EXEC mode. Default: C{True}
+    @type enable: C{bool}
+
+    @param exit: Whether or not to run the 'exit' command, unless the block has
+    raised. Default: C{True}
+    @type exit: C{bool}
+
+    @param connect: The function, that connects to the device. Default:
+    L{connect<texpect_cisco.fleet.connect>}
+    @type connect: C{callable}
+
+    @param kwargs: Passed to L{connect}
+
+    @return: An asynchronous context manager, that provides an L{AsyncSession}
+
+    """
+    return _SessionContext(device, enable, exit, connect, kwargs)
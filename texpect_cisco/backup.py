@@ -0,0 +1,288 @@
+'''
+@author: shylent
+'''
+import os
+import re
+import json
+import time
+import hashlib
+from twisted.internet.defer import maybeDeferred
+from twisted.internet.threads import deferToThread
+from texpect_cisco.cisco import CiscoCommandError
+from texpect_cisco.compat import to_bytes
+
+
+# Lines of the running configuration, that change without the configuration
+# itself changing, they are not taken into account when the digest is computed
+default_ignore = (
+    r'^! Last configuration change at ',
+    r'^! NVRAM config last updated at ',
+    r'^! No configuration change since last restart',
+    r'^Current configuration : ',
+    r'^Building configuration\.\.\.',
+    r'^!Time: ',
+    r'^ntp clock-period ',
+    r'^: Saved',
+    r'^Cryptochecksum:',
+)
+
+
+class StoredConfig(object):
+    """The last collected configuration of a device.
+
+    @ivar config: The configuration
+    @type config: C{str}
+
+    @ivar digest: The hash of the configuration (see L{config_digest})
+    @type digest: C{str}
+
+    @ivar fingerprint: The output of the probe, when the configuration was last
+    checked, or C{None} if there is no probe for the device
+    @type fingerprint: C{str}
+
+    @ivar changed: The time the configuration was last seen to change
+    @type changed: C{float}
+
+    @ivar checked: The time the configuration was last checked
+    @type checked: C{float}
+
+    """
+    __slots__ = ('config', 'digest', 'fingerprint', 'changed', 'checked')
+
+    def __init__(self, config, digest, fingerprint=None, changed=None, checked=None):
+        self.config = config
+        self.digest = digest
+        self.fingerprint = fingerprint
+        self.changed = changed if changed is not None else time.time()
+        self.checked = checked if checked is not None else self.changed
+
+    def metadata(self):
+        """@return: Everything but the configuration itself
+        @rtype: C{dict}"""
+        return {'digest':self.digest, 'fingerprint':self.fingerprint,
+                'changed':self.changed, 'checked':self.checked}
+
+
+class ConfigStore(object):
+    """Keeps the last configuration of every device in memory, keyed by
+    C{device['id']}. The methods may return L{Deferred}s instead of the
+    values, so that the stores, that are backed by something slow, can do the
+    work outside of the reactor thread (see L{DirectoryConfigStore}).
+
+    """
+
+    def __init__(self):
+        self._configs = {}
+
+    def get(self, device_id):
+        """@return: The stored configuration or C{None}
+        @rtype: L{StoredConfig}"""
+        return self._configs.get(device_id)
+
+    def put(self, device_id, stored, config_changed=True):
+        """Store the configuration.
+
+        @param config_changed: Whether or not the configuration itself has
+        changed (otherwise only the L{metadata<StoredConfig.metadata>} has)
+        @type config_changed: C{bool}
+
+        """
+        self._configs[device_id] = stored
+
+
+class DirectoryConfigStore(ConfigStore):
+    """Keeps the configurations in a directory: C{<id>.cfg} with the
+    configuration and C{<id>.json} with the metadata, so that the directory can
+    be put under version control as is. The files are read and written in a
+    thread.
+
+    """
+
+    def __init__(self, path):
+        ConfigStore.__init__(self)
+        self.path = path
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+    def _file(self, device_id, extension):
+        return os.path.join(self.path, '%s.%s' % (device_id.replace(os.sep, '_'), extension))
+
+    def get(self, device_id):
+        return deferToThread(self._read, device_id)
+
+    def _read(self, device_id):
+        try:
+            with open(self._file(device_id, 'json')) as f:
+                metadata = json.load(f)
+            with open(self._file(device_id, 'cfg')) as f:
+                config = f.read()
+        except IOError:
+            return None
+        return StoredConfig(config, **dict((str(k), v) for k, v in metadata.items()))
+
+    def put(self, device_id, stored, config_changed=True):
+        return deferToThread(self._write, device_id, stored, config_changed)
+
+    def _write(self, device_id, stored, config_changed):
+        if config_changed:
+            self._replace(self._file(device_id, 'cfg'), stored.config)
+        self._replace(self._file(device_id, 'json'), json.dumps(stored.metadata()))
+
+    def _replace(self, path, data):
+        with open(path + '.tmp', 'w') as f:
+            f.write(data)
+        os.rename(path + '.tmp', path)
+
+
+def config_digest(config, ignore=default_ignore):
+    """Hash the configuration, skipping the lines, that match any of the
+    expressions in L{ignore}, as well as the trailing whitespace.
+
+    @rtype: C{str}
+
+    """
+    ignore = [re.compile(expression) for expression in ignore]
+    digest = hashlib.sha1()
+    for line in config.splitlines():
+        line = line.rstrip()
+        if line and not any(expression.match(line) for expression in ignore):
+            digest.update(to_bytes(line))
+            digest.update(b'\n')
+    return digest.hexdigest()
+
+
+class ConfigResult(object):
+    """The outcome of L{collect_config}.
+
+    @ivar changed: Whether or not the configuration has changed since it was
+    last collected (C{True} if it was never collected before)
+    @type changed: C{bool}
+
+    @ivar fetched: Whether or not the full configuration was fetched from the
+    device (C{False} if the probe has shown, that nothing changed)
+    @type fetched: C{bool}
+
+    @ivar stored: The configuration, as it is stored now
+    @type stored: L{StoredConfig}
+
+    """
+    __slots__ = ('changed', 'fetched', 'stored')
+
+    def __init__(self, changed, fetched, stored):
+        self.changed = changed
+        self.fetched = fetched
+        self.stored = stored
+
+    def __repr__(self):
+        return '<ConfigResult changed=%s fetched=%s>' % (self.changed, self.fetched)
+
+
+def collect_config(session, store, force=False):
+    """Collect the configuration of the device, if it has changed since the last
+    time.
+
+    If the device has a 'config_probe_command' (see
+    L{platforms<texpect_cisco.platforms>}) and its output is the same as the last
+    time, the configuration is assumed to be unchanged and is not fetched. An
+    output, that is empty or doesn't match the 'config_probe_pattern', or an
+    error, reported by the device, tells nothing, so the configuration is
+    fetched.
+    Otherwise the 'config_command' (C{'show running-config'} by default) is run and
+    the digest of its output is compared to the stored one.
+
+    @param session: A logged in session (in the privileged EXEC mode, if the
+    commands require it)
+    @type session: L{Cisco<texpect_cisco.cisco.Cisco>}
+
+    @param store: Where the configurations are kept
+    @type store: L{ConfigStore}
+
+    @param force: If C{True}, the configuration is fetched regardless of the
+    probe. Default: C{False}
+    @type force: C{bool}
+
+    @return: A L{Deferred}, that fires with a L{ConfigResult}. Errback argument
+    types are the same as for L{run_command<texpect_cisco.cisco.Cisco.run_command>}
+    @rtype: L{Deferred}
+
+    """
+    device = session.device
+    device_id = device.get('id')
+    probe = device.get('config_probe_command')
+    state = {}
+
+    def probed(fingerprint):
+        state['fingerprint'] = fingerprint
+        stored = state['stored']
+        if not force and fingerprint is not None and stored is not None \
+                and stored.fingerprint == fingerprint:
+            stored.checked = time.time()
+            d = maybeDeferred(store.put, device_id, stored, False)
+            d.addCallback(lambda ign: ConfigResult(False, False, stored))
+            return d
+        d = session.run_command(device.get('config_command', 'show running-config'))
+        d.addCallback(fetched)
+        return d
+
+    def fetched(config):
+        stored, fingerprint = state['stored'], state['fingerprint']
+        digest = config_digest(config, device.get('config_ignore', default_ignore))
+        if stored is not None and stored.digest == digest:
+            stored.fingerprint = fingerprint
+            stored.checked = time.time()
+            changed = False
+        else:
+            stored = StoredConfig(config, digest, fingerprint)
+            changed = True
+        d = maybeDeferred(store.put, device_id, stored, changed)
+        d.addCallback(lambda ign: ConfigResult(changed, True, stored))
+        return d
+
+    def got_stored(stored):
+        state['stored'] = stored
+        if probe is None:
+            return probed(None)
+        d = session.run_command(probe)
+        d.addCallbacks(probe_output, probe_failed)
+        d.addCallback(probed)
+        return d
+
+    def probe_output(output):
+        output = output.strip()
+        pattern = device.get('config_probe_pattern')
+        if not output or pattern is not None and re.search(pattern, output, re.M) is None:
+            return None
+        return output
+
+    def probe_failed(failure):
+        # The device doesn't know the command, for one
+        failure.trap(CiscoCommandError)
+        return None
+
+    d = maybeDeferred(store.get, device_id)
+    d.addCallback(got_stored)
+    return d
+
+
+def config_job(store, force=False, enable=True, exit=True):
+    """Build a job (see L{FleetRunner<texpect_cisco.fleet.FleetRunner>}), that
+    collects the configurations, that have changed.
+
+    @param store: Where the configurations are kept
+    @type store: L{ConfigStore}
+
+    @return: A callable, that takes a connected L{Cisco<texpect_cisco.cisco.Cisco>}
+    instance and returns a L{Deferred}, that fires with a L{ConfigResult}
+    @rtype: C{callable}
+
+    """
+    def job(inst):
+        result = []
+        d = inst.bring_up(enable)
+        d.addCallback(lambda ign: collect_config(inst, store, force))
+        d.addCallback(result.append)
+        if exit:
+            d.addCallback(lambda ign: inst.exit())
+        d.addCallback(lambda ign: result[0])
+        return d
+    return job
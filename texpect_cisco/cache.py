@@ -0,0 +1,163 @@
+'''
+@author: shylent
+'''
+import re
+from collections import OrderedDict
+from twisted.python.failure import Failure
+from twisted.internet.defer import Deferred, maybeDeferred, succeed
+
+
+# Only the 'show' commands are cached by default
+default_ttls = (
+    (r'^sh(o(w)?)?\s', 30),
+)
+
+
+class ResultCache(object):
+    """Caches the results of read-only commands, keyed by the device id, the
+    command (with the whitespace normalized) and the keyword arguments of the
+    fetch (C{as_output}, C{strip_prompt} and such change the result), for a
+    time, that depends on the command. The least recently used results are evicted, when there are more
+    than L{max_entries} of them.
+
+    Concurrent requests for the same result, that is not cached yet, share a
+    single request to the device: only the first one calls the fetch function,
+    the others wait for its result. Failures are never cached.
+
+    The same result object is handed to every caller, so it should not be
+    modified (which is not a concern for the strings and
+    L{CommandOutput<texpect_cisco.output.CommandOutput>}s).
+
+    @ivar hits: Number of requests, that were served from the cache
+    @type hits: C{int}
+
+    @ivar misses: Number of requests, that resulted in a fetch
+    @type misses: C{int}
+
+    @ivar shared: Number of requests, that waited for a fetch, that was already
+    in progress
+    @type shared: C{int}
+
+    """
+
+    def __init__(self, ttls=default_ttls, max_entries=10000, clock=None):
+        """
+        @param ttls: C{(expression, seconds)} pairs. The TTL of a command is the
+        one of the first expression, that matches it. The commands, that don't
+        match any, are not cached (nor are the concurrent requests for them
+        shared). Default: L{default_ttls}
+        @type ttls: C{iterable}
+
+        @param max_entries: The maximum number of cached results. Default: 10000
+        @type max_entries: C{int}
+
+        @param clock: An object, providing C{IReactorTime}. Default: the global reactor
+
+        """
+        if clock is None:
+            from twisted.internet import reactor as clock
+        self.ttls = [(re.compile(expression), ttl) for expression, ttl in ttls]
+        self.max_entries = max_entries
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.shared = 0
+        self._entries = OrderedDict()
+        self._in_flight = {}
+
+    def normalize(self, command):
+        """@return: The command with the whitespace normalized
+        @rtype: C{str}"""
+        return ' '.join(command.split())
+
+    def ttl(self, command):
+        """@return: The TTL of the (normalized) command in seconds or C{None} if it
+        is not to be cached
+        @rtype: C{float}"""
+        for expression, ttl in self.ttls:
+            if expression.search(command):
+                return ttl
+        return None
+
+    def get(self, device_id, command, fetch, *args, **kwargs):
+        """Get the result of the command from the cache or call
+        C{fetch(*args, **kwargs)} to get it from the device.
+
+        @param fetch: A callable, that returns a L{Deferred}, that fires with the
+        result of the command. The results of the calls with different keyword
+        arguments are cached separately, the positional arguments are assumed
+        not to change the result.
+
+        @return: A L{Deferred}, that fires with the result
+        @rtype: L{Deferred}
+
+        """
+        command = self.normalize(command)
+        ttl = self.ttl(command)
+        key = (device_id, command, tuple(sorted(kwargs.items())))
+        try:
+            hash(key)
+        except TypeError:
+            # Can't tell the keyword arguments apart, so don't cache
+            ttl = None
+        if not ttl:
+            return maybeDeferred(fetch, *args, **kwargs)
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires, result = entry
+            if expires > self.clock.seconds():
+                # Mark as the most recently used
+                del self._entries[key]
+                self._entries[key] = entry
+                self.hits += 1
+                return succeed(result)
+            del self._entries[key]
+        waiters = self._in_flight.get(key)
+        if waiters is not None:
+            self.shared += 1
+            d = Deferred()
+            waiters.append(d)
+            return d
+        self.misses += 1
+        waiters = self._in_flight[key] = []
+        d = maybeDeferred(fetch, *args, **kwargs)
+        d.addBoth(self._fetched, key, ttl, waiters)
+        return d
+
+    def _fetched(self, res, key, ttl, waiters):
+        if self._in_flight.get(key) is waiters:
+            del self._in_flight[key]
+            # Unless it has been invalidated while being fetched
+            if not isinstance(res, Failure):
+                self._entries[key] = (self.clock.seconds() + ttl, res)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        for waiter in waiters:
+            waiter.callback(res)
+        return res
+
+    def run_command(self, session, command, **kwargs):
+        """Run the command in the session (see
+        L{run_command<texpect_cisco.cisco.Cisco.run_command>}), unless its result
+        for the device is cached.
+
+        @rtype: L{Deferred}
+
+        """
+        return self.get(session.device.get('id'), command,
+                        session.run_command, command, **kwargs)
+
+    def invalidate(self, device_id, command=None):
+        """Drop the cached results for the device (after its configuration has
+        been changed, for example), or only the result of the command.
+
+        """
+        if command is not None:
+            command = self.normalize(command)
+        def matches(key):
+            return key[0] == device_id and (command is None or key[1] == command)
+        keys = [key for key in self._entries if matches(key)]
+        keys.extend([key for key in self._in_flight if matches(key)])
+        for key in keys:
+            self._entries.pop(key, None)
+            self._in_flight.pop(key, None)
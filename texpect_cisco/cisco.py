@@ -1,11 +1,18 @@
 '''
 @author: shylent
 '''
+import re
+import struct
 from twisted.python.failure import Failure
 from twisted.python import log
-from twisted.internet.defer import fail
+from twisted.internet.defer import Deferred, fail, succeed, maybeDeferred
+from twisted.internet.error import ConnectionDone
 from texpect import TExpect, RequestFailed, RequestTimeout,\
     RequestInterruptedByConnectionLoss
+from texpect_cisco.compat import string_types, native, to_bytes, monotonic
+from texpect_cisco.errors import get_error_scanner
+from texpect_cisco.output import CommandOutput, strip_span
+from texpect_cisco.transcript import RECEIVED, SENT, MASKED
 
 class Device(dict):
     """A mapping, that represents a 'device'.
@@ -14,6 +21,18 @@ class Device(dict):
         - B{address}: domain name or ip address, that can be used to connect to the
         device
         - B{port}: port, to which to connect
+        - B{transport}: C{'telnet'} (the default) or C{'ssh'} (see
+        L{ssh<texpect_cisco.ssh>})
+        - B{window_size}: C{(columns, rows)}, the terminal size, that is advertised
+        to the device during the telnet option negotiation (NAWS), if the device
+        asks for it. Zero rows means no paging, so if the device has accepted
+        it, the 'disable_paging_command' is not run. C{None} refuses to
+        advertise the size
+        - B{ssh_port}: port, to which to connect over SSH (normally 22)
+        - B{username}: the user name, that is used to log in over SSH
+        - B{host_key_fingerprint}: the expected fingerprint of the host key of the
+        device. If not given, any host key is accepted, and a warning with its
+        fingerprint is logged
         - B{connect_timeout}: TCP connection timeout
         - B{command_timeout}: number of seconds to wait for the command to complete,
         before considering it a failure
@@ -33,9 +52,57 @@ class Device(dict):
         paging
         - B{disable_paging_command}: the command, that should be used to disable
         paging on this device
+        - B{speculative_bring_up}: if set, L{bring_up<Cisco.bring_up>} sends the
+        'disable_paging_command' and the 'enable_command' at once, instead of
+        waiting for the prompt after each one of them. Only for the devices, that
+        don't discard the input, that is typed ahead. The password is always
+        sent on its own and nothing is typed ahead until it has been accepted,
+        so that a wrong password can not turn the commands into more login
+        attempts
+        - B{scan_window}: the number of characters at the end of the already
+        scanned data, that are scanned again when more data arrives. Must be larger
+        than the longest prompt (see L{Cisco.expect})
+        - B{error_signatures}: the table of error signatures, that is used to
+        recognize errors in the command output (see
+        L{ErrorScanner<texpect_cisco.errors.ErrorScanner>})
+        - B{error_prefix}: an expression, that matches the beginning of a line
+        with an error message (normally just C{'%'})
+        - B{offload_threshold}: outputs of at least this many characters are
+        processed in a thread pool instead of the reactor thread (see
+        L{Cisco._offload}). Default: C{None} (everything is processed in the
+        reactor thread)
         - B{debug}: whether or not debug mode is enabled. Enabling it should result in
         lots more stuff in the log, also the internal buffer is kept forever so
-        that it is easier to examine the flow of events
+        that it is easier to examine the flow of events. The memory used grows
+        without bound, so don't enable it on a fleet, use the B{recorder} instead
+        - B{pager_prompt}: an expression, that matches the pager marker
+        (C{' --More-- '}) at the end of the received data. Once the pager is on,
+        the 'pager_key' is sent whenever the marker is encountered and the marker
+        (along with the sequence, that the device uses to erase it) is removed
+        from the output, so that the commands complete even if paging could not
+        be disabled. The pager is turned on, when the device rejects the
+        'disable_paging_command'. C{None} disables this.
+        - B{pager}: if set, the pager is on from the start (for the devices,
+        that paging is not disabled on)
+        - B{pager_key}: the key, that is sent to get the next page (normally C{' '})
+        - B{configure_command}: the command, that enters the configuration mode
+        (normally C{'configure terminal'}, see L{push_config<texpect_cisco.push.push_config>})
+        - B{config_command}: the command, that shows the configuration (normally
+        C{'show running-config'}, see L{collect_config<texpect_cisco.backup.collect_config>})
+        - B{config_probe_command}: a cheap command, whose output changes whenever the
+        configuration does. If it has not changed, the configuration is not fetched
+        - B{config_probe_pattern}: an expression, that the output of the
+        'config_probe_command' has to match. Otherwise (and if the output is
+        empty or the command fails) the configuration is fetched
+        - B{config_ignore}: expressions, that match the lines of the configuration,
+        that change on their own (timestamps and the like) and should not be
+        considered a change
+        - B{timeouts}: an L{AdaptiveTimeouts<texpect_cisco.timeouts.AdaptiveTimeouts>}
+        instance, that learns the command durations and sets the timeout of every
+        command from them instead of using the fixed 'command_timeout'
+        - B{recorder}: a L{TranscriptRecorder<texpect_cisco.transcript.TranscriptRecorder>},
+        that keeps a bounded transcript of every session and writes it to disk,
+        so that it can be replayed later (see L{replay<texpect_cisco.transcript.replay>})
         
         @note: Cisco commands that are stored should not include the trailing newline
         (see L{Cisco.run_command})
@@ -56,7 +123,10 @@ device_defaults = Device({
     'command_timeout':3,
     'password_prompt':'[Pp]assword:\s+$',
     'enable_password_prompt':'[Pp]assword:\s+$',
-    'enable_command':'enable'
+    'enable_command':'enable',
+    'pager_prompt':r' ?<?-+ ?More ?-+>? ?$',
+    'pager_key':' ',
+    'window_size':(512, 0)
 })
 
 
@@ -151,6 +221,664 @@ class EnableFailed(TExpectCiscoError):
 class NotConnected(TExpectCiscoError):
     """An attempt was made to run a command, but we are not connected to the device anymore"""
 
+class StreamInProgress(TExpectCiscoError):
+    """An attempt was made to stream a command, while the output of another one
+    is still being streamed"""
+
+
+class _IncrementalPattern(object):
+    """A wrapper around a compiled regular expression, that is searched in a
+    growing buffer. Each search skips the part of the buffer, that has already
+    been searched, save for the last L{window} characters. Everything else is
+    delegated to the wrapped expression.
+    
+    """
+    
+    def __init__(self, pattern, window):
+        if isinstance(pattern, string_types):
+            pattern = re.compile(pattern)
+        self._pattern = pattern
+        self.window = window
+        self._scanned = 0
+    
+    def search(self, string, pos=0, endpos=None):
+        if len(string) >= self._scanned:
+            pos = max(pos, self._scanned - self.window)
+        # Otherwise it is not the same buffer anymore
+        self._scanned = len(string)
+        if endpos is None:
+            return self._pattern.search(string, pos)
+        return self._pattern.search(string, pos, endpos)
+    
+    def __getattr__(self, name):
+        return getattr(self._pattern, name)
+
+
+# Matches at the end of whatever has been received so far
+_END_OF_INPUT = re.compile(r'\Z')
+
+# The end-of-input anchors and the optional whitespace, that the prompts end with
+_ANCHORS = ('$', r'\Z')
+_TRAILING_WHITESPACE = (r'\s*', r'\s+', r'\s?', ' *', ' +', ' ?')
+
+
+def _ends_with(pattern, suffix):
+    """@return: Whether or not the expression ends with the token (that is not
+    itself escaped by a backslash, as in C{'\\$'})
+    @rtype: C{bool}"""
+    if not pattern.endswith(suffix):
+        return False
+    pos = len(pattern) - len(suffix)
+    escapes = len(pattern[:pos]) - len(pattern[:pos].rstrip('\\'))
+    return escapes % 2 == 0
+
+
+class _OutputStream(object):
+    """The state of a command, whose output is being streamed to a consumer
+    (see L{Cisco.stream_command}).
+    
+    Only the last L{window} characters of the output are held back, so that the
+    prompt can still be detected. Everything before that is handed to the consumer
+    as soon as it arrives. The beginning of the output is held back until the
+    command echo and the line after it have been received completely (see
+    L{_head}), so that the echo can be stripped and the error message, that the
+    device prints right after it, can be found, but no longer than until more
+    than L{window} characters have been received: a huge first line is streamed
+    like the rest of the output.
+    
+    @ivar deferred: The L{Deferred}, that is fired when the prompt is encountered
+    @type deferred: L{Deferred}
+    
+    @ivar delivered: Number of characters handed to the consumer so far
+    @type delivered: C{int}
+    
+    """
+    
+    def __init__(self, session, command, prompt, consumer, timeout, window,
+                 lines, strip_command, process_errors):
+        self.session = session
+        self.command = command
+        if isinstance(prompt, string_types):
+            prompt = re.compile(prompt)
+        self.prompt = prompt
+        self.consumer = consumer
+        self.timeout = timeout
+        self.window = window
+        self.lines = lines
+        self.strip_command = strip_command
+        self.process_errors = process_errors
+        self.deferred = Deferred()
+        self.delivered = 0
+        self._buf = ''
+        self._started = False
+        # The state of the scan for the end of the head (see _head)
+        self._scanned = None
+        self._head_lines = 0
+        self._head_wanted = 2
+        self._paused = False
+        self._finished = False
+        self._timeout_call = None
+        self._reset_timeout()
+    
+    def feed(self, data):
+        """Handle a chunk of data, received from the device."""
+        self._buf += data
+        if not self._paused:
+            self._reset_timeout()
+            self._process()
+    
+    def fail(self, exc):
+        """Abort the stream."""
+        if self._finished:
+            return
+        self._finish()
+        self.deferred.errback(Failure(exc))
+    
+    def _process(self):
+        buf = self._buf
+        match_obj = self.prompt.search(buf, max(0, len(buf) - self.window))
+        if match_obj is not None:
+            self._buf = buf[match_obj.end():]
+            self._deliver(buf[:match_obj.start()], final=True)
+            return
+        release = len(buf) - self.window
+        if not self._started:
+            head = self._head(buf)
+            if head is not None:
+                # The head ends with a line break, so the prompt can't be split
+                release = max(release, head)
+            elif release <= 0:
+                return
+        if self.lines:
+            release = buf.rfind('\n', 0, release) + 1
+        if release > 0:
+            self._buf = buf[release:]
+            self._deliver(buf[:release], final=False)
+    
+    def _head(self, buf):
+        """Nothing is released before the head, so the buffer only grows and the
+        scan goes on from where it has stopped the last time.
+        
+        @return: The offset just past the command echo and the line after it
+        (and the line after that, if it is the C{'^'} marker, that the error
+        message follows) or C{None}, if they haven't been received yet
+        @rtype: C{int}"""
+        if self._scanned is None:
+            stripped = buf.lstrip()
+            if not stripped:
+                return None
+            self._scanned = len(buf) - len(stripped)
+        while self._head_lines < self._head_wanted:
+            end = buf.find('\n', self._scanned)
+            if end == -1:
+                return None
+            if self._head_lines == 1 and buf[self._scanned:end].strip() == '^':
+                self._head_wanted = 3
+            self._scanned = end + 1
+            self._head_lines += 1
+        return self._scanned
+    
+    def _deliver(self, chunk, final):
+        if not self._started:
+            self._started = True
+            chunk = chunk.lstrip()
+            if self.strip_command and chunk.startswith(self.command):
+                chunk = chunk[len(self.command):].lstrip()
+            if self.process_errors:
+                error = self.session.error_scanner.scan(chunk)
+                if error is not None:
+                    self.fail(CiscoCommandError(
+                        'An error was reported by the device "%s" while running the command "%s"' %
+                            (self.session.device['id'], self.command),
+                        command=self.command,
+                        error=error.text(),
+                        data=chunk))
+                    return
+        if final:
+            chunk = chunk.rstrip()
+        res = None
+        if chunk:
+            self.delivered += len(chunk)
+            if self.lines:
+                chunk = chunk.splitlines()
+            try:
+                res = self.consumer(chunk)
+            except Exception as e:
+                self.fail(e)
+                return
+        if isinstance(res, Deferred) and not res.called:
+            self._pause()
+            res.addBoth(self._resume, final)
+        elif final:
+            self._complete()
+    
+    def _pause(self):
+        """The consumer is not ready for more data, stop reading from the device."""
+        self._paused = True
+        self._cancel_timeout()
+        self.session.transport.pauseProducing()
+    
+    def _resume(self, res, final):
+        if isinstance(res, Failure):
+            self.fail(res.value)
+            return
+        if self._finished:
+            return
+        self._paused = False
+        self.session.transport.resumeProducing()
+        if final:
+            self._complete()
+        else:
+            self._reset_timeout()
+            self._process()
+    
+    def _complete(self):
+        leftover = self._buf
+        self._finish()
+        if leftover:
+            TExpect.dataReceived(self.session, leftover)
+        self.deferred.callback(self.delivered)
+    
+    def _finish(self):
+        self._finished = True
+        self._cancel_timeout()
+        self._buf = ''
+        if self._paused:
+            self._paused = False
+            if not self.session.eof:
+                self.session.transport.resumeProducing()
+        self.session._stream = None
+    
+    def _reset_timeout(self):
+        self._cancel_timeout()
+        if self.timeout:
+            from twisted.internet import reactor
+            self._timeout_call = reactor.callLater(self.timeout, self._timed_out)
+    
+    def _cancel_timeout(self):
+        if self._timeout_call is not None and self._timeout_call.active():
+            self._timeout_call.cancel()
+        self._timeout_call = None
+    
+    def _timed_out(self):
+        self._timeout_call = None
+        self.fail(UnexpectedResultError(
+            "Error running command '%s'. Expected: %s, got no data for %s seconds" %
+             (self.command, self.prompt.pattern, self.timeout), command=self.command,
+             data=self._buf))
+
+
+IAC = '\xff'
+DONT = '\xfe'
+DO = '\xfd'
+WONT = '\xfc'
+WILL = '\xfb'
+SB = '\xfa'
+SE = '\xf0'
+ECHO = '\x01'
+SGA = '\x03'
+NAWS = '\x1f'
+
+
+class _Telnet(object):
+    """Handles the telnet option negotiation and removes the telnet commands from
+    the data, received from the device, before anything else looks at it.
+    
+    The device may echo and suppress go-ahead (that is what it normally wants
+    to do), the window size (NAWS) is advertised, if the device asks for it,
+    every other option is refused.
+    
+    @ivar naws_sent: Whether or not the window size has been sent to the device
+    @type naws_sent: C{bool}
+    
+    """
+    
+    def __init__(self, session, window_size):
+        self.session = session
+        self.window_size = window_size
+        self.naws_sent = False
+        self._local = set()
+        self._remote = set()
+        self._pending = ''
+        self._sb = None
+    
+    @property
+    def paging_disabled(self):
+        """Whether or not the device has been told, that the terminal has no
+        rows limit"""
+        return self.naws_sent and not self.window_size[1]
+    
+    def filter(self, data):
+        """@return: The data without the telnet commands
+        @rtype: C{str}"""
+        if self._pending:
+            data, self._pending = self._pending + data, ''
+        if self._sb is None and IAC not in data:
+            return data
+        out = []
+        pos = 0
+        while pos < len(data):
+            if self._sb is not None:
+                end = data.find(IAC + SE, pos)
+                if end == -1:
+                    # Keep a trailing IAC, it may be the start of IAC SE
+                    keep = data.endswith(IAC) and 1 or 0
+                    self._sb += data[pos:len(data) - keep]
+                    self._pending = data[len(data) - keep:]
+                    break
+                self._sb += data[pos:end]
+                self._sb = None
+                pos = end + 2
+                continue
+            ind = data.find(IAC, pos)
+            if ind == -1:
+                out.append(data[pos:])
+                break
+            out.append(data[pos:ind])
+            command = data[ind + 1:ind + 2]
+            if not command or (command in (DO, DONT, WILL, WONT) and ind + 2 >= len(data)):
+                # Incomplete, wait for the rest of it
+                self._pending = data[ind:]
+                break
+            if command == IAC:
+                out.append(IAC)
+                pos = ind + 2
+            elif command in (DO, DONT, WILL, WONT):
+                self._negotiate(command, data[ind + 2])
+                pos = ind + 3
+            elif command == SB:
+                self._sb = ''
+                pos = ind + 2
+            else:
+                pos = ind + 2
+        return ''.join(out)
+    
+    def _send(self, data):
+        if self.session.transcript is not None:
+            self.session.transcript.record(SENT, data)
+        self.session.transport.write(to_bytes(data))
+    
+    def _negotiate(self, command, option):
+        if command == DO:
+            if option == NAWS and self.window_size is not None:
+                if option not in self._local:
+                    self._local.add(option)
+                    self._send(IAC + WILL + NAWS)
+                self._send_window_size()
+            elif option not in self._local:
+                self._send(IAC + WONT + option)
+        elif command == DONT:
+            if option in self._local:
+                self._local.discard(option)
+                self._send(IAC + WONT + option)
+        elif command == WILL:
+            if option in (ECHO, SGA):
+                if option not in self._remote:
+                    self._remote.add(option)
+                    self._send(IAC + DO + option)
+            else:
+                self._send(IAC + DONT + option)
+        elif command == WONT:
+            if option in self._remote:
+                self._remote.discard(option)
+                self._send(IAC + DONT + option)
+    
+    def _send_window_size(self):
+        columns, rows = self.window_size
+        size = native(struct.pack('>HH', columns, rows)).replace(IAC, IAC + IAC)
+        self._send(IAC + SB + NAWS + size + IAC + SE)
+        self.naws_sent = True
+
+
+class _Pager(object):
+    """Removes the pager markers from the data, received from the device, and
+    sends the continuation key, when one is encountered.
+    
+    The device stops sending after the marker, so the marker is always at the end
+    of the data received so far, possibly split between the chunks. So the end of
+    the last line (no more than L{window} characters) is held back until more
+    data arrives, unless it is what the session is waiting for (the prompt,
+    normally). After the key is sent, the device erases the marker (backspaces,
+    spaces, backspaces or C{'\\r'}, spaces, C{'\\r'}), this sequence is removed
+    from the beginning of the next chunks.
+    
+    """
+    
+    window = 64
+    
+    def __init__(self, session, pattern, key):
+        self.session = session
+        if isinstance(pattern, string_types):
+            pattern = re.compile(pattern)
+        self.pattern = pattern
+        self.key = key
+        self._held = ''
+        self._erase = None
+    
+    def filter(self, data):
+        """@return: The data without the pager markers and the erase sequences,
+        and without the end, that is held back
+        @rtype: C{str}"""
+        if self._erase is not None:
+            data = self._strip_erase(self._erase + data)
+            if not data:
+                return ''
+        data, self._held = self._held + data, ''
+        tail = data[-self.window:]
+        match_obj = self.pattern.search(tail)
+        if match_obj is None or match_obj.end() != len(tail) or \
+                match_obj.start() == match_obj.end():
+            held = tail[tail.rfind('\n') + 1:]
+            if held and not self.session._awaited(held):
+                self._held = held
+                data = data[:-len(held)]
+            return data
+        data = data[:len(data) - len(tail) + match_obj.start()]
+        self._erase = ''
+        if self.session.metrics is not None:
+            self.session.metrics.count(self.session.device.get('id'), 'pages')
+        self.session.write(self.key)
+        return data
+    
+    def release(self):
+        """Hand the data, that is held back, over to the session, if it is what
+        the session has started waiting for."""
+        if self._held and self.session._awaited(self._held):
+            held, self._held = self._held, ''
+            self.session._feed(held)
+    
+    def _strip_erase(self, data):
+        """Remove the erase sequence from the beginning of the data. If the data
+        could be an incomplete erase sequence, it is held back (until the next
+        chunk) and an empty string is returned.
+        
+        """
+        if data.startswith('\x08'):
+            count = len(data) - len(data.lstrip('\x08'))
+            spaces = min(count, len(data) - count - len(data[count:].lstrip(' ')))
+            end = count + spaces
+            backspaces = min(count, len(data) - end - len(data[end:].lstrip('\x08')))
+            end += backspaces
+            complete = backspaces == count or end < len(data)
+        elif data.startswith('\r'):
+            end = len(data) - len(data[1:].lstrip(' '))
+            if data[end:end + 1] == '\r':
+                end += 1
+                complete = True
+            else:
+                complete = end < len(data)
+                if complete:
+                    # Not an erase sequence after all, keep the indentation
+                    end = 0
+        else:
+            end, complete = 0, True
+        if not complete:
+            self._erase = data
+            return ''
+        self._erase = None
+        return data[end:]
+
+
+class _Watchdog(object):
+    """Closes the session, if it has not received anything for a whole
+    L{period} while a command is running. As long as the output keeps
+    arriving, the deadline is extended by another period.
+    
+    @ivar expired: Whether or not the session has been closed by the watchdog
+    @type expired: C{bool}
+    
+    """
+    
+    def __init__(self, session, command, period, clock):
+        self.session = session
+        self.command = command
+        self.period = period
+        self.clock = clock
+        self.expired = False
+        self._received = session._received
+        self._call = clock.callLater(period, self._check)
+    
+    def _check(self):
+        if self.session._received != self._received:
+            self._received = self.session._received
+            self._call = self.clock.callLater(self.period, self._check)
+            return
+        self._call = None
+        self.expired = True
+        self.session._failed = True
+        if self.session.debug:
+            log.msg("No data from %s for %s seconds while running '%s', disconnecting" %
+                    (self.session.device['id'], self.period, self.command))
+        self.session.transport.loseConnection()
+    
+    def stop(self, res):
+        """Stop watching. Used as a callback, passes the result through, unless
+        it is the connection loss, caused by the watchdog.
+        
+        """
+        if self._call is not None and self._call.active():
+            self._call.cancel()
+        self._call = None
+        if self.expired and isinstance(res, Failure):
+            return Failure(UnexpectedResultError(
+                "Error running command '%s'. Got no data for %s seconds" %
+                (self.command, self.period), command=self.command))
+        return res
+
+
+class _BringUp(object):
+    """Logs in, disables paging and enters privileged EXEC mode, sending the
+    commands at once. The password is sent on its own first: until it has been
+    accepted, whatever is typed ahead could be taken for more login attempts
+    (and lock the account out). The prompts, that follow the commands, are then
+    matched against the expected sequence: the echo of every command, then the
+    enable password prompt (or just the prompt, if privileged EXEC mode is not
+    entered).
+    
+    If the expected prompt does not show up in time (the device has discarded
+    the commands, that were typed ahead, for example), but the device is at the
+    prompt, the rest is done the usual way, one step at a time.
+    
+    """
+    
+    def __init__(self, session, enable, timeout):
+        self.session = session
+        self.enable = enable
+        self.timeout = timeout
+        self.commands = []
+        self.started = monotonic()
+    
+    def run(self):
+        session = self.session
+        if session.device.get('transport') == 'ssh':
+            # The transport has already authenticated the session
+            d = session.expect([session.device['prompt']], timeout=self.timeout)
+            d.addCallbacks(callback=self._logged_in, errback=session._on_login_failure)
+        else:
+            d = session.read_until(session.device['password_prompt'])
+            d.addBoth(lambda res: session._record('password_prompt', self.started, res))
+            d.addCallbacks(callback=self._password, errback=session._no_password_prompt)
+        return d
+    
+    def _password(self, ign):
+        """Send the password and wait until it is accepted (the prompt) or
+        rejected (the password prompt again)."""
+        session = self.session
+        device = session.device
+        d = session.write(device['password'] + '\n', True)
+        d.addCallback(lambda ign: session.expect([device['prompt'], device['password_prompt']],
+                                                 timeout=self.timeout))
+        d.addCallbacks(callback=self._logged_in, errback=session._on_login_failure)
+        return d
+    
+    def _logged_in(self, res):
+        session = self.session
+        if res[0] == 1:
+            session._failed = True
+            return Failure(LoginFailed('Failed to log in to %s' % session.device['id'],
+                                       data=res[2]))
+        session._record('login', self.started)
+        if session.debug:
+            log.msg("Logged in to %s" % session.device['id'])
+        return self._send(None)
+    
+    def _send(self, ign):
+        session = self.session
+        device = session.device
+        # Known by now, since the device negotiates before asking for the password
+        if device.get('disable_paging') and not (session._telnet is not None and
+                                                 session._telnet.paging_disabled):
+            self.commands.append(device['disable_paging_command'])
+        if self.enable:
+            self.commands.append(device['enable_command'])
+        if not self.commands:
+            return succeed(None)
+        if session.debug:
+            log.msg("Bringing up the session to %s speculatively" % device['id'])
+        d = session.write(''.join([command + '\n' for command in self.commands]))
+        d.addCallback(self._expect, 1)
+        return d
+    
+    def _expect(self, ign, ind):
+        """Wait for the prompt, that follows the command with the index
+        C{ind - 1}: the one, that precedes the echo of the next command (or the
+        last prompt, if there are no more commands)."""
+        device = self.session.device
+        if ind < len(self.commands):
+            expecting = [self.session._pipeline_pattern(device['prompt'],
+                                                        self.commands[ind])]
+        elif self.enable:
+            expecting = [device['enable_password_prompt'], device['prompt']]
+        else:
+            expecting = [device['prompt']]
+        d = self.session.expect(expecting, timeout=self.timeout)
+        d.addCallbacks(callback=self._got, callbackArgs=[ind],
+                       errback=self._fall_back, errbackArgs=[ind])
+        return d
+    
+    def _got(self, res, ind):
+        session = self.session
+        # The output of the previous command
+        command = self.commands[ind - 1]
+        if self.enable and ind == len(self.commands):
+            # That was the enable command
+            if res[0] != 0:
+                return self._step_by_step(False)
+            return self._enable_password()
+        d = succeed(res)
+        d.addCallback(session._on_command_result, command, True, True, True)
+        d.addBoth(lambda res: session._record('disable_paging', self.started, res))
+        d.addErrback(session._on_disable_paging_failure)
+        if ind < len(self.commands):
+            d.addCallback(self._expect, ind + 1)
+        return d
+    
+    def _enable_password(self):
+        session = self.session
+        started = monotonic()
+        d = session.write(session.device['enable_password'] + '\n', True)
+        d.addCallback(lambda ign: session.read_to_prompt(session.device['enabled_prompt'],
+                                                         self.timeout))
+        d.addCallbacks(callback=session._on_enable, errback=session._on_enable_failure)
+        d.addBoth(lambda res: session._record('enable', started, res))
+        return d
+    
+    def _fall_back(self, failure, ind):
+        """The expected prompt did not show up in time. If the device is at the
+        prompt, go on one step at a time, otherwise fail the same way, the
+        step that was waited for would have."""
+        session = self.session
+        data = failure.check(RequestTimeout) and failure.value.data or ''
+        # Nothing at all after the prompt, that the password was accepted with
+        at_prompt = ind == 1 and not data.strip()
+        if not failure.check(RequestTimeout) or \
+                not at_prompt and re.search(session.device['prompt'], data) is None:
+            if self.enable and ind == len(self.commands):
+                return session._on_enable_failure(failure)
+            return session._on_command_error(failure, self.commands[ind - 1],
+                                             True, True, True, False)
+        if session.debug:
+            log.msg("The speculative bring-up of %s has failed, going step by step" %
+                    session.device['id'])
+        if session.metrics is not None:
+            session.metrics.count(session.device.get('id'), 'bring_up_fallback')
+        # Whatever was left of the sequence is of no interest anymore
+        d = session._discard_input()
+        d.addCallback(lambda ign: self._step_by_step(True))
+        return d
+    
+    def _step_by_step(self, disable_paging):
+        """Do the rest of the bring-up the usual way. Disabling paging is
+        repeated, if it is not known to have been done."""
+        session = self.session
+        if disable_paging:
+            d = maybeDeferred(session._on_login_success, None)
+        else:
+            d = succeed(None)
+        if self.enable:
+            d.addCallback(lambda ign: session.enable(self.timeout))
+        return d
+
 
 class Cisco(TExpect):
     """
@@ -162,9 +890,40 @@ class Cisco(TExpect):
     @ivar enabled: Whether or not we are in privileged EXEC mode at the moment
     @type enabled: C{bool}
     
+    @ivar scan_window: Number of already scanned characters, that are scanned again
+    when more data arrives (see L{expect})
+    @type scan_window: C{int}
+    
+    @ivar error_scanner: The scanner, that is used to find the errors in the
+    command output
+    @type error_scanner: L{ErrorScanner<texpect_cisco.errors.ErrorScanner>}
+    
+    @ivar offload_threshold: Outputs of at least this many characters are
+    processed in L{threadpool}. C{None} disables offloading.
+    @type offload_threshold: C{int}
+    
+    @ivar threadpool: The thread pool, that is used for the offloaded processing.
+    C{None} means the reactor's thread pool.
+    @type threadpool: L{ThreadPool<twisted.python.threadpool.ThreadPool>}
+    
+    @ivar metrics: The collector of the timings of the session phases, or C{None}
+    @type metrics: L{Metrics<texpect_cisco.metrics.Metrics>}
+    
+    @ivar timeouts: The source of the learned command timeouts, or C{None}
+    @type timeouts: L{AdaptiveTimeouts<texpect_cisco.timeouts.AdaptiveTimeouts>}
+    
+    @ivar transcript: The transcript of the session, or C{None} if it is not
+    being recorded
+    @type transcript: L{Transcript<texpect_cisco.transcript.Transcript>}
+    
     """
     
-    def __init__(self, device, command_timeout=None, debug=False):
+    scan_window = 512
+    offload_threshold = None
+    threadpool = None
+    
+    def __init__(self, device, command_timeout=None, debug=False, metrics=None,
+                 recorder=None, timeouts=None):
         """
         
         @param device: A L{Device} instance, that will be used for this session
@@ -177,10 +936,44 @@ class Cisco(TExpect):
         @param debug: Override the 'debug' value provided in the C{Device} instance.
         Default: C{False}
         @type debug: C{bool}
+        
+        @param metrics: The collector of the timings. Default: C{None}, no timings
+        are collected.
+        @type metrics: L{Metrics<texpect_cisco.metrics.Metrics>}
+        
+        @param recorder: Override the 'recorder' value provided in the C{Device}
+        instance. Default: C{None}, the session is not recorded.
+        @type recorder: L{TranscriptRecorder<texpect_cisco.transcript.TranscriptRecorder>}
+        
+        @param timeouts: Override the 'timeouts' value provided in the C{Device}
+        instance. Default: C{None}, the fixed 'command_timeout' is used.
+        @type timeouts: L{AdaptiveTimeouts<texpect_cisco.timeouts.AdaptiveTimeouts>}
             
         """
         self.device = device
         self.enabled = False
+        self.metrics = metrics
+        self.recorder = recorder if recorder is not None else device.get('recorder')
+        self.transcript = None
+        self.timeouts = timeouts if timeouts is not None else device.get('timeouts')
+        self._received = 0
+        self._failed = False
+        if self.recorder is not None:
+            self.transcript = self.recorder.start(device.get('id'))
+        self._first_byte_pending = None
+        self._stream = None
+        self._expecting = None
+        self.scan_window = self.device.get('scan_window', self.scan_window)
+        self.offload_threshold = self.device.get('offload_threshold',
+                                                 self.offload_threshold)
+        self.error_scanner = get_error_scanner(self.device.get('error_signatures'),
+                                               self.device.get('error_prefix'))
+        self._telnet = None
+        if self.device.get('transport', 'telnet') == 'telnet':
+            self._telnet = _Telnet(self, self.device.get('window_size', (512, 0)))
+        self._pager = None
+        if self.device.get('pager'):
+            self._start_pager()
         self.debug = self.device.get('debug', debug)
         if command_timeout is not None:
             timeout = command_timeout
@@ -194,6 +987,187 @@ class Cisco(TExpect):
         
         """
         
+    def dataReceived(self, data):
+        """Hand the data to the output stream, if a command is being streamed
+        (see L{stream_command}), or to L{TExpect<texpect.TExpect>} otherwise.
+        The telnet commands and the pager markers are removed (and answered) first.
+        
+        """
+        data = native(data)
+        self._received += len(data)
+        if self.transcript is not None:
+            self.transcript.record(RECEIVED, data)
+        if self.metrics is not None:
+            self.metrics.count(self.device.get('id'), 'bytes_received', len(data))
+        if self._telnet is not None:
+            data = self._telnet.filter(data)
+            if not data:
+                return
+        if self._first_byte_pending is not None:
+            self._first_byte(data)
+        if self._pager is not None:
+            data = self._pager.filter(data)
+            if not data:
+                return
+        self._feed(data)
+    
+    def _feed(self, data):
+        if self._stream is not None:
+            self._stream.feed(data)
+        else:
+            TExpect.dataReceived(self, data)
+    
+    def write(self, data, password=False):
+        """Record the data in the L{transcript} (if there is one) and send it.
+        
+        @param password: If C{True}, the first line of the data is a password,
+        it is recorded as L{MASKED<texpect_cisco.transcript.MASKED>}. Default: C{False}
+        @type password: C{bool}
+        
+        """
+        if self._telnet is not None and IAC in data:
+            data = data.replace(IAC, IAC + IAC)
+        if self.transcript is not None:
+            if password:
+                _, sep, rest = data.partition('\n')
+                self.transcript.record(SENT, MASKED + sep + rest)
+            else:
+                self.transcript.record(SENT, data)
+        return TExpect.write(self, to_bytes(data))
+    
+    def _learn(self, res, command, started):
+        """Let L{timeouts} know how long the command took. Used as a callback,
+        passes the result through.
+        
+        """
+        self.timeouts.observe(self.device.get('id'), command,
+                              self.timeouts.clock.seconds() - started)
+        return res
+    
+    def _first_byte(self, data):
+        """Record the 'first_byte' phase, when the first character after the
+        echo of the command (that is, the end of the line, that contains it) is
+        received.
+        
+        """
+        started, echoed = self._first_byte_pending
+        if not echoed:
+            end = data.find('\n')
+            if end == -1:
+                return
+            data = data[end + 1:]
+            self._first_byte_pending = (started, True)
+        if data:
+            self._first_byte_pending = None
+            self._record('first_byte', started)
+    
+    def _command_done(self, res, started):
+        """Record the 'command' phase. A command, that has completed without
+        any output after its echo, has no 'first_byte' phase.
+        
+        @return: L{res}
+        
+        """
+        self._first_byte_pending = None
+        return self._record('command', started, res)
+    
+    def _record(self, phase, started, res=None):
+        """Record the duration of the phase in L{metrics} (if there is a collector).
+        
+        @param phase: The name of the phase
+        @type phase: C{str}
+        
+        @param started: The time the phase has started
+        @type started: C{float}
+        
+        @param res: Result of the previous callback, passed through, so that this
+        can be used as a callback. If it is a L{Failure}, the duration is not
+        recorded, the '<phase>_failed' counter is incremented instead.
+        
+        @return: L{res}
+        
+        """
+        if self.metrics is not None:
+            if isinstance(res, Failure):
+                self.metrics.count(self.device.get('id'), '%s_failed' % phase)
+            else:
+                self.metrics.record(self.device.get('id'), phase, monotonic() - started)
+        return res
+    
+    def connectionLost(self, reason):
+        """Abort the output stream, if there is one, then let L{TExpect<texpect.TExpect>}
+        handle the connection loss. The L{transcript} is handed to the recorder.
+        
+        """
+        if self._stream is not None:
+            self._failed = True
+            self._stream.fail(Disconnected('Command resulted in a disconnection',
+                                           self._stream.command))
+        TExpect.connectionLost(self, reason)
+        if self.transcript is not None:
+            self.recorder.finish(self.transcript, failed=self._failed or
+                                 reason.check(ConnectionDone) is None)
+            self.transcript = None
+    
+    def expect(self, patterns, timeout=None):
+        """Wait for one of the patterns to show up in the data, received from
+        the device (see L{TExpect.expect<texpect.TExpect.expect>}).
+        
+        Every time more data arrives, the patterns are only searched in the new
+        data and the last L{scan_window} characters before it. The prompt can only
+        appear at the very end of the output (and, anyway, it is much shorter
+        than the window), so this finds the same match as searching the whole
+        data, but the cost of waiting for a prompt stays linear in the size of
+        the output.
+        
+        """
+        patterns = [re.compile(pattern) if isinstance(pattern, string_types) else pattern
+                    for pattern in patterns]
+        self._expecting = patterns
+        if self._pager is not None:
+            self._pager.release()
+        d = TExpect.expect(self,
+                [_IncrementalPattern(pattern, self.scan_window) for pattern in patterns],
+                timeout)
+        def done(res):
+            if self._expecting is patterns:
+                self._expecting = None
+            return res
+        d.addBoth(done)
+        return d
+    
+    def read_until(self, pattern, timeout=None):
+        """Wait for the pattern to show up in the data, received from the device
+        (see L{expect}).
+        
+        @return: A L{Deferred}, that will be fired with the data up to and
+        including the pattern
+        @rtype: L{Deferred}
+        
+        """
+        d = self.expect([pattern], timeout)
+        d.addCallback(lambda res: res[2])
+        return d
+    
+    def _awaited(self, data):
+        """@return: Whether the data matches the prompt of the command, that is
+        being streamed, or one of the patterns, that are expected at the moment
+        @rtype: C{bool}"""
+        if self._stream is not None:
+            patterns = [self._stream.prompt]
+        else:
+            patterns = self._expecting or ()
+        for pattern in patterns:
+            if pattern.search(data) is not None:
+                return True
+        return False
+    
+    def _discard_input(self):
+        """Throw away the data, that has been received, but not read yet.
+        
+        @rtype: L{Deferred}"""
+        return self.read_until(_END_OF_INPUT)
+    
     def read_to_prompt(self, prompt=None, timeout=None):
         """Read all data up to and including the prompt. The prompt, that is used
         depends on whether or not the prompt argument is provided and on the mode
@@ -229,7 +1203,8 @@ class Cisco(TExpect):
         """Attempt to log in using the information in L{device} dictionary.
         
         Requires the C{'password'} and C{'password_prompt'} keys to be populated
-        in the L{device} dictionary.
+        in the L{device} dictionary. Over SSH the transport has already
+        authenticated the session, so only the prompt is waited for.
         
         @return: A L{Deferred}, that is fired when (if) the login succeeds. Callback
         argument is meaningless and should be ignored. Possible errback argument types:
@@ -239,11 +1214,46 @@ class Cisco(TExpect):
         @rtype: L{Deferred}
         
         """
-        d = self.read_until(self.device['password_prompt'])
-        d.addCallbacks(callback=lambda ign: self.write(self.device['password']+'\n'),
-                       errback=self._no_password_prompt)
-        d.addCallback(lambda ign: self.read_to_prompt())
+        started = monotonic()
+        if self.device.get('transport') == 'ssh':
+            d = self.read_to_prompt()
+        else:
+            d = self.read_until(self.device['password_prompt'])
+            d.addBoth(lambda res: self._record('password_prompt', started, res))
+            d.addCallbacks(callback=lambda ign: self.write(self.device['password']+'\n', True),
+                           errback=self._no_password_prompt)
+            d.addCallback(lambda ign: self.read_to_prompt())
         d.addCallbacks(callback=self._on_login_success, errback=self._on_login_failure)
+        d.addBoth(lambda res: self._record('login', started, res))
+        return d
+    
+    def bring_up(self, enable=True, timeout=None):
+        """Log in (see L{login}) and, optionally, enter privileged EXEC mode (see
+        L{enable}). If 'speculative_bring_up' is set in the L{device} dictionary,
+        the 'disable_paging_command' and the 'enable_command' are sent at once, as
+        soon as the password has been accepted, which saves a round trip per step.
+        The prompts, that follow, are checked against the expected sequence, if it
+        differs, but the device is at the prompt, the rest is done one step at a
+        time.
+        
+        @param enable: Whether or not to enter privileged EXEC mode. Default: C{True}
+        @type enable: C{bool}
+        
+        @param timeout: Override the instance-default command timeout. Default: C{None}
+        @type timeout: C{int}
+        
+        @return: A L{Deferred}, that is fired when (if) the session is ready. Errback
+        argument types are the same as for L{login} and L{enable}
+        @rtype: L{Deferred}
+        
+        """
+        if timeout is None:
+            timeout = self.timeout
+        if self.device.get('speculative_bring_up'):
+            return _BringUp(self, enable, timeout).run()
+        d = self.login()
+        if enable:
+            d.addCallback(lambda ign: self.enable(timeout))
         return d
     
     def _no_password_prompt(self, failure):
@@ -268,7 +1278,8 @@ class Cisco(TExpect):
         """Handle successful login. If 'disable_paging' is present in the
         L{device} dictionary, attempt to disable paging on the device using the
         command, specified at the 'disable_paging_command' key of the L{device}
-        dictionary
+        dictionary (unless the device has been told, that the terminal has no
+        rows limit during the telnet option negotiation)
         
         @param res: Result of the callback, meaningless.
         @type res: C{str}
@@ -282,10 +1293,41 @@ class Cisco(TExpect):
         if self.debug:
             log.msg("Logged in to %s" % self.device['id'])
         disable_paging = self.device.get('disable_paging')
+        if self._telnet is not None and self._telnet.paging_disabled:
+            # The window size, that was advertised, has already done that
+            disable_paging = False
         if disable_paging:
-            return self.run_command(self.device['disable_paging_command'])
+            started = monotonic()
+            d = self.run_command(self.device['disable_paging_command'])
+            d.addBoth(lambda res: self._record('disable_paging', started, res))
+            d.addErrback(self._on_disable_paging_failure)
+            return d
         return res
     
+    def _on_disable_paging_failure(self, failure):
+        """Handle the failure of the 'disable_paging_command'. If the device
+        has a 'pager_prompt' (see L{Device}), the device rejecting the command
+        (some AAA command sets don't allow it) is not a reason to fail the login:
+        the pager is turned on instead. Catches L{CiscoCommandError}.
+        
+        """
+        failure.trap(CiscoCommandError)
+        if not self._start_pager():
+            return failure
+        if self.debug:
+            log.msg("Could not disable paging on %s, continuing with the pager" %
+                    self.device['id'])
+    
+    def _start_pager(self):
+        """Start answering the pager markers (see 'pager_prompt' in L{Device}).
+        
+        @return: Whether or not the pager is on
+        @rtype: C{bool}"""
+        if self._pager is None and self.device.get('pager_prompt'):
+            self._pager = _Pager(self, self.device['pager_prompt'],
+                                 self.device.get('pager_key', ' '))
+        return self._pager is not None
+    
     def _on_login_failure(self, failure):
         """Handle failed login. Catches L(RequestFailed<texpect.RequestFailed>).
         
@@ -294,13 +1336,14 @@ class Cisco(TExpect):
         
         """
         failure.trap(RequestFailed)
+        self._failed = True
         exc = failure.value
         return Failure(LoginFailed('Failed to log in to %s' %
                                    self.device['id'], data=exc.data))
     
     def run_command(self, command, prompt=None, timeout=None,
             strip_command=True, strip_prompt=True, process_errors=True,
-            _may_disconnect=False):
+            as_output=False, _may_disconnect=False):
         """Run a command, capturing the output.
         
         @param command: the command to be executed. Do not include trailing newline.
@@ -311,7 +1354,10 @@ class Cisco(TExpect):
         overrides the prompt if the default behaviour is not sufficient
         @type prompt: C{str} or C{_sre.SRE_Pattern} (compiled regular expression instance)
         
-        @param timeout: Override the instance-default timeout
+        @param timeout: Override the instance-default timeout. If it is not given
+        and the session has L{timeouts}, the learned timeout of the command is
+        used instead (extended while the output keeps arriving; if it expires, the
+        session is closed, since it is not usable anymore)
         @type timeout: C{int}
         
         @param strip_command: Whether or not the line, containing the actual invocation
@@ -326,6 +1372,11 @@ class Cisco(TExpect):
         Cisco-produced errors (lines, starting with '%'). Default: C{True}.
         @type process_errors: C{bool}
         
+        @param as_output: If C{True}, the result is a L{CommandOutput<texpect_cisco.output.CommandOutput>}
+        instance, that refers to the received data instead of copying the output
+        out of it. Default: C{False}.
+        @type as_output: C{bool}
+        
         @param _may_disconnect: Signals if the command that is to be run may cause
         the connection to be terminated. Invokes a special case in the error processing
         logic so that we don't get an error if we are disconnected. Default: C{False}
@@ -346,30 +1397,255 @@ class Cisco(TExpect):
         if self.eof:
             return fail(Failure(NotConnected('Not connected to %s at the moment' %
                                               self.device['id'], command=command)))
+        command = command.strip()
+        learned = None
         if timeout is None:
             timeout = self.timeout
+            if self.timeouts is not None:
+                learned = self.timeouts.timeout(self.device.get('id'), command)
+                if learned is not None:
+                    timeout = self.timeouts.maximum
         if prompt is None:
             if self.enabled:
                 prompt = self.device['enabled_prompt']
             else:
                 prompt = self.device['prompt']
-        command = command.strip()
         
         if self.debug:
             log.msg("Running command '%s' on %s, expecting %s" %
                     (command, self.device['id'], prompt))
 
+        started = monotonic()
+        if self.metrics is not None:
+            self._first_byte_pending = (started, False)
         d = self.write(command+'\n')
         d.addCallback(lambda ign: self.expect([prompt], timeout=timeout))
-        d.addCallbacks(callback=self._process_command_result,
+        if learned is not None:
+            d.addBoth(_Watchdog(self, command, learned, self.timeouts.clock).stop)
+        if self.timeouts is not None:
+            d.addCallback(self._learn, command, self.timeouts.clock.seconds())
+        d.addBoth(self._command_done, started)
+        d.addCallbacks(callback=self._on_command_result,
                        callbackArgs=[command, strip_command, strip_prompt, process_errors],
+                       callbackKeywords={'as_output':as_output, 'started':started},
                        errback=self._on_command_error,
                        errbackArgs=[command, strip_command, strip_prompt,
-                                    process_errors, _may_disconnect])
+                                    process_errors, _may_disconnect],
+                       errbackKeywords={'as_output':as_output, 'started':started})
+        return d
+    
+    def run_commands(self, commands, prompt=None, timeout=None,
+            strip_command=True, strip_prompt=True, process_errors=True,
+            collect_errors=False):
+        """Run several commands, writing all of them at once, instead of waiting
+        for the prompt after each one. The output is then split into per-command
+        results: the output of a command ends where the prompt, followed by the
+        echo of the next command, begins.
+        
+        @param commands: the commands to be executed. Do not include trailing newlines.
+        @type commands: C{iterable} of C{str}
+        
+        @param collect_errors: If C{True}, the result list contains a L{Failure},
+        wrapping L{CiscoCommandError}, for every command, that resulted in an error.
+        Otherwise, the first such error is propagated to the errback, once the output
+        of all the commands has been read. Default: C{False}.
+        @type collect_errors: C{bool}
+        
+        See L{run_command} for the description of the rest of the arguments.
+        
+        @return: A L{Deferred}, that will be fired with the list of processed outputs,
+        an item for each command. Errback argument types are the same as for
+        L{run_command}.
+        @rtype: L{Deferred}
+        
+        @note: This relies on the device echoing the commands back, which is what
+        Cisco devices do. Do not include commands that change the prompt (such as
+        'enable' or 'configure terminal') in the middle of a batch.
+        
+        """
+        def finish(results):
+            if not collect_errors:
+                for res in results:
+                    if isinstance(res, Failure):
+                        return res
+            return results
+        d = self.run_pipelined(commands, prompt, timeout, strip_command,
+                               strip_prompt, process_errors)
+        d.addCallback(finish)
+        return d
+    
+    def run_pipelined(self, commands, prompt=None, timeout=None, strip_command=True,
+            strip_prompt=True, process_errors=True, as_output=False):
+        """Write all the commands at once, then read the output of each one in
+        turn: it ends where the prompt, followed by the echo of the next command,
+        begins. This is what L{run_commands} and
+        L{push_config<texpect_cisco.push.push_config>} are built on.
+        
+        See L{run_command} for the description of the arguments.
+        
+        @return: A L{Deferred}, that will be fired with a list, an item for each
+        command: the processed output or, if the device has reported an error,
+        a L{Failure}, wrapping L{CiscoCommandError}. If the output of a command
+        could not be read, the errback is called instead, with the same argument
+        types as for L{run_command}.
+        @rtype: L{Deferred}
+        
+        """
+        commands = [command.strip() for command in commands]
+        if self.eof:
+            return fail(Failure(NotConnected('Not connected to %s at the moment' %
+                                              self.device['id'],
+                                              command='; '.join(commands))))
+        if not commands:
+            return succeed([])
+        if timeout is None:
+            timeout = self.timeout
+        if prompt is None:
+            if self.enabled:
+                prompt = self.device['enabled_prompt']
+            else:
+                prompt = self.device['prompt']
+        
+        if self.debug:
+            log.msg("Running commands %s on %s, expecting %s" %
+                    (commands, self.device['id'], prompt))
+        
+        results = []
+        def collect(res):
+            if isinstance(res, Failure) and res.check(CiscoCommandError) is None:
+                return res
+            results.append(res)
+        
+        d = self.write(''.join([command+'\n' for command in commands]))
+        for ind, command in enumerate(commands):
+            if ind + 1 < len(commands):
+                expecting = self._pipeline_pattern(prompt, commands[ind+1])
+            else:
+                expecting = prompt
+            d.addCallback(lambda ign, expecting=expecting:
+                          self.expect([expecting], timeout=timeout))
+            d.addCallbacks(callback=self._on_command_result,
+                           callbackArgs=[command, strip_command, strip_prompt, process_errors],
+                           callbackKeywords={'as_output':as_output},
+                           errback=self._on_command_error,
+                           errbackArgs=[command, strip_command, strip_prompt,
+                                        process_errors, False])
+            d.addBoth(collect)
+        d.addCallback(lambda ign: results)
+        return d
+    
+    def _pipeline_pattern(self, prompt, next_command):
+        """Build the expression, that matches the prompt, followed by the echo of
+        the next command in the batch. The end-of-input anchor (C{'$'} or
+        C{'\\Z'}) is removed from the prompt, since the prompt is not at the end of
+        the output anymore, and the whitespace, that the prompt may end with, is
+        made optional, since the echo follows it right away.
+        
+        @param prompt: The prompt
+        @type prompt: C{str} or C{_sre.SRE_Pattern}
+        
+        @param next_command: The command, that follows the prompt
+        @type next_command: C{str}
+        
+        @return: Compiled regular expression
+        @rtype: C{_sre.SRE_Pattern}
+        
+        """
+        if isinstance(prompt, string_types):
+            pattern, flags = prompt, 0
+        else:
+            pattern, flags = prompt.pattern, prompt.flags
+        for anchor in _ANCHORS:
+            if _ends_with(pattern, anchor):
+                pattern = pattern[:-len(anchor)]
+                break
+        for whitespace in _TRAILING_WHITESPACE:
+            if _ends_with(pattern, whitespace):
+                # The echo follows on the same line, whether or not there is a space
+                pattern = pattern[:-len(whitespace)] + '[ \\t]*'
+                break
+        return re.compile('(?:%s)%s' % (pattern, re.escape(next_command)), flags)
+    
+    def stream_command(self, command, consumer, prompt=None, timeout=None,
+            lines=False, window=256, strip_command=True, process_errors=True):
+        """Run a command, handing the output to the consumer as it arrives, instead
+        of collecting all of it first. Use this for the commands, that produce huge
+        outputs, such as C{'show tech-support'}.
+        
+        Only the last L{window} characters are held back (so that the prompt can be
+        detected), so the amount of memory used does not depend on the size of the
+        output. If the consumer returns a L{Deferred}, that hasn't been fired yet,
+        reading from the device is paused until it fires, so a slow consumer
+        makes the device stop sending (by the means of TCP flow control).
+        
+        @param command: the command to be executed. Do not include trailing newline.
+        @type command: C{str}
+        
+        @param consumer: A callable, that will be called with every chunk of output
+        (or a list of complete lines, see L{lines}). It may return a L{Deferred}
+        to signal, that it is not ready to accept more data.
+        @type consumer: C{callable}
+        
+        @param timeout: Override the instance-default timeout. Unlike L{run_command},
+        the timeout is the number of seconds to wait for more data, not for the
+        whole command to complete.
+        @type timeout: C{int}
+        
+        @param lines: If C{True}, the consumer is called with lists of complete lines
+        (with line endings removed), otherwise - with chunks of arbitrary size.
+        Default: C{False}.
+        @type lines: C{bool}
+        
+        @param window: Number of characters at the end of the received data, that
+        are held back until more data arrives. Must be larger than the prompt.
+        The echo of the command is only stripped and the errors are only found,
+        if the echo and the error message fit in it as well. Default: 256.
+        @type window: C{int}
+        
+        @param process_errors: Whether or not should the beginning of the output be
+        checked for Cisco-produced errors (lines, starting with '%'). Default: C{True}.
+        @type process_errors: C{bool}
+        
+        See L{run_command} for the description of the rest of the arguments.
+        
+        @return: A L{Deferred}, that will be fired with the number of characters
+        handed to the consumer, when the prompt is encountered. Errback argument
+        types are the same as for L{run_command}, as well as L{StreamInProgress}, if
+        another command is being streamed. If the consumer raises an exception or
+        its L{Deferred} fails, the errback is called with that failure.
+        @rtype: L{Deferred}
+        
+        """
+        if self.eof:
+            return fail(Failure(NotConnected('Not connected to %s at the moment' %
+                                              self.device['id'], command=command)))
+        if self._stream is not None:
+            return fail(Failure(StreamInProgress(
+                "The output of '%s' is still being streamed from %s" %
+                    (self._stream.command, self.device['id']), command=command)))
+        if timeout is None:
+            timeout = self.timeout
+        if prompt is None:
+            if self.enabled:
+                prompt = self.device['enabled_prompt']
+            else:
+                prompt = self.device['prompt']
+        command = command.strip()
+        
+        if self.debug:
+            log.msg("Streaming command '%s' on %s, expecting %s" %
+                    (command, self.device['id'], prompt))
+        
+        stream = _OutputStream(self, command, prompt, consumer, timeout, window,
+                               lines, strip_command, process_errors)
+        self._stream = stream
+        d = self.write(command+'\n')
+        d.addCallback(lambda ign: stream.deferred)
         return d
     
     def _on_command_error(self, failure, cmd, strip_command, strip_prompt,
-                          process_errors, _may_disconnect):
+                          process_errors, _may_disconnect, as_output=False,
+                          started=None):
         """Handle command error, such as unexpected connection loss,
         not encountering the expected prompt and so on. Anything, not derived from
         L{RequestFailed<texpect.RequestFailed>} is not caught.
@@ -401,6 +1677,9 @@ class Cisco(TExpect):
         can get back the output. Default: C{False}
         @type _may_disconnect: C{bool}
         
+        @param as_output: Forwarded to L{_process_command_result}
+        @param started: Forwarded to L{_process_command_result}
+        
         @return: A L{Failure} instance, wrapping L{UnexpectedResultError}.  
         @rtype: L{Failure}
         
@@ -412,16 +1691,49 @@ class Cisco(TExpect):
             # and fake the usual 'expect' result (first two items will not be needed)
             if _may_disconnect: 
                 return self._process_command_result((None, None, exc.data), cmd,
-                                                strip_command, False, process_errors)
+                                                strip_command, False, process_errors,
+                                                as_output, started)
             else:
+                self._failed = True
                 return Failure(Disconnected('Command resulted in a disconnection',
                                             cmd, data=exc.data))
+        self._failed = True
         return Failure(UnexpectedResultError(
             "Error running command '%s'. Expected: %s, got %r" %
              (cmd, [e.pattern for e in exc.promise.expecting], exc.data)
         ))
     
-    def _process_command_result(self, res, cmd, strip_command, strip_prompt, process_errors):
+    def _on_command_result(self, res, *args, **kwargs):
+        """Process the result of a successfully completed command (see
+        L{_process_command_result}), in a thread pool, if the output is large
+        (see L{offload_threshold}).
+        
+        @return: Whatever L{_process_command_result} returns or a L{Deferred},
+        that will be fired with it.
+        
+        """
+        if self.offload_threshold is not None and len(res[2]) >= self.offload_threshold:
+            return self._offload(self._process_command_result, res, *args, **kwargs)
+        return self._process_command_result(res, *args, **kwargs)
+    
+    def _offload(self, func, *args, **kwargs):
+        """Call the function in L{threadpool}, so that the reactor thread stays free
+        to do I/O for the rest of the sessions. The function must not touch the
+        transport or anything else, that is not thread-safe.
+        
+        @return: A L{Deferred}, that will be fired with the result of the function
+        @rtype: L{Deferred}
+        
+        """
+        from twisted.internet import reactor
+        from twisted.internet.threads import deferToThreadPool
+        threadpool = self.threadpool
+        if threadpool is None:
+            threadpool = reactor.getThreadPool()
+        return deferToThreadPool(reactor, threadpool, func, *args, **kwargs)
+    
+    def _process_command_result(self, res, cmd, strip_command, strip_prompt, process_errors,
+                                as_output=False, started=None):
         """Process the result of a successfully completed command.
         
         @param res: Result of the underlying L{Expect} callback, typically
@@ -443,11 +1755,21 @@ class Cisco(TExpect):
         Cisco-produced errors (lines, starting with '%').
         @type process_errors: C{bool}
         
+        @param as_output: Return a L{CommandOutput<texpect_cisco.output.CommandOutput>}
+        instead of a string. Default: C{False}
+        @type as_output: C{bool}
+        
+        @param started: The time the command was sent. Default: C{None}
+        @type started: C{float}
+        
         @return: Command output or L{Failure}, containing L{CiscoCommandError}, if
         L{process_errors} is True and errors were encountered.
-        @rtype: C{str} or L{Failure}
+        @rtype: C{str}, L{CommandOutput<texpect_cisco.output.CommandOutput>} or L{Failure}
         
         """
+        if as_output:
+            return self._command_output(res, cmd, strip_command, strip_prompt,
+                                        process_errors, started)
         (match_obj, data) = res[1:]
         if strip_prompt:
             data = data[:match_obj.start()]
@@ -456,18 +1778,49 @@ class Cisco(TExpect):
             if data.startswith(cmd):
                 data = data[len(cmd):].lstrip()
         if process_errors:
-            error = self._process_device_errors(data)
+            error = self.error_scanner.scan(data)
             if error is not None:
-                (error_lines, _) = error
                 return Failure(CiscoCommandError(
                     'An error was reported by the device "%s" while running the command "%s"' %
                         (self.device['id'], cmd),
                     command=cmd,
-                    error='\n'.join(error_lines),
+                    error=error.text(),
                     data=data
                     ))
         return data
     
+    def _command_output(self, res, cmd, strip_command, strip_prompt, process_errors,
+                        started):
+        """The same as L{_process_command_result}, but the stripping is done by
+        adjusting the offsets of L{CommandOutput<texpect_cisco.output.CommandOutput>}
+        and the error scan only looks at that part of the data, so nothing is copied.
+        
+        @rtype: L{CommandOutput<texpect_cisco.output.CommandOutput>} or L{Failure}
+        
+        """
+        (match_obj, data) = res[1:]
+        end = len(data)
+        prompt = None
+        if match_obj is not None:
+            prompt = match_obj.group()
+            if strip_prompt:
+                end = match_obj.start()
+        start, end = strip_span(data, 0, end)
+        if strip_command and data.startswith(cmd, start, end):
+            start, end = strip_span(data, start + len(cmd), end)
+        output = CommandOutput(data, start, end, cmd, prompt, started, monotonic())
+        if process_errors:
+            error = self.error_scanner.scan(data, start, end)
+            if error is not None:
+                return Failure(CiscoCommandError(
+                    'An error was reported by the device "%s" while running the command "%s"' %
+                        (self.device['id'], cmd),
+                    command=cmd,
+                    error=error.text(),
+                    data=str(output)
+                    ))
+        return output
+    
     def _process_device_errors(self, data):
         """Check for typical Cisco-style errors in the output. The errors are usually
         formatted in one of two ways:
@@ -496,20 +1849,15 @@ class Cisco(TExpect):
         
         @note: If the error message contains a '^' marker, its position, relative
         to the previous line is not preserved! 
+        
+        @note: L{run_command} only needs the error message, so it uses
+        L{error_scanner} directly and never builds the lists.
 
         """
-        lines = data.split('\n')
-        for ind, line in enumerate(lines):
-            if line.startswith('%'):
-                if line.find("'^' marker") != -1:
-                    error_lines = lines[ind-1:ind+2]
-                    data_lines = lines[:ind-1]+lines[ind+2:]
-                else:
-                    error_lines = lines[ind:ind+1]
-                    data_lines = lines[:ind]+lines[ind+1:]
-                return (error_lines, data_lines)
-        else:
+        error = self.error_scanner.scan(data)
+        if error is None:
             return None
+        return (error.lines(), error.remaining_lines())
         
     
     def enable(self, timeout=None):
@@ -533,11 +1881,13 @@ class Cisco(TExpect):
         """
         if timeout is None:
             timeout = self.timeout
+        started = monotonic()
         d = self.run_command(self.device['enable_command'],
                              prompt=self.device['enable_password_prompt'])
-        d.addCallback(lambda ign: self.write(self.device['enable_password']+'\n'))
+        d.addCallback(lambda ign: self.write(self.device['enable_password']+'\n', True))
         d.addCallback(lambda ign: self.read_to_prompt(self.device['enabled_prompt'], timeout))
         d.addCallbacks(callback=self._on_enable, errback=self._on_enable_failure)
+        d.addBoth(lambda res: self._record('enable', started, res))
         return d
     
     def _on_enable(self, res):
@@ -564,6 +1914,7 @@ class Cisco(TExpect):
         @rtype: L{Failure}
         """
         failure.trap(RequestFailed)
+        self._failed = True
         exc = failure.value
         return Failure(EnableFailed('Failed to enter privileged EXEC mode on %s' %
                                     self.device['id'], data=exc.data))
@@ -0,0 +1,59 @@
+'''
+@author: shylent
+
+Python 2 and 3 compatibility. The sessions work with the native strings, but
+on Python 3 the transports send and receive bytes, so the data is converted,
+when it crosses the transport. Latin-1 maps every byte to the character with
+the same code, so nothing is lost and the telnet commands are the same
+characters on both.
+'''
+try:
+    string_types = basestring
+except NameError:
+    string_types = str
+
+try:
+    from time import monotonic
+except ImportError:
+    # Python 2 has no monotonic clock in the standard library
+    from time import time as monotonic
+
+
+if str is bytes:
+    def native(data, encoding='latin-1'):
+        """@return: C{data} as a native string
+        @rtype: C{str}"""
+        if isinstance(data, unicode):
+            return data.encode(encoding)
+        return data
+
+    def to_bytes(data):
+        """@return: C{data}, as the transports expect it
+        @rtype: C{bytes}"""
+        return data
+
+    def to_text(data):
+        """@return: C{data}, decoded from Latin-1
+        @rtype: C{unicode}"""
+        if isinstance(data, str):
+            return data.decode('latin-1')
+        return data
+else:
+    def native(data, encoding='latin-1'):
+        """@return: C{data} as a native string
+        @rtype: C{str}"""
+        if isinstance(data, bytes):
+            return data.decode(encoding)
+        return data
+
+    def to_bytes(data):
+        """@return: C{data}, as the transports expect it
+        @rtype: C{bytes}"""
+        if isinstance(data, str):
+            return data.encode('latin-1')
+        return data
+
+    def to_text(data):
+        """@return: C{data}, decoded from Latin-1
+        @rtype: C{unicode}"""
+        return native(data)
@@ -2,7 +2,7 @@
 @author: shylent
 '''
 from twisted.python import log
-from texpect_cisco.cisco import TExpectCiscoError
+from texpect_cisco.cisco import TExpectCiscoError, Device
 
 
 class ImproperlyConfigured(TExpectCiscoError):
@@ -13,8 +13,9 @@ def process_hooks(hooks, device, force=False, strict=True):
     """Populate the L{device} dictionary, using the attribute-to-callable
     mapping provided in L{hooks} iterable.
     
-    @param hooks: An iterable, that yields 2-tuples, that represents a 'hook'.
-    The items of the tuples are:
+    @param hooks: An iterable, that yields 2-tuples, that represents a 'hook'
+    (3-tuples, as used by L{LazyDevice}, are accepted as well, the third item is
+    ignored). The items of the tuples are:
         - the key in the L{device} dictionary, that will be populated by the
         return value of this hook
         - a callable, that will be called with the L{device} dictionary
@@ -38,18 +39,138 @@ def process_hooks(hooks, device, force=False, strict=True):
     @type strict: C{bool}
     
     """
-    for attr_name, hook in hooks:
+    for spec in hooks:
+        attr_name, hook = spec[:2]
         if attr_name in device and not force:
             continue
         try:
             device[attr_name] = hook(device)
-        except ImproperlyConfigured, e:
+        except ImproperlyConfigured as e:
             log.err(e, "An error has occured while processing configuration")
             if strict:
                 raise
-        except Exception, e:
+        except Exception as e:
             exc = ImproperlyConfigured("An exception was raised in the hook: %s" % e)
             log.err(exc)
             if strict:
                 raise exc
-    return device
\ No newline at end of file
+    return device
+
+
+class LazyDevice(Device):
+    """A L{Device}, whose hooks are only run, when the key, that they populate, is
+    read for the first time (by L{Cisco<texpect_cisco.cisco.Cisco>} or
+    anything else), and the result is kept. The keys, that are never read,
+    cost nothing.
+
+    The hooks are 3-tuples: the key, the callable (see L{process_hooks}) and the
+    keys, that the callable depends on. These are checked before the hook is
+    run, so a missing input is reported as such. A hook may also read the keys,
+    it has not declared, the dependencies are resolved the same way.
+
+    The value of a key is looked up in the device itself, then the hook for the
+    key is run, and then the defaults are consulted. So, unlike with
+    L{process_hooks}, a hook takes precedence over a default.
+
+    Iterating over the device (and C{keys}, C{items} and so on) only covers the
+    values, that are known already, use L{evaluate} to run the rest of the hooks.
+
+    """
+
+    def __init__(self, device=(), hooks=(), defaults=None):
+        """
+        @param device: The values of the device
+        @type device: C{dict}
+
+        @param hooks: C{(key, callable, dependencies)} 3-tuples or C{(key, callable)}
+        2-tuples (the dependencies are not declared then). The hooks for the
+        keys, that are present in L{device}, are not run.
+        @type hooks: C{iterable}
+
+        @param defaults: The values of the keys, that are neither present, nor
+        have a hook. Default: C{None}
+        @type defaults: C{dict}
+
+        """
+        Device.__init__(self, device)
+        self._hooks = {}
+        for spec in hooks:
+            if not dict.__contains__(self, spec[0]):
+                self._hooks[spec[0]] = (spec[1], tuple(spec[2:3] and spec[2] or ()))
+        self._defaults = defaults
+        self._evaluating = []
+
+    def __contains__(self, key):
+        return dict.__contains__(self, key) or key in self._hooks or \
+            (self._defaults is not None and key in self._defaults)
+
+    has_key = __contains__
+
+    def __missing__(self, key):
+        if key in self._hooks:
+            return self._evaluate(key)
+        if self._defaults is not None and key in self._defaults:
+            return self._defaults[key]
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        self._hooks.pop(key, None)
+        dict.__setitem__(self, key, value)
+
+    def get(self, key, default=None):
+        if key in self:
+            return self[key]
+        return default
+
+    def setdefault(self, key, default=None):
+        if key in self:
+            return self[key]
+        self[key] = default
+        return default
+
+    def _evaluate(self, key):
+        if key in self._evaluating:
+            cycle = self._evaluating[self._evaluating.index(key):] + [key]
+            raise ImproperlyConfigured('Dependency cycle in the hooks of %s: %s' %
+                                       (dict.get(self, 'id'), ' -> '.join(cycle)))
+        hook, dependencies = self._hooks[key]
+        for dependency in dependencies:
+            if dependency not in self:
+                raise ImproperlyConfigured("The hook for '%s' of %s requires '%s', "
+                                           "which is missing" %
+                                           (key, dict.get(self, 'id'), dependency))
+        self._evaluating.append(key)
+        try:
+            for dependency in dependencies:
+                self[dependency]
+            try:
+                value = hook(self)
+            except ImproperlyConfigured:
+                raise
+            except Exception as e:
+                raise ImproperlyConfigured("An exception was raised in the hook for "
+                                           "'%s' of %s: %s" % (key, dict.get(self, 'id'), e))
+        finally:
+            self._evaluating.pop()
+        # Unless the hook itself has set it
+        if key in self._hooks:
+            self[key] = value
+        return dict.__getitem__(self, key)
+
+    def pending(self):
+        """@return: The keys, whose hooks have not been run yet
+        @rtype: C{list}"""
+        return list(self._hooks)
+
+    def evaluate(self):
+        """Run every hook, that has not been run yet (to validate the device as a
+        whole, for example, or before handing it to another process).
+
+        @return: The device itself
+        @rtype: L{LazyDevice}
+
+        """
+        for key in self.pending():
+            if key in self._hooks:
+                self[key]
+        return self
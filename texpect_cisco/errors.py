@@ -0,0 +1,169 @@
+'''
+@author: shylent
+'''
+import re
+
+
+default_error_signatures = (
+    ('invalid input', r'Invalid input detected'),
+    ('incomplete command', r'Incomplete command'),
+    ('ambiguous command', r'Ambiguous command'),
+    ('unknown command', r'Unknown command'),
+    # Anything else, that looks like an error. Leave this out of a custom table
+    # to only recognize the known errors.
+    ('other', r''),
+)
+
+
+class DeviceError(object):
+    """An error, found in the command output by L{ErrorScanner}. Only the position
+    of the error is stored, the lines are extracted when (and if) they are asked for.
+
+    @ivar data: The output, that was scanned
+    @type data: C{str}
+
+    @ivar start: The offset of the first character of the error message
+    @type start: C{int}
+
+    @ivar end: The offset just past the last character of the error message
+    @type end: C{int}
+
+    @ivar kind: The name of the error signature, that has matched
+    @type kind: C{str}
+
+    @ivar lo: The offset of the beginning of the scanned part of L{data}
+    @type lo: C{int}
+
+    @ivar hi: The offset just past the end of the scanned part of L{data}
+    @type hi: C{int}
+
+    """
+    __slots__ = ('data', 'start', 'end', 'kind', 'lo', 'hi')
+
+    def __init__(self, data, start, end, kind, lo=0, hi=None):
+        if hi is None:
+            hi = len(data)
+        self.data = data
+        self.start = start
+        self.end = end
+        self.kind = kind
+        self.lo = lo
+        self.hi = hi
+
+    def text(self):
+        """@return: The error message
+        @rtype: C{str}"""
+        return self.data[self.start:self.end]
+
+    def lines(self):
+        """@return: The error message, presented as a list of lines
+        @rtype: C{list}"""
+        return self.text().split('\n')
+
+    def remaining_lines(self):
+        """@return: The data sans the error message, presented as a list of lines
+        @rtype: C{list}"""
+        lines = []
+        if self.start > self.lo:
+            lines.extend(self.data[self.lo:self.start - 1].split('\n'))
+        if self.end < self.hi:
+            lines.extend(self.data[self.end + 1:self.hi].split('\n'))
+        return lines
+
+
+class ErrorScanner(object):
+    """Find Cisco-style errors in the command output in a single pass of one
+    regular expression over the whole output, without splitting it into lines.
+
+    The errors are recognized by a table of signatures: C{(name, expression)}
+    pairs, where the expression should match the beginning of the error message
+    (following the C{'%'}). If the message mentions the C{'^'} marker, the line
+    before it (the one with the marker) and the line after it are considered
+    to be part of the error as well.
+
+    """
+    marker = "'^' marker"
+
+    def __init__(self, signatures=default_error_signatures, prefix='%'):
+        """
+        @param signatures: The table of error signatures.
+        Default: L{default_error_signatures}
+        @type signatures: C{iterable} of 2-tuples
+
+        @param prefix: An expression, that matches the beginning of a line with
+        an error message. Default: C{'%'}
+        @type prefix: C{str}
+
+        """
+        self.signatures = tuple(signatures)
+        alternatives = '|'.join(['(?P<_sig%d>%s)' % (ind, expr)
+                                 for ind, (_, expr) in enumerate(self.signatures)])
+        line = r'(?:%s)[ \t]*(?:%s)[^\n]*' % (prefix, alternatives)
+        self.pattern = re.compile('^' + line, re.MULTILINE)
+        # '^' doesn't match at the starting position of the search, unless it
+        # is preceded by a newline, so the first line is checked separately
+        self._first_line = re.compile(line)
+
+    def scan(self, data, lo=0, hi=None):
+        """Find the first error in the data.
+
+        @param data: Data to be checked for errors
+        @type data: C{str}
+
+        @param lo: Only scan the data starting at this offset. Default: 0
+        @type lo: C{int}
+
+        @param hi: Only scan the data up to this offset. Default: the end of the data
+        @type hi: C{int}
+
+        @return: L{DeviceError} or C{None} if no error was found
+        @rtype: L{DeviceError} or C{None}
+
+        """
+        if hi is None:
+            hi = len(data)
+        match_obj = None
+        if lo > 0 and data[lo - 1] != '\n':
+            match_obj = self._first_line.match(data, lo, hi)
+        if match_obj is None:
+            match_obj = self.pattern.search(data, lo, hi)
+        if match_obj is None:
+            return None
+        start, end = match_obj.span()
+        if data.find(self.marker, start, end) != -1:
+            if start > lo:
+                start = data.rfind('\n', lo, start - 1) + 1 or lo
+            if end < hi:
+                end = data.find('\n', end + 1, hi)
+                if end == -1:
+                    end = hi
+        groups = match_obj.groupdict()
+        for ind, (name, _) in enumerate(self.signatures):
+            if groups['_sig%d' % ind] is not None:
+                break
+        else:
+            name = None
+        return DeviceError(data, start, end, name, lo, hi)
+
+
+_scanners = {}
+
+def get_error_scanner(signatures=None, prefix=None):
+    """Get the scanner for the given table of signatures. Scanners are cached, so
+    the expression is only compiled once for every table.
+
+    @param signatures: The table of error signatures. Default: L{default_error_signatures}
+    @param prefix: See L{ErrorScanner}. Default: C{'%'}
+
+    @rtype: L{ErrorScanner}
+
+    """
+    if signatures is None:
+        signatures = default_error_signatures
+    if prefix is None:
+        prefix = '%'
+    key = (tuple(signatures), prefix)
+    scanner = _scanners.get(key)
+    if scanner is None:
+        scanner = _scanners[key] = ErrorScanner(signatures, prefix)
+    return scanner
@@ -0,0 +1,248 @@
+'''
+@author: shylent
+'''
+from twisted.python.failure import Failure
+from twisted.python import log
+from twisted.internet.defer import DeferredList, maybeDeferred
+from twisted.internet.protocol import ClientCreator
+from twisted.internet.task import Cooperator
+from texpect_cisco.cisco import Cisco, device_defaults
+from texpect_cisco.compat import monotonic
+from texpect_cisco.conf import process_hooks, LazyDevice
+
+
+def prepare_device(device, hooks=(), defaults=device_defaults, lazy=False):
+    """Apply the defaults and run the hooks on a freshly loaded device dictionary.
+    This is the same thing, that every script used to do by hand before
+    connecting to the device.
+
+    @param device: A dictionary, that represents a 'device'
+    @type device: C{dict}
+
+    @param hooks: Hooks to be passed to L{process_hooks<texpect_cisco.conf.process_hooks>}.
+    Default: no hooks.
+    @type hooks: C{iterable}
+
+    @param defaults: The defaults to be applied (with C{setdefault}) before the
+    hooks are run. Default: L{device_defaults<texpect_cisco.cisco.device_defaults>}
+    @type defaults: C{dict}
+
+    @param lazy: If C{True}, a L{LazyDevice<texpect_cisco.conf.LazyDevice>} is
+    returned instead, the hooks are only run when their keys are read (and take
+    precedence over the defaults). Default: C{False}
+    @type lazy: C{bool}
+
+    @return: The populated L{device} dictionary
+    @rtype: C{dict}
+
+    """
+    if lazy:
+        return LazyDevice(device, hooks, defaults)
+    for k, v in defaults.items():
+        device.setdefault(k, v)
+    return process_hooks(hooks, device)
+
+def connect(device, protocol=Cisco, reactor=None, metrics=None):
+    """Establish a TCP connection to the device, using the 'address', 'port' and
+    'connect_timeout' keys of the L{device} dictionary.
+
+    @param device: A L{Device<texpect_cisco.cisco.Device>} instance
+    @type device: C{dict}
+
+    @param protocol: The protocol class to instantiate. Default: L{Cisco}
+    @type protocol: C{type}
+
+    @param reactor: The reactor to use. Default: the global reactor
+
+    @param metrics: The collector of the timings, that is passed to the session.
+    The time it takes to connect is recorded as the 'connect' phase. Default: C{None}
+    @type metrics: L{Metrics<texpect_cisco.metrics.Metrics>}
+
+    If the 'transport' of the device is C{'ssh'}, the session is opened over SSH
+    instead (see L{ssh.connect<texpect_cisco.ssh.connect>}).
+
+    @return: A L{Deferred}, that will be fired with the connected L{Cisco} instance
+    @rtype: L{Deferred}
+
+    """
+    if device.get('transport') == 'ssh':
+        from texpect_cisco.ssh import connect as ssh_connect
+        return ssh_connect(device, protocol, reactor, metrics)
+    if reactor is None:
+        from twisted.internet import reactor
+    if metrics is None:
+        cc = ClientCreator(reactor, protocol, device)
+        return cc.connectTCP(device['address'], device['port'],
+                             device.get('connect_timeout', 30))
+    started = monotonic()
+    cc = ClientCreator(reactor, protocol, device, metrics=metrics)
+    d = cc.connectTCP(device['address'], device['port'],
+                      device.get('connect_timeout', 30))
+    def record(res):
+        if isinstance(res, Failure):
+            metrics.count(device.get('id'), 'connect_failed')
+        else:
+            metrics.record(device.get('id'), 'connect', monotonic() - started)
+        return res
+    d.addBoth(record)
+    return d
+
+def command_job(commands, enable=True, exit=True):
+    """Build the most common kind of job: log in, (optionally) enter the privileged
+    EXEC mode, run the commands one after another and log out.
+
+    @param commands: The commands to be run
+    @type commands: C{iterable} of C{str}
+
+    @param enable: Whether or not to enter the privileged EXEC mode before
+    running the commands. Default: C{True}
+    @type enable: C{bool}
+
+    @param exit: Whether or not to run the 'exit' command when done. Default: C{True}
+    @type exit: C{bool}
+
+    @return: A callable, that takes a connected L{Cisco} instance and returns a
+    L{Deferred}, that fires with the list of outputs, an item for each command.
+    @rtype: C{callable}
+
+    """
+    commands = list(commands)
+    def job(inst):
+        outputs = []
+        d = inst.bring_up(enable)
+        for command in commands:
+            d.addCallback(lambda ign, command=command: inst.run_command(command))
+            d.addCallback(outputs.append)
+        if exit:
+            d.addCallback(lambda ign: inst.exit())
+        d.addCallback(lambda ign: outputs)
+        return d
+    return job
+
+
+class FleetRunner(object):
+    """Run a job against a (possibly very large) number of devices, keeping no
+    more than a fixed number of sessions open at any given moment.
+
+    The inventory is consumed lazily, so it is fine to pass a generator, that
+    reads the devices from a file or a database. The results are handed to the
+    L{on_result} callable as soon as the job for the particular device is
+    finished.
+
+    @ivar job: A callable, that will be called with a connected L{Cisco} instance and
+    is expected to return a L{Deferred} (see L{command_job})
+    @type job: C{callable}
+
+    @ivar concurrency: Maximum number of devices processed simultaneously
+    @type concurrency: C{int}
+
+    """
+
+    def __init__(self, job, concurrency=100, hooks=(), connect=connect,
+                 on_result=None, lazy_hooks=False):
+        """
+        @param job: A callable, that will be called with a connected L{Cisco}
+        instance and is expected to return a L{Deferred}
+        @type job: C{callable}
+
+        @param concurrency: Maximum number of devices processed simultaneously.
+        Default: 100
+        @type concurrency: C{int}
+
+        @param hooks: Hooks, that are used to populate each device (see
+        L{prepare_device}). Default: no hooks
+        @type hooks: C{iterable}
+
+        @param connect: A callable, that takes a device and returns a L{Deferred},
+        that fires with the connected L{Cisco} instance. Default: L{connect}
+        @type connect: C{callable}
+
+        @param on_result: A callable, that will be called with the device and the
+        result of the job (or a L{Failure}) for every device as soon as the job
+        is done. Default: C{None}
+        @type on_result: C{callable}
+
+        @param lazy_hooks: Whether or not to only run the hooks, when the job
+        reads their keys (see L{prepare_device}). Default: C{False}
+        @type lazy_hooks: C{bool}
+
+        """
+        if concurrency < 1:
+            raise ValueError('concurrency must be a positive integer')
+        self.job = job
+        self.concurrency = concurrency
+        self.hooks = tuple(hooks)
+        self.connect = connect
+        self.on_result = on_result
+        self.lazy_hooks = lazy_hooks
+        self.succeeded = 0
+        self.failed = 0
+
+    def run(self, inventory):
+        """Run the job against every device in the inventory.
+
+        @param inventory: An iterable of device dictionaries. Each one is prepared
+        using L{prepare_device} before connecting.
+        @type inventory: C{iterable}
+
+        @return: A L{Deferred}, that will be fired with a 2-tuple C{(succeeded, failed)}
+        when every device has been processed. Failures of individual devices
+        never errback this L{Deferred}, they are delivered to L{on_result} instead.
+        @rtype: L{Deferred}
+
+        """
+        work = (self._process(device) for device in inventory)
+        coop = Cooperator()
+        workers = [coop.coiterate(work) for _ in range(self.concurrency)]
+        d = DeferredList(workers)
+        d.addCallback(lambda ign: (self.succeeded, self.failed))
+        return d
+
+    def _process(self, device):
+        """Run the job against a single device.
+
+        @return: A L{Deferred}, that never errbacks.
+        @rtype: L{Deferred}
+
+        """
+        d = maybeDeferred(prepare_device, device, self.hooks, lazy=self.lazy_hooks)
+        d.addCallback(self.connect)
+        d.addCallback(self._run_job)
+        d.addBoth(self._deliver, device)
+        return d
+
+    def _run_job(self, inst):
+        """Run the job and make sure the connection is closed afterwards."""
+        d = maybeDeferred(self.job, inst)
+        def close(res):
+            if not inst.eof and inst.transport is not None:
+                inst.transport.loseConnection()
+            return res
+        d.addBoth(close)
+        return d
+
+    def _deliver(self, res, device):
+        """Count the result and hand it to L{on_result}."""
+        if isinstance(res, Failure):
+            self.failed += 1
+        else:
+            self.succeeded += 1
+        if self.on_result is not None:
+            try:
+                self.on_result(device, res)
+            except Exception:
+                log.err(None, "Exception raised in the result handler for %s" %
+                        device.get('id'))
+        elif isinstance(res, Failure):
+            log.err(res, "Job failed for %s" % device.get('id'))
+
+
+def run_fleet(inventory, job, concurrency=100, hooks=(), on_result=None):
+    """Convenience function, see L{FleetRunner}.
+
+    @return: A L{Deferred}, that will be fired with a 2-tuple C{(succeeded, failed)}
+    @rtype: L{Deferred}
+
+    """
+    runner = FleetRunner(job, concurrency, hooks, on_result=on_result)
+    return runner.run(inventory)
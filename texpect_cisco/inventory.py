@@ -0,0 +1,373 @@
+'''
+@author: shylent
+
+Loading large inventories: the devices are read from CSV, JSON Lines or SQLite
+one at a time, so the whole inventory never has to be in memory, and are
+created as L{CompactDevice<texpect_cisco.platforms.CompactDevice>}s, so the
+defaults are not copied into every one of them. The hooks (see
+L{process_hooks<texpect_cisco.conf.process_hooks>}) are run over batches of
+devices, and the ones, that only depend on a few keys, can be memoized (see
+L{memoized}), so that they are run once per distinct combination of the
+values instead of once per device.
+
+    loader = InventoryLoader(hooks=hooks)
+    runner.run(loader.load(read_csv('inventory.csv')))
+'''
+import csv
+import json
+import sqlite3
+from collections import OrderedDict
+from twisted.python import log
+from texpect_cisco.compat import string_types, native
+from texpect_cisco.conf import ImproperlyConfigured
+from texpect_cisco.platforms import Platform, platforms
+
+
+# Columns, that are not strings
+default_converters = {
+    'port':int,
+    'ssh_port':int,
+    'connect_timeout':float,
+    'command_timeout':float,
+}
+
+
+def _open(source):
+    if isinstance(source, string_types):
+        if str is bytes:
+            return open(source, 'rb'), True
+        return open(source, 'r', newline=''), True
+    return source, False
+
+
+def read_csv(source, **kwargs):
+    """Read the devices from a CSV file with a header row, that names the keys.
+    Empty values are left out, so that the defaults apply.
+
+    @param source: A path or a file object
+    @param kwargs: Passed to C{csv.DictReader}
+
+    @return: An iterator over C{(line number, row)} pairs
+    @rtype: C{iterator}
+
+    """
+    f, close = _open(source)
+    try:
+        reader = csv.DictReader(f, **kwargs)
+        for row in reader:
+            yield reader.line_num, dict((key, value) for key, value in row.items()
+                                        if key and value)
+    finally:
+        if close:
+            f.close()
+
+
+def read_jsonl(source):
+    """Read the devices from a JSON Lines file: an object per line. The blank
+    lines are skipped. The lines, that are not valid JSON objects, are
+    reported by the loader (see L{InventoryLoader}).
+
+    @param source: A path or a file object
+
+    @return: An iterator over C{(line number, row)} pairs
+    @rtype: C{iterator}
+
+    """
+    f, close = _open(source)
+    try:
+        for number, line in enumerate(f):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as e:
+                row = ImproperlyConfigured('Not a valid JSON object: %s' % e)
+            else:
+                if isinstance(row, dict):
+                    row = _to_str(row)
+                else:
+                    row = ImproperlyConfigured('Not a JSON object: %r' % (row,))
+            yield number + 1, row
+    finally:
+        if close:
+            f.close()
+
+
+def read_json(source):
+    """Read the devices from a JSON file with an array of objects. Unlike the
+    other readers, this one has to parse the whole file at once, so the
+    large inventories are better kept as JSON Lines (see L{read_jsonl}). The
+    items, that are not objects, are reported by the loader.
+
+    @param source: A path or a file object
+
+    @return: An iterator over C{(position in the array, row)} pairs, the
+    positions start at 1
+    @rtype: C{iterator}
+
+    @raise ValueError: If the file is not valid JSON or is not an array
+
+    """
+    f, close = _open(source)
+    try:
+        rows = json.load(f)
+    finally:
+        if close:
+            f.close()
+    if not isinstance(rows, list):
+        raise ValueError('Not a JSON array: %s' % type(rows).__name__)
+    for number, row in enumerate(rows):
+        if isinstance(row, dict):
+            row = _to_str(row)
+        else:
+            row = ImproperlyConfigured('Not a JSON object: %r' % (row,))
+        yield number + 1, row
+
+
+def _to_str(row):
+    result = {}
+    for key, value in row.items():
+        if isinstance(value, string_types):
+            value = native(value, 'utf-8')
+        result[native(key, 'utf-8')] = value
+    return result
+
+
+def read_sqlite(source, query='SELECT * FROM devices', batch_size=1000):
+    """Read the devices from an SQLite database. The columns of the query are
+    the keys, the C{NULL}s are left out.
+
+    @param source: A path or an C{sqlite3} connection
+
+    @param query: The query, that selects the devices. Default: every row of the
+    'devices' table
+
+    @param batch_size: Number of rows, that are fetched at once. Default: 1000
+
+    @return: An iterator over C{(row number, row)} pairs
+    @rtype: C{iterator}
+
+    """
+    if isinstance(source, string_types):
+        connection, close = sqlite3.connect(source), True
+    else:
+        connection, close = source, False
+    try:
+        cursor = connection.cursor()
+        cursor.execute(query)
+        columns = [str(column[0]) for column in cursor.description]
+        number = 0
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            for values in rows:
+                number += 1
+                row = {}
+                for key, value in zip(columns, values):
+                    if value is not None:
+                        if isinstance(value, string_types):
+                            value = native(value, 'utf-8')
+                        row[key] = value
+                yield number, row
+        cursor.close()
+    finally:
+        if close:
+            connection.close()
+
+
+def memoized(hook, keys, max_entries=10000):
+    """Wrap a hook, that only depends on the values of a few keys of the device,
+    so that it is only called once for each combination of the values. The
+    hook should not modify the device. Failures are not remembered.
+
+    @param hook: The hook (see L{process_hooks<texpect_cisco.conf.process_hooks>})
+    @type hook: C{callable}
+
+    @param keys: The keys, the result depends on
+    @type keys: C{iterable}
+
+    @param max_entries: The maximum number of the remembered results, the least
+    recently used ones are forgotten. Default: 10000
+    @type max_entries: C{int}
+
+    @return: The memoizing hook. Its C{calls} and C{hits} attributes tell how
+    many times it has been called and how many of those were served from the memo
+    @rtype: C{callable}
+
+    """
+    keys = tuple(keys)
+    results = OrderedDict()
+    def memoizing_hook(device):
+        memoizing_hook.calls += 1
+        memo_key = tuple([device.get(key) for key in keys])
+        try:
+            result = results.pop(memo_key)
+        except KeyError:
+            result = hook(device)
+            if len(results) >= max_entries:
+                results.popitem(last=False)
+        else:
+            memoizing_hook.hits += 1
+        results[memo_key] = result
+        return result
+    memoizing_hook.calls = 0
+    memoizing_hook.hits = 0
+    return memoizing_hook
+
+
+class InventoryLoader(object):
+    """Turns the rows of an inventory into the devices.
+
+    The row is made into a L{CompactDevice<texpect_cisco.platforms.CompactDevice>}
+    of the platform, named by its 'platform' key (see
+    L{platforms<texpect_cisco.platforms.platforms>}), or of the default
+    platform. Then the hooks are run, each one over the whole batch before the
+    next one. A row, that can not be made into a device (a hook raises, the
+    platform is unknown), is reported and skipped, the loading goes on.
+
+    @ivar loaded: Number of devices, that were loaded
+    @type loaded: C{int}
+
+    @ivar errors: C{(line number, L{ImproperlyConfigured})} pairs for the rows,
+    that were skipped
+    @type errors: C{list}
+
+    """
+
+    def __init__(self, hooks=(), platform=None, platforms=platforms, batch_size=1000,
+                 converters=default_converters, force=False):
+        """
+        @param hooks: See L{process_hooks<texpect_cisco.conf.process_hooks>}.
+        Default: no hooks
+        @type hooks: C{iterable}
+
+        @param platform: The platform of the rows, that don't name one. Default:
+        a platform with just the L{device_defaults<texpect_cisco.cisco.device_defaults>}
+        @type platform: L{Platform<texpect_cisco.platforms.Platform>}
+
+        @param platforms: Platform name to L{Platform<texpect_cisco.platforms.Platform>}
+        mapping. Default: L{platforms<texpect_cisco.platforms.platforms>}
+        @type platforms: C{dict}
+
+        @param batch_size: Number of rows, the hooks are run over at once.
+        Default: 1000
+        @type batch_size: C{int}
+
+        @param converters: Key to callable mapping, the string values of these
+        keys are converted with. Default: L{default_converters}
+        @type converters: C{dict}
+
+        @param force: If C{True}, the hooks are run even for the keys, that are
+        already present in the row. The keys, that only have the platform
+        defaults, are always populated by the hooks. Default: C{False}
+        @type force: C{bool}
+
+        """
+        if platform is None:
+            platform = Platform('default', {})
+        self.hooks = tuple(hooks)
+        self.platform = platform
+        self.platforms = platforms
+        self.batch_size = batch_size
+        self.converters = converters
+        self.force = force
+        self.loaded = 0
+        self.errors = []
+
+    def load(self, rows):
+        """Load the devices.
+
+        @param rows: C{(line number, row)} pairs, as produced by L{read_csv},
+        L{read_jsonl}, L{read_json} or L{read_sqlite}. The row may be an L{ImproperlyConfigured}
+        instance, if the reader could not parse it.
+        @type rows: C{iterable}
+
+        @return: An iterator over the devices, suitable as the inventory of
+        L{FleetRunner<texpect_cisco.fleet.FleetRunner>}
+        @rtype: C{iterator}
+
+        """
+        batch = []
+        for number, row in rows:
+            device = self._device(number, row)
+            if device is not None:
+                batch.append((number, device))
+            if len(batch) >= self.batch_size:
+                for device in self._process(batch):
+                    yield device
+                batch = []
+        for device in self._process(batch):
+            yield device
+
+    def _reject(self, number, exc):
+        if not isinstance(exc, ImproperlyConfigured):
+            exc = ImproperlyConfigured("An exception was raised in the hook: %s" % exc)
+        log.msg("Skipping line %s of the inventory: %s" % (number, exc))
+        self.errors.append((number, exc))
+
+    def _device(self, number, row):
+        if isinstance(row, Exception):
+            self._reject(number, row)
+            return None
+        platform = self.platform
+        name = row.pop('platform', None)
+        if name is not None:
+            platform = self.platforms.get(name)
+            if platform is None:
+                self._reject(number, ImproperlyConfigured('Unknown platform: %s' % name))
+                return None
+        try:
+            for key, convert in self.converters.items():
+                if isinstance(row.get(key), string_types):
+                    row[key] = convert(row[key])
+        except ValueError as e:
+            self._reject(number, ImproperlyConfigured('Invalid value of %s: %s' % (key, e)))
+            return None
+        return platform.device(**row)
+
+    def _process(self, batch):
+        failed = set()
+        for attr_name, hook in self.hooks:
+            for ind, (number, device) in enumerate(batch):
+                # The platform defaults are there to be overridden by the hooks
+                if ind in failed or (device.has_own(attr_name) and not self.force):
+                    continue
+                try:
+                    device[attr_name] = hook(device)
+                except Exception as e:
+                    failed.add(ind)
+                    self._reject(number, e)
+        for ind, (number, device) in enumerate(batch):
+            if ind not in failed:
+                self.loaded += 1
+                yield device
+
+
+_readers = {
+    'csv':read_csv,
+    'jsonl':read_jsonl,
+    'json':read_json,
+    'db':read_sqlite,
+    'sqlite':read_sqlite,
+    'sqlite3':read_sqlite,
+}
+
+
+def load_inventory(path, hooks=(), **kwargs):
+    """Load the inventory from the file, choosing the reader by the extension
+    (C{.csv}, C{.jsonl}, C{.json}, C{.db}, C{.sqlite}, C{.sqlite3}).
+
+    @param kwargs: Passed to L{InventoryLoader}
+
+    @return: An iterator over the devices (see L{InventoryLoader.load}). Use
+    L{InventoryLoader} directly to see the rows, that were skipped
+    @rtype: C{iterator}
+
+    """
+    extension = path.rsplit('.', 1)[-1].lower()
+    reader = _readers.get(extension)
+    if reader is None:
+        raise ValueError('Unknown inventory format: %s' % path)
+    loader = InventoryLoader(hooks, **kwargs)
+    return loader.load(reader(path))
@@ -0,0 +1,172 @@
+'''
+@author: shylent
+'''
+import bisect
+
+
+# Upper bounds of the histogram buckets, in seconds
+default_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+class Histogram(object):
+    """A histogram with fixed buckets. Observing a value is cheap and the memory
+    used does not depend on the number of observations.
+
+    @ivar count: Number of observations
+    @type count: C{int}
+
+    @ivar sum: Sum of the observed values
+    @type sum: C{float}
+
+    """
+    __slots__ = ('buckets', 'counts', 'count', 'sum', 'min', 'max')
+
+    def __init__(self, buckets=default_buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def quantile(self, q):
+        """Estimate the quantile (the upper bound of the bucket, that contains it).
+
+        @param q: The quantile, from 0 to 1
+        @type q: C{float}
+
+        @return: The estimate or C{None} if nothing was observed
+        @rtype: C{float}
+
+        """
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for ind, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                if ind < len(self.buckets):
+                    return min(self.buckets[ind], self.max)
+                return self.max
+        return self.max
+
+    def snapshot(self):
+        """@return: The summary of the histogram
+        @rtype: C{dict}"""
+        return {
+            'count':self.count,
+            'sum':self.sum,
+            'min':self.min,
+            'max':self.max,
+            'mean':self.sum / self.count if self.count else None,
+            'p50':self.quantile(0.5),
+            'p99':self.quantile(0.99),
+            'buckets':list(zip(self.buckets + ('+Inf',), self.counts)),
+        }
+
+
+class Metrics(object):
+    """Collects the timings of the phases of L{Cisco<texpect_cisco.cisco.Cisco>}
+    sessions and the amount of data received, both per device and for the whole
+    fleet. A single instance is meant to be shared by all the sessions.
+
+    The phases, that are recorded by the sessions:
+        - B{connect}: establishing the TCP connection (recorded by
+        L{connect<texpect_cisco.fleet.connect>})
+        - B{password_prompt}: waiting for the password prompt
+        - B{login}: logging in, including the wait for the password prompt and
+        disabling the paging
+        - B{disable_paging}: running the 'disable_paging_command'
+        - B{enable}: entering the privileged EXEC mode
+        - B{first_byte}: from sending a command to receiving the first byte of
+        its output (the echo of the command is not counted)
+        - B{command}: from sending a command to receiving the prompt
+
+    The durations are measured with the monotonic clock, where there is one (not
+    on Python 2), so that adjusting the system time doesn't distort them.
+
+    @ivar per_device: Whether or not the per-device histograms are kept. With
+    a very large fleet, you might only want the fleet-wide ones.
+    @type per_device: C{bool}
+
+    """
+
+    def __init__(self, per_device=True, buckets=default_buckets):
+        self.per_device = per_device
+        self.buckets = buckets
+        self.fleet = {}
+        self.devices = {}
+        self.counters = {}
+        self.device_counters = {}
+
+    def _histogram(self, histograms, phase):
+        histogram = histograms.get(phase)
+        if histogram is None:
+            histogram = histograms[phase] = Histogram(self.buckets)
+        return histogram
+
+    def record(self, device_id, phase, seconds):
+        """Record the duration of a phase."""
+        self._histogram(self.fleet, phase).observe(seconds)
+        if self.per_device:
+            self._histogram(self.devices.setdefault(device_id, {}), phase).observe(seconds)
+
+    def count(self, device_id, name, amount=1):
+        """Increment a counter (number of bytes received, number of failures etc)."""
+        self.counters[name] = self.counters.get(name, 0) + amount
+        if self.per_device:
+            counters = self.device_counters.setdefault(device_id, {})
+            counters[name] = counters.get(name, 0) + amount
+
+    def forget(self, device_id):
+        """Drop the per-device data of the device (for example, when it is removed
+        from the inventory).
+
+        """
+        self.devices.pop(device_id, None)
+        self.device_counters.pop(device_id, None)
+
+    def dump(self):
+        """@return: Everything that was collected, as a (JSON-serializable) dictionary
+        @rtype: C{dict}"""
+        return {
+            'fleet':dict((phase, h.snapshot()) for phase, h in self.fleet.items()),
+            'counters':dict(self.counters),
+            'devices':dict((device_id, {
+                'phases':dict((phase, h.snapshot()) for phase, h in phases.items()),
+                'counters':dict(self.device_counters.get(device_id, {})),
+            }) for device_id, phases in self.devices.items()),
+        }
+
+    def exposition(self, prefix='texpect_cisco'):
+        """Render the fleet-wide metrics in the Prometheus text format, so that they
+        can be scraped.
+
+        @rtype: C{str}
+
+        """
+        lines = []
+        for phase, h in sorted(self.fleet.items()):
+            name = '%s_%s_seconds' % (prefix, phase)
+            lines.append('# TYPE %s histogram' % name)
+            cumulative = 0
+            for bound, count in zip(h.buckets + ('+Inf',), h.counts):
+                cumulative += count
+                lines.append('%s_bucket{le="%s"} %d' % (name, bound, cumulative))
+            lines.append('%s_sum %s' % (name, h.sum))
+            lines.append('%s_count %d' % (name, h.count))
+        for counter, value in sorted(self.counters.items()):
+            name = '%s_%s_total' % (prefix, counter)
+            lines.append('# TYPE %s counter' % name)
+            lines.append('%s %d' % (name, value))
+        return '\n'.join(lines) + '\n'
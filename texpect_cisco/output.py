@@ -0,0 +1,134 @@
+'''
+@author: shylent
+'''
+from texpect_cisco.compat import string_types, to_bytes
+
+
+class CommandOutput(object):
+    """The output of a command, represented as a part of the data, that was
+    received from the device, instead of a separate string. Nothing is copied
+    until the text is actually asked for, and even then only the requested part
+    is copied.
+
+    An instance compares equal to the string it represents.
+
+    @ivar buffer: The data, that was received while the command was running
+    @type buffer: C{str}
+
+    @ivar start: The offset of the first character of the output in L{buffer}
+    @type start: C{int}
+
+    @ivar end: The offset just past the last character of the output in L{buffer}
+    @type end: C{int}
+
+    @ivar command: The command, that was run
+    @type command: C{str}
+
+    @ivar prompt: The prompt, that has followed the output (C{None} if the command
+    resulted in a disconnection)
+    @type prompt: C{str}
+
+    @ivar started: The time the command was sent to the device (by the monotonic
+    clock, see L{duration})
+    @type started: C{float}
+
+    @ivar finished: The time the prompt was encountered (by the same clock)
+    @type finished: C{float}
+
+    """
+    __slots__ = ('buffer', 'start', 'end', 'command', 'prompt', 'started', 'finished')
+
+    def __init__(self, buffer, start=0, end=None, command=None, prompt=None,
+                 started=None, finished=None):
+        if end is None:
+            end = len(buffer)
+        self.buffer = buffer
+        self.start = start
+        self.end = end
+        self.command = command
+        self.prompt = prompt
+        self.started = started
+        self.finished = finished
+
+    @property
+    def duration(self):
+        """The number of seconds the command took to complete or C{None} if unknown"""
+        if self.started is None or self.finished is None:
+            return None
+        return self.finished - self.started
+
+    def __str__(self):
+        return self.buffer[self.start:self.end]
+
+    text = __str__
+
+    def __len__(self):
+        return self.end - self.start
+
+    def __nonzero__(self):
+        return self.end > self.start
+
+    __bool__ = __nonzero__
+
+    def __eq__(self, other):
+        if isinstance(other, CommandOutput):
+            other = str(other)
+        if not isinstance(other, string_types):
+            return NotImplemented
+        return len(other) == len(self) and \
+               self.buffer.startswith(other, self.start, self.end)
+
+    def __ne__(self, other):
+        res = self.__eq__(other)
+        if res is NotImplemented:
+            return res
+        return not res
+
+    __hash__ = None
+
+    def __repr__(self):
+        return '<CommandOutput %r: %d characters>' % (self.command, len(self))
+
+    def lines(self):
+        """Iterate over the lines of the output (without the line endings), copying
+        one line at a time.
+
+        @rtype: C{iterator}
+
+        """
+        buf, pos, end = self.buffer, self.start, self.end
+        if pos >= end:
+            return
+        while True:
+            nl = buf.find('\n', pos, end)
+            if nl == -1:
+                yield buf[pos:end].rstrip('\r')
+                return
+            line_end = nl
+            if line_end > pos and buf[line_end - 1] == '\r':
+                line_end -= 1
+            yield buf[pos:line_end]
+            pos = nl + 1
+
+    def view(self):
+        """@return: A C{memoryview} of the output, that doesn't copy the data at all
+        (on Python 3 the output is encoded, which does copy it)
+        @rtype: C{memoryview}"""
+        if isinstance(self.buffer, bytes):
+            return memoryview(self.buffer)[self.start:self.end]
+        return memoryview(to_bytes(str(self)))
+
+
+def strip_span(buf, start, end):
+    """Compute the offsets, that C{buf[start:end].strip()} would have, without
+    copying anything.
+
+    @return: C{(start, end)}
+    @rtype: C{tuple}
+
+    """
+    while start < end and buf[start].isspace():
+        start += 1
+    while end > start and buf[end - 1].isspace():
+        end -= 1
+    return start, end
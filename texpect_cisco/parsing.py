@@ -0,0 +1,369 @@
+'''
+@author: shylent
+'''
+import re
+from collections import OrderedDict
+from twisted.internet.defer import fail, maybeDeferred
+from texpect_cisco.cisco import TExpectCiscoError
+from texpect_cisco.compat import string_types
+
+
+class NoParserError(TExpectCiscoError):
+    """There is no template registered for the command"""
+
+
+START = 'Start'
+
+# Rule actions
+RECORD = 'Record'
+"""Emit the record after the values of the matching line are assigned"""
+NEW = 'New'
+"""Emit the record before the values of the matching line are assigned (the line
+starts a new record)"""
+
+
+class Template(object):
+    """A description of how to turn the output of a command into records.
+
+    The template is a state machine. Every state is a list of rules: C{(expression,
+    action, next_state)} tuples (the last two items are optional). The lines are
+    matched against the rules of the current state in order, the first rule, that
+    matches, wins: the named groups of the expression are assigned to the current
+    record, the L{action<RECORD>} is performed and the machine moves to the next
+    state (if given). Lines, that don't match any rule, are ignored.
+
+    Whatever is left in the record when the output ends is emitted as well, so a
+    template without any actions produces a single record (which is what you
+    want for C{'show version'} and the like).
+
+    The expressions are only compiled (once), when the template is first used.
+
+    @ivar name: The name of the template
+    @type name: C{str}
+
+    @ivar states: State name to rule list mapping
+    @type states: C{dict}
+
+    """
+
+    def __init__(self, name, states, fields=()):
+        """
+        @param name: The name of the template
+        @type name: C{str}
+
+        @param states: State name to rule list mapping, or just a list of rules for
+        a template with only the initial (L{START}) state
+        @type states: C{dict} or C{list}
+
+        @param fields: The names of the values, that every record should have (they
+        are set to C{None} if not encountered). Default: no fields
+        @type fields: C{iterable}
+
+        """
+        if not isinstance(states, dict):
+            states = {START:states}
+        if START not in states:
+            raise ValueError('Template %s has no %s state' % (name, START))
+        self.name = name
+        self.states = states
+        self.fields = tuple(fields)
+        self._compiled = None
+
+    def __repr__(self):
+        return '<Template %s>' % self.name
+
+    def compiled(self):
+        """@return: State name to the list of C{(compiled expression, action,
+        next state)} mapping, compiling it on the first call
+        @rtype: C{dict}"""
+        if self._compiled is None:
+            compiled = {}
+            for state, rules in self.states.items():
+                compiled[state] = [self._compile_rule(rule) for rule in rules]
+            self._compiled = compiled
+        return self._compiled
+
+    def _compile_rule(self, rule):
+        if isinstance(rule, string_types):
+            rule = (rule,)
+        expression, action, next_state = (tuple(rule) + (None, None))[:3]
+        if next_state is not None and next_state not in self.states:
+            raise ValueError('Template %s refers to unknown state %s' %
+                             (self.name, next_state))
+        return (re.compile(expression), action, next_state)
+
+    def parser(self):
+        """@return: A new incremental parser for this template
+        @rtype: L{Parser}"""
+        return Parser(self)
+
+    def parse(self, lines):
+        """Parse the output.
+
+        @param lines: The lines of the output (an iterable) or the whole output
+        (a string or L{CommandOutput<texpect_cisco.output.CommandOutput>})
+        @type lines: C{iterable} or C{str}
+
+        @return: An iterator over the records
+        @rtype: C{iterator}
+
+        """
+        if isinstance(lines, string_types):
+            lines = lines.splitlines()
+        elif hasattr(lines, 'lines'):
+            lines = lines.lines()
+        parser = self.parser()
+        for line in lines:
+            for record in parser.feed_line(line):
+                yield record
+        for record in parser.close():
+            yield record
+
+
+class Parser(object):
+    """An incremental parser. Lines can be fed to it as they arrive (for example
+    from L{stream_command<texpect_cisco.cisco.Cisco.stream_command>}), records are
+    returned as soon as they are complete.
+
+    """
+
+    def __init__(self, template):
+        self.template = template
+        self._states = template.compiled()
+        self._state = START
+        self._record = {}
+
+    def feed(self, lines):
+        """Parse some more lines.
+
+        @param lines: An iterable of lines (without line endings)
+
+        @return: The records, that were completed
+        @rtype: C{list}
+
+        """
+        records = []
+        for line in lines:
+            records.extend(self.feed_line(line))
+        return records
+
+    def feed_line(self, line):
+        """Parse a single line.
+
+        @return: The records, that were completed (at most two)
+        @rtype: C{list}
+
+        """
+        records = []
+        line = line.rstrip('\r')
+        for expression, action, next_state in self._states[self._state]:
+            match_obj = expression.search(line)
+            if match_obj is None:
+                continue
+            if action == NEW:
+                self._emit(records)
+            for key, value in match_obj.groupdict().items():
+                if value is not None:
+                    self._record[key] = value
+            if action == RECORD:
+                self._emit(records)
+            if next_state is not None:
+                self._state = next_state
+            break
+        return records
+
+    def close(self):
+        """Finish parsing.
+
+        @return: The last record, if there is one
+        @rtype: C{list}
+
+        """
+        records = []
+        self._emit(records)
+        return records
+
+    def _emit(self, records):
+        if not self._record:
+            return
+        record = dict.fromkeys(self.template.fields)
+        record.update(self._record)
+        records.append(record)
+        self._record = {}
+
+
+class ParserRegistry(object):
+    """Maps commands to templates. The command may be abbreviated in the same way
+    it can be abbreviated on the device (C{'sh ip int br'} finds the template for
+    C{'show ip interface brief'}), as long as the abbreviation is not ambiguous.
+
+    The templates, that the commands have been resolved to, are remembered, but
+    no more than L{max_entries} of them.
+
+    """
+
+    def __init__(self, templates=(), max_entries=1000):
+        """
+        @param templates: C{(command, template)} pairs to register
+        @type templates: C{iterable}
+
+        @param max_entries: The maximum number of the remembered lookups, the least
+        recently used ones are forgotten first. Default: 1000
+        @type max_entries: C{int}
+
+        """
+        self._templates = {}
+        self.max_entries = max_entries
+        self._lookup_cache = OrderedDict()
+        for command, template in templates:
+            self.register(command, template)
+
+    def register(self, command, template):
+        """Register the template for the command.
+
+        @param command: The command, as it would be typed on the device, in full
+        @type command: C{str}
+
+        @type template: L{Template}
+
+        """
+        self._templates[tuple(self._normalize(command))] = template
+        self._lookup_cache.clear()
+
+    def _normalize(self, command):
+        return command.lower().split()
+
+    def get(self, command):
+        """Find the template for the command.
+
+        @raise NoParserError: if there is no (unambiguous) template for the command
+
+        @rtype: L{Template}
+
+        """
+        words = tuple(self._normalize(command))
+        template = self._lookup_cache.pop(words, None)
+        if template is not None:
+            # Mark as the most recently used
+            self._lookup_cache[words] = template
+            return template
+        template = self._templates.get(words)
+        if template is None:
+            candidates = [t for key, t in self._templates.items()
+                          if len(key) == len(words) and
+                          all(full.startswith(word) for word, full in zip(words, key))]
+            if len(candidates) != 1:
+                raise NoParserError('No template for the command "%s"' % command,
+                                    command=command)
+            template = candidates[0]
+        self._lookup_cache[words] = template
+        while len(self._lookup_cache) > self.max_entries:
+            self._lookup_cache.popitem(last=False)
+        return template
+
+    def parse(self, command, output):
+        """Parse the output of the command, see L{Template.parse}.
+
+        @rtype: C{iterator}
+
+        """
+        return self.get(command).parse(output)
+
+
+def run_parsed(session, command, registry=None, consumer=None, **kwargs):
+    """Run the command and parse its output as it arrives (see
+    L{stream_command<texpect_cisco.cisco.Cisco.stream_command>}), so neither the
+    whole output, nor the parsing of it ever holds the reactor thread up.
+
+    @param session: A connected (and logged in) session
+    @type session: L{Cisco<texpect_cisco.cisco.Cisco>}
+
+    @param command: The command to be run
+    @type command: C{str}
+
+    @param registry: The registry to look the template up in.
+    Default: L{default_registry}
+    @type registry: L{ParserRegistry}
+
+    @param consumer: A callable, that will be called with every list of the
+    records, that were completed. Like the consumer of
+    L{stream_command<texpect_cisco.cisco.Cisco.stream_command>}, it may return a
+    L{Deferred} to signal, that it is not ready to accept more. Default: the
+    records are collected in a list
+    @type consumer: C{callable}
+
+    @param kwargs: Passed to L{stream_command<texpect_cisco.cisco.Cisco.stream_command>}
+
+    @return: A L{Deferred}, that fires with the list of records (or the number of
+    records handed to the L{consumer}, if there is one). Errback argument types are
+    the same as for L{stream_command<texpect_cisco.cisco.Cisco.stream_command>},
+    as well as L{NoParserError}.
+    @rtype: L{Deferred}
+
+    """
+    if registry is None:
+        registry = default_registry
+    try:
+        template = registry.get(command)
+    except NoParserError:
+        return fail()
+    parser = template.parser()
+    collected = []
+    counter = [0]
+    def deliver(records):
+        if not records:
+            return None
+        if consumer is None:
+            collected.extend(records)
+            return None
+        counter[0] += len(records)
+        return consumer(records)
+    def finish(ign):
+        d = maybeDeferred(deliver, parser.close())
+        if consumer is None:
+            d.addCallback(lambda ign: collected)
+        else:
+            d.addCallback(lambda ign: counter[0])
+        return d
+    kwargs['lines'] = True
+    d = session.stream_command(command, lambda lines: deliver(parser.feed(lines)),
+                               **kwargs)
+    d.addCallback(finish)
+    return d
+
+
+SHOW_IP_ARP = Template('show ip arp', [
+    (r'^(?P<protocol>\S+)\s+(?P<address>\d+\.\d+\.\d+\.\d+)\s+(?P<age>\S+)\s+'
+     r'(?P<mac>[0-9a-fA-F.]+|Incomplete)\s+(?P<type>\S+)(?:\s+(?P<interface>\S+))?\s*$',
+     RECORD),
+], fields=('protocol', 'address', 'age', 'mac', 'type', 'interface'))
+
+SHOW_VERSION = Template('show version', [
+    r'^Cisco (?P<software>.+?), Version (?P<version>[^\s,]+)',
+    r'^(?P<hostname>\S+) uptime is (?P<uptime>.+)$',
+    r'^System image file is "(?P<image>[^"]+)"',
+    r'^[Cc]isco (?P<model>\S+) .*\(.*\) processor',
+    r'^Processor board ID (?P<serial>\S+)',
+    r'^Configuration register is (?P<config_register>\S+)',
+], fields=('software', 'version', 'hostname', 'uptime', 'image', 'model',
+           'serial', 'config_register'))
+
+SHOW_INTERFACES = Template('show interfaces', [
+    (r'^(?P<interface>\S+) is (?P<status>.+?), line protocol is (?P<protocol>\S+)', NEW),
+    r'^\s+Hardware is (?P<hardware>[^,]+)(?:, address is (?P<mac>\S+))?',
+    r'^\s+Description: (?P<description>.*)$',
+    r'^\s+Internet address is (?P<ip_address>\S+)',
+    r'^\s+MTU (?P<mtu>\d+) bytes, BW (?P<bandwidth>\d+) Kbit',
+    r'^\s+\S+ minute input rate (?P<input_rate>\d+) bits/sec',
+    r'^\s+\S+ minute output rate (?P<output_rate>\d+) bits/sec',
+    r'^\s+(?P<input_errors>\d+) input errors',
+    r'^\s+(?P<output_errors>\d+) output errors',
+], fields=('interface', 'status', 'protocol', 'hardware', 'mac', 'description',
+           'ip_address', 'mtu', 'bandwidth', 'input_rate', 'output_rate',
+           'input_errors', 'output_errors'))
+
+default_registry = ParserRegistry([
+    ('show ip arp', SHOW_IP_ARP),
+    ('show version', SHOW_VERSION),
+    ('show interfaces', SHOW_INTERFACES),
+])
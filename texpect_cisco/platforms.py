@@ -0,0 +1,266 @@
+'''
+@author: shylent
+'''
+import re
+try:
+    from collections.abc import Mapping, MutableMapping
+except ImportError:
+    from collections import Mapping, MutableMapping
+from texpect_cisco.cisco import device_defaults
+from texpect_cisco.compat import string_types
+
+
+class Platform(object):
+    """A platform profile: the settings, that are shared by all the devices of
+    the same kind (IOS, NX-OS, ASA and so on). The regular expressions are
+    compiled once, when the profile is created, instead of once per device.
+
+    @ivar name: The name of the platform
+    @type name: C{str}
+
+    @ivar settings: The values of the device keys (see
+    L{Device<texpect_cisco.cisco.Device>}), that are common to all the devices
+    of this platform
+    @type settings: C{dict}
+
+    """
+    __slots__ = ('name', 'settings')
+
+    def __init__(self, name, settings, base=device_defaults):
+        """
+        @param name: The name of the platform
+        @type name: C{str}
+
+        @param settings: Platform-specific settings. String values of the keys,
+        that end with C{'prompt'}, are compiled.
+        @type settings: C{dict}
+
+        @param base: Settings, that are used unless overriden by L{settings}.
+        Default: L{device_defaults<texpect_cisco.cisco.device_defaults>}
+        @type base: C{dict}
+
+        """
+        self.name = name
+        self.settings = {}
+        if base is not None:
+            self.settings.update(base)
+        self.settings.update(settings)
+        for key, value in self.settings.items():
+            if key.endswith('prompt') and isinstance(value, string_types):
+                self.settings[key] = re.compile(value)
+
+    def __repr__(self):
+        return '<Platform %s>' % self.name
+
+    def device(self, **overrides):
+        """Create a L{CompactDevice} of this platform.
+
+        @param overrides: Per-device values (C{id}, C{address}, credentials
+        and anything, that differs from the platform settings)
+
+        @rtype: L{CompactDevice}
+
+        """
+        return CompactDevice(self, **overrides)
+
+
+class CompactDevice(object):
+    """A device, that only stores its own values and looks everything else up
+    in its L{Platform}. Can be used anywhere a L{Device<texpect_cisco.cisco.Device>}
+    can be used.
+
+    The most common per-device keys are stored in slots, everything else goes
+    to a dictionary, that is only created when the first such key is set.
+    Assigning a key (for example, by a hook) overrides the platform value for
+    this device only. Deleting a key, that is not overriden, raises C{KeyError}.
+
+    @note: This is not a subclass of C{MutableMapping}, because the ABCs do not
+    define C{__slots__} (on Python 2), which would give every instance a
+    C{__dict__}. It is registered as a virtual subclass instead.
+
+    """
+    __slots__ = ('platform', 'id', 'address', 'password', 'enable_password',
+                 '_extra')
+
+    _slot_keys = frozenset(['id', 'address', 'password', 'enable_password'])
+
+    def __init__(self, platform, **overrides):
+        """
+        @param platform: The platform profile
+        @type platform: L{Platform}
+
+        @param overrides: Per-device values
+
+        """
+        self.platform = platform
+        self._extra = None
+        for key, value in overrides.items():
+            self[key] = value
+
+    def __getitem__(self, key):
+        if key in self._slot_keys:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                raise KeyError(key)
+        if self._extra is not None and key in self._extra:
+            return self._extra[key]
+        return self.platform.settings[key]
+
+    def __setitem__(self, key, value):
+        if key in self._slot_keys:
+            setattr(self, key, value)
+        else:
+            if self._extra is None:
+                self._extra = {}
+            self._extra[key] = value
+
+    def __delitem__(self, key):
+        if key in self._slot_keys:
+            try:
+                delattr(self, key)
+            except AttributeError:
+                raise KeyError(key)
+        elif self._extra is not None and key in self._extra:
+            del self._extra[key]
+        else:
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        try:
+            self[key]
+        except KeyError:
+            return False
+        return True
+
+    def _own_keys(self):
+        keys = [key for key in self._slot_keys if hasattr(self, key)]
+        if self._extra is not None:
+            keys.extend(self._extra)
+        return keys
+
+    def has_own(self, key):
+        """@return: Whether the device has a value of its own for the key,
+        rather than the platform default
+        @rtype: C{bool}"""
+        if key in self._slot_keys:
+            return hasattr(self, key)
+        return self._extra is not None and key in self._extra
+
+    def __iter__(self):
+        own = self._own_keys()
+        for key in own:
+            yield key
+        for key in self.platform.settings:
+            if key not in own:
+                yield key
+
+    def __len__(self):
+        return len(set(self._own_keys()).union(self.platform.settings))
+
+    def __eq__(self, other):
+        if not isinstance(other, Mapping):
+            return NotImplemented
+        return dict(self.items()) == dict(other.items())
+
+    def __ne__(self, other):
+        res = self.__eq__(other)
+        if res is NotImplemented:
+            return res
+        return not res
+
+    __hash__ = None
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def setdefault(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            self[key] = default
+            return default
+
+    def keys(self):
+        return list(self)
+
+    def values(self):
+        return [self[key] for key in self]
+
+    def items(self):
+        return [(key, self[key]) for key in self]
+
+    def iteritems(self):
+        for key in self:
+            yield (key, self[key])
+
+    def update(self, other=(), **kwargs):
+        if hasattr(other, 'keys'):
+            other = [(key, other[key]) for key in other.keys()]
+        for key, value in other:
+            self[key] = value
+        for key, value in kwargs.items():
+            self[key] = value
+
+    def overrides(self):
+        """The values, that are specific to this device.
+
+        @rtype: C{dict}
+
+        """
+        return dict((key, self[key]) for key in self._own_keys())
+
+    def __repr__(self):
+        return '<CompactDevice %s: %r>' % (self.platform.name, self.overrides())
+
+MutableMapping.register(CompactDevice)
+
+
+_ios_prompts = {
+    'prompt':r'[\w.\-]+>\s*$',
+    'enabled_prompt':r'[\w.\-]+(\(config[^)]*\))?#\s*$',
+}
+
+# There is nothing cheaper on the classic IOS: the device still builds the whole
+# running configuration for the probe, only the transfer is saved
+IOS = Platform('ios', dict(_ios_prompts,
+    config_probe_command='show running-config | include ^! Last configuration change',
+    config_probe_pattern=r'^! Last configuration change'))
+
+# The configuration id (IOS XE 16 and later) is incremented with every change of
+# the running configuration and is read without building it
+IOS_XE = Platform('ios-xe', dict(_ios_prompts,
+    config_probe_command='show configuration id',
+    config_probe_pattern=r'\d'))
+
+# NX-OS has no unprivileged EXEC mode: the session starts at the '#' prompt, so
+# the jobs should not try to enable (see the 'enable' argument of bring_up). Telnet
+# is disabled by default. The probe is the "Running configuration last done at"
+# line (7.0(3)I7 and later); the device still builds the running configuration
+_nx_os_prompt = r'[\w.\-]+(\(config[^)]*\))?#\s*$'
+NX_OS = Platform('nx-os', {
+    'prompt':_nx_os_prompt,
+    'enabled_prompt':_nx_os_prompt,
+    'transport':'ssh',
+    'config_probe_command':'show running-config | include last.done.at',
+    'config_probe_pattern':r'^!Running configuration last done at',
+})
+
+ASA = Platform('asa', {
+    'prompt':r'[\w.\-/]+>\s*$',
+    'enabled_prompt':r'[\w.\-/]+(\(config[^)]*\))?#\s*$',
+    'disable_paging_command':'terminal pager 0',
+    'error_prefix':r'(?:ERROR:[ \t]*)?%',
+    'config_probe_command':'show version | include Configuration last modified',
+    'config_probe_pattern':r'Configuration last modified',
+})
+
+platforms = {
+    'ios':IOS,
+    'ios-xe':IOS_XE,
+    'nx-os':NX_OS,
+    'asa':ASA,
+}
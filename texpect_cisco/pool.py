@@ -0,0 +1,315 @@
+'''
+@author: shylent
+'''
+from collections import deque
+from twisted.python.failure import Failure
+from twisted.python import log
+from twisted.internet.defer import Deferred, maybeDeferred, fail
+from twisted.internet.task import LoopingCall
+from texpect_cisco.cisco import TExpectCiscoError, CiscoCommandError
+from texpect_cisco.fleet import connect
+
+
+class PoolClosed(TExpectCiscoError):
+    """An attempt was made to acquire a session from a pool, that has been closed"""
+
+
+class SessionPool(object):
+    """A pool of logged in (and, optionally, enabled) L{Cisco} sessions, keyed
+    by C{device['id']}.
+
+    Bringing a session up (connecting, logging in, disabling paging and entering
+    the privileged EXEC mode) is usually much more expensive, than running a
+    couple of show commands, so, when the same devices are polled periodically,
+    it makes sense to keep the sessions open between the polling cycles.
+
+    Sessions are taken from the pool with L{acquire} and must be returned with
+    L{release}. Idle sessions are periodically sent the keepalive command and
+    are closed once they've been idle for longer than L{idle_timeout}. Sessions,
+    that have been disconnected (C{eof} is set) are never handed out.
+
+    @ivar max_per_device: Maximum number of open sessions per device
+    @type max_per_device: C{int}
+
+    @ivar max_total: Maximum number of open sessions overall
+    @type max_total: C{int}
+
+    @ivar idle_timeout: Number of seconds after which an idle session is closed
+    @type idle_timeout: C{int}
+
+    @ivar keepalive_interval: Number of seconds of idleness after which the
+    keepalive command is sent to the session
+    @type keepalive_interval: C{int}
+
+    """
+
+    def __init__(self, connect=connect, enable=True, max_per_device=1,
+                 max_total=1000, idle_timeout=300, keepalive_interval=60,
+                 keepalive_command='', clock=None):
+        """
+        @param connect: A callable, that takes a device and returns a L{Deferred},
+        that fires with the connected L{Cisco} instance.
+        Default: L{connect<texpect_cisco.fleet.connect>}
+        @type connect: C{callable}
+
+        @param enable: Whether or not new sessions should enter the privileged
+        EXEC mode after logging in. Default: C{True}
+        @type enable: C{bool}
+
+        @param max_per_device: Maximum number of open sessions per device. Default: 1
+        @type max_per_device: C{int}
+
+        @param max_total: Maximum number of open sessions overall. Default: 1000
+        @type max_total: C{int}
+
+        @param idle_timeout: Number of seconds after which an idle session is
+        closed. Default: 300
+        @type idle_timeout: C{int}
+
+        @param keepalive_interval: Number of seconds of idleness after which the
+        keepalive command is sent. C{None} disables keepalives. Default: 60
+        @type keepalive_interval: C{int}
+
+        @param keepalive_command: The command, that is sent to keep the session
+        alive. The empty command just makes the device print the prompt again.
+        Default: C{''}
+        @type keepalive_command: C{str}
+
+        @param clock: An object, providing C{IReactorTime}. Default: the global reactor
+
+        """
+        if clock is None:
+            from twisted.internet import reactor as clock
+        self.connect = connect
+        self.enable = enable
+        self.max_per_device = max_per_device
+        self.max_total = max_total
+        self.idle_timeout = idle_timeout
+        self.keepalive_interval = keepalive_interval
+        self.keepalive_command = keepalive_command
+        self.clock = clock
+        self.closed = False
+        self._idle = {}
+        self._open = {}
+        self._total = 0
+        self._waiters = deque()
+        self._dispatching = False
+        self._maintenance = LoopingCall(self._maintain)
+        self._maintenance.clock = clock
+        intervals = [i for i in (idle_timeout, keepalive_interval) if i]
+        if intervals:
+            self._maintenance.start(min(intervals) / 2.0, now=False)
+
+    def acquire(self, device):
+        """Get a ready to use session for the device.
+
+        @param device: A L{Device<texpect_cisco.cisco.Device>} instance
+        @type device: C{dict}
+
+        @return: A L{Deferred}, that will be fired with a logged in L{Cisco}
+        instance, once one is available. Possible errback argument types are the
+        same as for L{login<texpect_cisco.cisco.Cisco.login>} and
+        L{enable<texpect_cisco.cisco.Cisco.enable>}, as well as L{PoolClosed}.
+        @rtype: L{Deferred}
+
+        """
+        if self.closed:
+            return fail(PoolClosed('The session pool is closed'))
+        d = Deferred()
+        self._waiters.append((device, d))
+        self._dispatch()
+        return d
+
+    def release(self, inst, broken=False):
+        """Return the session to the pool.
+
+        @param inst: A session, previously obtained with L{acquire}
+        @type inst: L{Cisco}
+
+        @param broken: If C{True}, the session is closed instead of being put back
+        to the pool, for example because a command timed out and the state of the
+        session is unknown. Default: C{False}
+        @type broken: C{bool}
+
+        """
+        if broken or inst.eof or self.closed:
+            self._discard(inst)
+        else:
+            inst._pool_last_used = inst._pool_last_seen = self.clock.seconds()
+            self._idle.setdefault(inst.device['id'], []).append(inst)
+        self._dispatch()
+
+    def run(self, device, func, *args, **kwargs):
+        """Acquire a session, call C{func(session, *args, **kwargs)} and release
+        the session, when the L{Deferred} returned by C{func} fires. The session
+        is considered broken if C{func} fails with anything but
+        L{CiscoCommandError<texpect_cisco.cisco.CiscoCommandError>}, since
+        the device is still in a known state after reporting a syntax error.
+
+        @return: A L{Deferred}, that will be fired with the result of C{func}
+        @rtype: L{Deferred}
+
+        """
+        def use(inst):
+            d = maybeDeferred(func, inst, *args, **kwargs)
+            def done(res):
+                broken = isinstance(res, Failure) and res.check(CiscoCommandError) is None
+                self.release(inst, broken)
+                return res
+            d.addBoth(done)
+            return d
+        d = self.acquire(device)
+        d.addCallback(use)
+        return d
+
+    def close(self):
+        """Close every idle session and fail every pending L{acquire}. Sessions,
+        that are in use at the moment, are closed when they are released.
+
+        """
+        self.closed = True
+        if self._maintenance.running:
+            self._maintenance.stop()
+        for sessions in list(self._idle.values()):
+            for inst in list(sessions):
+                self._discard(inst)
+        while self._waiters:
+            _, d = self._waiters.popleft()
+            d.errback(PoolClosed('The session pool is closed'))
+
+    def _dispatch(self):
+        """Try to satisfy as many pending L{acquire} calls as possible.
+        Firing the waiting L{Deferred}s may release sessions synchronously, so
+        reentrant calls just make the outermost one do another pass.
+
+        """
+        if self._dispatching:
+            self._redispatch = True
+            return
+        self._dispatching = True
+        try:
+            self._redispatch = True
+            while self._redispatch:
+                self._redispatch = False
+                for _ in range(len(self._waiters)):
+                    device, d = self._waiters.popleft()
+                    if not self._serve(device, d):
+                        self._waiters.append((device, d))
+        finally:
+            self._dispatching = False
+
+    def _serve(self, device, d):
+        """Hand an idle session to the waiter or start bringing up a new one.
+
+        @return: C{False} if the limits do not allow serving this waiter now
+        @rtype: C{bool}
+
+        """
+        dev_id = device['id']
+        idle = self._idle.get(dev_id)
+        while idle:
+            inst = idle.pop()
+            if inst.eof:
+                # The connection was lost while the session was idle
+                self._discard(inst)
+                idle = self._idle.get(dev_id)
+                continue
+            d.callback(inst)
+            return True
+        if self._open.get(dev_id, 0) >= self.max_per_device:
+            return False
+        if self._total >= self.max_total and not self._evict_one():
+            return False
+        self._bring_up(device).chainDeferred(d)
+        return True
+
+    def _evict_one(self):
+        """Close the least recently used idle session to make room for a new one.
+
+        @return: C{True} if a session was closed
+        @rtype: C{bool}
+
+        """
+        candidates = [sessions[0] for sessions in self._idle.values() if sessions]
+        if not candidates:
+            return False
+        self._discard(min(candidates, key=lambda inst: inst._pool_last_used))
+        return True
+
+    def _bring_up(self, device):
+        """Connect, log in and (optionally) enter the privileged EXEC mode."""
+        dev_id = device['id']
+        self._open[dev_id] = self._open.get(dev_id, 0) + 1
+        self._total += 1
+        d = maybeDeferred(self.connect, device)
+        def login(inst):
+            d = inst.bring_up(self.enable)
+            d.addErrback(lambda f: self._bring_up_failed(f, inst))
+            d.addCallback(lambda ign: inst)
+            return d
+        def failed(f):
+            self._forget(dev_id)
+            self._dispatch()
+            return f
+        d.addCallbacks(login, failed)
+        return d
+
+    def _bring_up_failed(self, failure, inst):
+        """Close the half-initialized session and pass the failure on."""
+        self._discard(inst)
+        self._dispatch()
+        return failure
+
+    def _discard(self, inst):
+        """Close the session and forget about it."""
+        dev_id = inst.device['id']
+        idle = self._idle.get(dev_id)
+        if idle and inst in idle:
+            idle.remove(inst)
+        if getattr(inst, '_pool_discarded', False):
+            return
+        inst._pool_discarded = True
+        self._forget(dev_id)
+        if not inst.eof and inst.transport is not None:
+            inst.transport.loseConnection()
+
+    def _forget(self, dev_id):
+        """Update the session counters after a session is gone."""
+        self._total -= 1
+        self._open[dev_id] -= 1
+        if not self._open[dev_id]:
+            del self._open[dev_id]
+            self._idle.pop(dev_id, None)
+
+    def _maintain(self):
+        """Drop broken and expired idle sessions and send keepalives to the rest."""
+        now = self.clock.seconds()
+        for sessions in list(self._idle.values()):
+            for inst in list(sessions):
+                idle_for = now - inst._pool_last_used
+                silent_for = now - inst._pool_last_seen
+                if inst.eof or (self.idle_timeout and idle_for >= self.idle_timeout):
+                    self._discard(inst)
+                elif self.keepalive_interval and silent_for >= self.keepalive_interval:
+                    sessions.remove(inst)
+                    self._keepalive(inst)
+        self._dispatch()
+
+    def _keepalive(self, inst):
+        """Send the keepalive command, the session is busy until it completes.
+        The keepalive does not count as using the session, so it doesn't postpone
+        the expiration of the session.
+
+        """
+        d = inst.run_command(self.keepalive_command)
+        def done(res):
+            if isinstance(res, Failure) or inst.eof or self.closed:
+                if isinstance(res, Failure) and inst.debug:
+                    log.err(res, "Keepalive failed for %s" % inst.device['id'])
+                self._discard(inst)
+            else:
+                inst._pool_last_seen = self.clock.seconds()
+                self._idle.setdefault(inst.device['id'], []).append(inst)
+            self._dispatch()
+        d.addBoth(done)
+        return d
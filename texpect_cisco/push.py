@@ -0,0 +1,228 @@
+'''
+@author: shylent
+'''
+import re
+from twisted.python import log
+from twisted.python.failure import Failure
+from twisted.internet.defer import fail, succeed
+from texpect_cisco.cisco import TExpectCiscoError, CiscoCommandError, NotConnected
+from texpect_cisco.compat import string_types
+
+
+_mode_pattern = re.compile(r'\((config[^)]*)\)#')
+
+
+class ConfigLine(object):
+    """The outcome of a single line of the configuration, that was pushed.
+
+    @ivar number: The number of the line in the pushed configuration (starting
+    from 1, the blank lines and the comments are counted, but not sent)
+    @type number: C{int}
+
+    @ivar line: The line, as it was sent
+    @type line: C{str}
+
+    @ivar mode: The configuration mode, the line was entered in (C{'config'},
+    C{'config-if'} and so on, as seen in the prompt, C{'exec'} if the
+    configuration mode has been left or C{None} if it is not known)
+    @type mode: C{str}
+
+    @ivar output: The output of the line (normally empty)
+    @type output: C{str}
+
+    @ivar error: The error, that the device reported for this line, or C{None}
+    @type error: L{CiscoCommandError<texpect_cisco.cisco.CiscoCommandError>}
+
+    """
+    __slots__ = ('number', 'line', 'mode', 'output', 'error')
+
+    def __init__(self, number, line, mode, output=None, error=None):
+        self.number = number
+        self.line = line
+        self.mode = mode
+        self.output = output
+        self.error = error
+
+    def __repr__(self):
+        return '<ConfigLine %d (%s) %r%s>' % (self.number, self.mode, self.line,
+                                             self.error and ' failed' or '')
+
+
+class ConfigPushError(TExpectCiscoError):
+    """The device has reported an error for a line of the configuration, that was
+    being pushed, and the push was stopped.
+
+    @ivar line: The line, that has failed
+    @type line: L{ConfigLine}
+
+    @ivar results: The outcome of every line, that was sent (including the ones,
+    that were sent in the same window after the failed one)
+    @type results: C{list} of L{ConfigLine}
+
+    """
+
+    def __init__(self, msg, line, results):
+        super(ConfigPushError, self).__init__(msg, command=line.line,
+                                              data=line.error and line.error.data)
+        self.line = line
+        self.results = results
+
+
+def _prompt_mode(prompt):
+    match_obj = _mode_pattern.search(prompt)
+    if match_obj is None:
+        return None
+    return match_obj.group(1)
+
+
+def push_config(session, config, window=50, stop_on_error=True, configure=True,
+                timeout=None):
+    """Push the configuration, sending the lines in windows instead of waiting for
+    the prompt after every line (see L{run_pipelined<texpect_cisco.cisco.Cisco.run_pipelined>}).
+    The echo of every line is still matched individually, so an error is
+    attributed to the exact line, that has caused it, and the configuration mode
+    every line was entered in is taken from the prompt before its echo.
+
+    The next window is only sent after the whole previous window has been
+    acknowledged by the device, so with L{stop_on_error}, at most C{window - 1}
+    lines are applied after the failed one.
+
+    @param session: A logged in session in the privileged EXEC mode (or in the
+    configuration mode already, if L{configure} is C{False})
+    @type session: L{Cisco<texpect_cisco.cisco.Cisco>}
+
+    @param config: The configuration: a string or an iterable of lines
+    @type config: C{str} or C{iterable}
+
+    @param window: Number of lines to send at once. Default: 50
+    @type window: C{int}
+
+    @param stop_on_error: If C{True}, nothing is sent after the window with the
+    first failed line, and the L{Deferred} fails with L{ConfigPushError}.
+    Otherwise, every line is sent and the errors are only reported in the
+    results. Default: C{True}
+    @type stop_on_error: C{bool}
+
+    @param configure: Whether or not to enter the configuration mode (with the
+    'configure_command' of the device, C{'configure terminal'} by default) before
+    and leave it (with C{'end'}) after pushing the configuration. C{'end'} is
+    sent even if the output of a line could not be read (the device is too
+    slow, for one), so that the session is not left in the configuration mode,
+    then the original failure is reported. Default: C{True}
+    @type configure: C{bool}
+
+    @param timeout: Override the instance-default timeout (for every line)
+    @type timeout: C{int}
+
+    @return: A L{Deferred}, that will be fired with a list of L{ConfigLine}s, an
+    item for each line, that was sent. Errback argument types are the same as for
+    L{run_command<texpect_cisco.cisco.Cisco.run_command>}, as well as
+    L{ConfigPushError}.
+    @rtype: L{Deferred}
+
+    """
+    if isinstance(config, string_types):
+        config = config.splitlines()
+    lines = []
+    for number, line in enumerate(config):
+        line = line.strip()
+        if line and not line.startswith('!'):
+            lines.append((number + 1, line))
+    if session.eof:
+        return fail(Failure(NotConnected('Not connected to %s at the moment' %
+                                         session.device['id'])))
+    if timeout is None:
+        timeout = session.timeout
+    prompt = session.device['enabled_prompt']
+    results = []
+    state = {'mode':configure and 'config' or None, 'failed':None}
+
+    if session.debug:
+        log.msg("Pushing %d lines of configuration to %s" %
+                (len(lines), session.device['id']))
+
+    def send_window(ign, start):
+        if start >= len(lines) or (stop_on_error and state['failed'] is not None):
+            return
+        chunk = lines[start:start + window]
+        # The errors are looked for here, so that the prompt of a failed line
+        # is known as well
+        d = session.run_pipelined([line for _, line in chunk], prompt=prompt,
+                                  timeout=timeout, process_errors=False,
+                                  as_output=True)
+        d.addCallback(window_done, chunk)
+        d.addCallback(send_window, start + window)
+        return d
+
+    def window_done(outputs, chunk):
+        for (number, line), output in zip(chunk, outputs):
+            result = ConfigLine(number, line, state['mode'], str(output))
+            results.append(result)
+            # The prompt (and the echo of the next line, if any) tells the mode
+            # of the next line
+            state['mode'] = _prompt_mode(output.prompt) or 'exec'
+            error = session.error_scanner.scan(output.buffer, output.start, output.end)
+            if error is not None:
+                result.error = CiscoCommandError(
+                    'An error was reported by the device "%s" while running the command "%s"' %
+                        (session.device['id'], line),
+                    command=line,
+                    error=error.text(),
+                    data=result.output)
+                if state['failed'] is None:
+                    state['failed'] = result
+
+    def abort(failure):
+        if not session.eof:
+            d = session.run_command('end', prompt=prompt, timeout=timeout)
+            d.addBoth(lambda ign: failure)
+            return d
+        return failure
+
+    def finish(ign):
+        failed = state['failed']
+        if stop_on_error and failed is not None:
+            return Failure(ConfigPushError(
+                'Line %d of the configuration ("%s") has failed on "%s", stopped' %
+                    (failed.number, failed.line, session.device['id']),
+                failed, results))
+        return results
+
+    if configure:
+        d = session.run_command(session.device.get('configure_command',
+                                                   'configure terminal'),
+                                prompt=prompt, timeout=timeout)
+    else:
+        d = succeed(None)
+    d.addCallback(send_window, 0)
+    if configure:
+        d.addCallbacks(lambda ign: session.run_command('end', prompt=prompt,
+                                                       timeout=timeout),
+                       abort)
+    d.addCallback(finish)
+    return d
+
+
+def push_job(config, enable=True, exit=True, **kwargs):
+    """Build a job (see L{FleetRunner<texpect_cisco.fleet.FleetRunner>}), that
+    pushes the configuration to every device.
+
+    @param kwargs: Passed to L{push_config}
+
+    @return: A callable, that takes a connected L{Cisco<texpect_cisco.cisco.Cisco>}
+    instance and returns a L{Deferred}, that fires with the list of L{ConfigLine}s
+    @rtype: C{callable}
+
+    """
+    if not isinstance(config, string_types):
+        config = list(config)
+    def job(inst):
+        result = []
+        d = inst.bring_up(enable)
+        d.addCallback(lambda ign: push_config(inst, config, **kwargs))
+        d.addCallback(result.append)
+        if exit:
+            d.addCallback(lambda ign: inst.exit())
+        d.addCallback(lambda ign: result[0])
+        return d
+    return job
@@ -0,0 +1,424 @@
+'''
+@author: shylent
+
+Running a job against the fleet in several processes, so that more than one
+core is used: a single reactor can only use one, and with thousands of
+sessions matching the prompts and processing the output is enough to keep it
+busy.
+
+The coordinator (L{ShardedRunner}) starts the worker processes and hands the
+devices out to them in batches, as the results come back, so a slow worker is
+simply given less work. Once the inventory is exhausted, the devices, that a
+worker has not started yet, are taken back from it and given to the ones,
+that have spare capacity. Every worker runs the job with its own reactor
+(see L{FleetRunner<texpect_cisco.fleet.FleetRunner>}).
+
+The worker processes can not be handed the job itself, so it is named: the
+fully qualified name of a callable, that builds the job (such as
+L{command_job<texpect_cisco.fleet.command_job>}), and its arguments. The
+results and the exceptions are pickled.
+'''
+import os
+import sys
+import struct
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+from collections import deque, OrderedDict
+from twisted.python import log, reflect
+from twisted.python.failure import Failure
+from twisted.internet.defer import Deferred, DeferredList
+from twisted.internet.protocol import Protocol, ProcessProtocol
+from twisted.internet.task import Cooperator
+from texpect_cisco.cisco import TExpectCiscoError
+
+
+class WorkerLost(TExpectCiscoError):
+    """The worker process, that was running the job for the device, has exited"""
+
+
+class WorkerError(TExpectCiscoError):
+    """The job has failed in the worker process with an exception, that could
+    not be passed back as is"""
+
+
+def _frame(message):
+    data = pickle.dumps(message, pickle.HIGHEST_PROTOCOL)
+    return struct.pack('>I', len(data)) + data
+
+
+class _Frames(object):
+    """Splits the stream into the length-prefixed pickled messages."""
+
+    def __init__(self):
+        self._buf = b''
+
+    def feed(self, data):
+        """@return: The messages, that are complete now
+        @rtype: C{list}"""
+        self._buf += data
+        messages = []
+        while len(self._buf) >= 4:
+            length = struct.unpack('>I', self._buf[:4])[0]
+            if len(self._buf) < 4 + length:
+                break
+            messages.append(pickle.loads(self._buf[4:4 + length]))
+            self._buf = self._buf[4 + length:]
+        return messages
+
+
+class _WorkerProcess(ProcessProtocol):
+    """The coordinator's side of a worker process.
+
+    @ivar outstanding: The devices, that were handed to the worker and have no
+    result yet, keyed by their sequence numbers
+    @type outstanding: C{OrderedDict}
+
+    """
+
+    def __init__(self, runner, number):
+        self.runner = runner
+        self.number = number
+        self.outstanding = OrderedDict()
+        self.completed = 0
+        self.releasing = False
+        self.stopping = False
+        self._frames = _Frames()
+
+    def connectionMade(self):
+        self.runner._started(self)
+
+    def send(self, message):
+        self.transport.write(_frame(message))
+
+    def outReceived(self, data):
+        for message in self._frames.feed(data):
+            self.runner._message(self, message)
+
+    def errReceived(self, data):
+        log.msg('Worker %d: %s' % (self.number, data.rstrip()))
+
+    def processEnded(self, reason):
+        self.runner._ended(self, reason)
+
+
+class ShardedRunner(object):
+    """Run a job against the devices in several worker processes (see the module
+    docstring). The interface is the same as that of
+    L{FleetRunner<texpect_cisco.fleet.FleetRunner>}, except for how the job and
+    the hooks are specified.
+
+    @ivar processes: Number of worker processes
+    @type processes: C{int}
+
+    @ivar concurrency: Maximum number of devices processed simultaneously by
+    each worker
+    @type concurrency: C{int}
+
+    @ivar prefetch: Number of devices, that a worker is given in addition to
+    the ones it is processing, so that it does not wait for more. These are the
+    ones, that are moved to the other workers, if need be
+    @type prefetch: C{int}
+
+    """
+
+    def __init__(self, job, job_args=(), hooks=None, processes=None, concurrency=100,
+                 prefetch=None, on_result=None, reactor=None, executable=None):
+        """
+        @param job: Fully qualified name of a callable, that builds the job (see
+        L{command_job<texpect_cisco.fleet.command_job>}), for example
+        C{'texpect_cisco.fleet.command_job'}
+        @type job: C{str}
+
+        @param job_args: The arguments for the callable. Must be picklable.
+        Default: no arguments
+        @type job_args: C{tuple}
+
+        @param hooks: Fully qualified name of the hooks (see
+        L{process_hooks<texpect_cisco.conf.process_hooks>}) or C{None}. Default:
+        C{None}
+        @type hooks: C{str}
+
+        @param processes: See L{processes}. Default: the number of CPUs
+        @param concurrency: See L{concurrency}. Default: 100
+        @param prefetch: See L{prefetch}. Default: half of L{concurrency}
+
+        @param on_result: A callable, that will be called with the device and the
+        result of the job (or a L{Failure}) for every device as soon as the job
+        is done. Default: C{None}
+        @type on_result: C{callable}
+
+        @param reactor: The reactor to use. Default: the global reactor
+
+        @param executable: The Python interpreter for the workers. Default: the
+        current one
+
+        """
+        if concurrency < 1:
+            raise ValueError('concurrency must be a positive integer')
+        if processes is None:
+            import multiprocessing
+            processes = multiprocessing.cpu_count()
+        if prefetch is None:
+            prefetch = max(1, concurrency // 2)
+        if reactor is None:
+            from twisted.internet import reactor
+        self.job = job
+        self.job_args = tuple(job_args)
+        self.hooks = hooks
+        self.processes = processes
+        self.concurrency = concurrency
+        self.prefetch = prefetch
+        self.on_result = on_result
+        self.reactor = reactor
+        self.executable = executable or sys.executable
+        self.succeeded = 0
+        self.failed = 0
+        self._workers = []
+        self._requeued = deque()
+        self._inventory = None
+        self._exhausted = False
+        self._sequence = 0
+        self._done = None
+
+    def run(self, inventory):
+        """Run the job against every device in the inventory.
+
+        @param inventory: An iterable of device dictionaries. It is consumed
+        lazily. The devices must be picklable.
+        @type inventory: C{iterable}
+
+        @return: A L{Deferred}, that will be fired with a 2-tuple C{(succeeded, failed)}
+        when every device has been processed and the workers have exited.
+        Failures of individual devices are delivered to L{on_result}, the
+        devices, that were being processed by a worker, that has exited
+        unexpectedly, fail with L{WorkerLost}.
+        @rtype: L{Deferred}
+
+        """
+        self._inventory = iter(inventory)
+        self._done = Deferred()
+        # The workers import the job from where this process would
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+        for number in range(self.processes):
+            worker = _WorkerProcess(self, number)
+            self._workers.append(worker)
+            self.reactor.spawnProcess(worker, self.executable,
+                                      [self.executable, '-m', 'texpect_cisco.shard'],
+                                      env=env)
+        return self._done
+
+    def _started(self, worker):
+        worker.send(('setup', self.job, self.job_args, self.hooks, self.concurrency))
+        self._dispatch()
+
+    def _next_device(self):
+        if self._requeued:
+            return self._requeued.popleft()
+        if self._exhausted:
+            return None
+        try:
+            device = next(self._inventory)
+        except StopIteration:
+            self._exhausted = True
+            return None
+        self._sequence += 1
+        return (self._sequence, device)
+
+    def _live(self):
+        return [worker for worker in self._workers
+                if worker.transport is not None and not worker.stopping]
+
+    def _dispatch(self):
+        """Top up the workers, the least loaded ones first, then take back the
+        work, that has not been started, if some of the workers are idle."""
+        workers = sorted(self._live(), key=lambda worker: len(worker.outstanding))
+        for worker in workers:
+            batch = []
+            # There is nothing to prefetch for, once the inventory is exhausted
+            limit = self.concurrency + (not self._exhausted and self.prefetch or 0)
+            while len(worker.outstanding) < limit:
+                item = self._next_device()
+                if item is None:
+                    break
+                worker.outstanding[item[0]] = item[1]
+                batch.append(item)
+            if batch:
+                worker.send(('run', batch))
+        if self._exhausted and not self._requeued:
+            self._rebalance(workers)
+            self._finish()
+
+    def _rebalance(self, workers):
+        if not any(len(worker.outstanding) < self.concurrency for worker in workers):
+            return
+        for worker in workers:
+            if len(worker.outstanding) > self.concurrency and not worker.releasing:
+                worker.releasing = True
+                worker.send(('release',))
+
+    def _message(self, worker, message):
+        kind = message[0]
+        if kind == 'result':
+            device = worker.outstanding.pop(message[1])
+            worker.completed += 1
+            self._deliver(message[2], device)
+        elif kind == 'failure':
+            device = worker.outstanding.pop(message[1])
+            worker.completed += 1
+            exc = message[2]
+            if not isinstance(exc, Exception):
+                exc = WorkerError(exc)
+            self._deliver(Failure(exc), device)
+        elif kind == 'released':
+            worker.releasing = False
+            for key, device in message[1]:
+                del worker.outstanding[key]
+                self._requeued.append((key, device))
+        elif kind == 'error':
+            log.msg('Worker %d has failed: %s' % (worker.number, message[1]))
+        self._dispatch()
+
+    def _ended(self, worker, reason):
+        self._workers.remove(worker)
+        if not worker.stopping:
+            log.msg('Worker %d has exited unexpectedly: %s' %
+                    (worker.number, reason.getErrorMessage()))
+        for device in worker.outstanding.values():
+            self._deliver(Failure(WorkerLost('The worker, that was processing %s, '
+                                             'has exited' % device.get('id'))), device)
+        worker.outstanding.clear()
+        if not self._live():
+            # Nobody is left to process the rest
+            while True:
+                item = self._next_device()
+                if item is None:
+                    break
+                self._deliver(Failure(WorkerLost('No workers are left')), item[1])
+        self._dispatch()
+        if not self._workers and self._done is not None:
+            done, self._done = self._done, None
+            done.callback((self.succeeded, self.failed))
+
+    def _finish(self):
+        if any(worker.outstanding for worker in self._workers):
+            return
+        for worker in self._live():
+            worker.stopping = True
+            worker.send(('stop',))
+
+    def _deliver(self, res, device):
+        """Count the result and hand it to L{on_result}."""
+        if isinstance(res, Failure):
+            self.failed += 1
+        else:
+            self.succeeded += 1
+        if self.on_result is not None:
+            try:
+                self.on_result(device, res)
+            except Exception:
+                log.err(None, "Exception raised in the result handler for %s" %
+                        device.get('id'))
+        elif isinstance(res, Failure):
+            log.err(res, "Job failed for %s" % device.get('id'))
+
+
+class _Worker(Protocol):
+    """The worker's side: receives the devices on the standard input, runs the
+    job against them and writes the results to the standard output."""
+
+    def __init__(self, reactor):
+        self.reactor = reactor
+        self.runner = None
+        self.pending = deque()
+        self.stopping = False
+        self._keys = {}
+        self._waiters = []
+        self._frames = _Frames()
+
+    def send(self, message):
+        self.transport.write(_frame(message))
+
+    def dataReceived(self, data):
+        for message in self._frames.feed(data):
+            getattr(self, 'do_' + message[0])(*message[1:])
+
+    def do_setup(self, job, job_args, hooks, concurrency):
+        from texpect_cisco.fleet import FleetRunner
+        try:
+            job = reflect.namedAny(job)(*job_args)
+            hooks = hooks and reflect.namedAny(hooks) or ()
+        except Exception as e:
+            self.send(('error', '%s: %s' % (e.__class__.__name__, e)))
+            self.transport.loseConnection()
+            return
+        self.runner = FleetRunner(job, concurrency, hooks, on_result=self._result)
+        coop = Cooperator()
+        work = self._work()
+        d = DeferredList([coop.coiterate(work) for _ in range(concurrency)])
+        d.addCallback(lambda ign: self.transport.loseConnection())
+
+    def do_run(self, batch):
+        self.pending.extend(batch)
+        self._wake()
+
+    def do_release(self):
+        released = list(self.pending)
+        self.pending.clear()
+        self.send(('released', released))
+
+    def do_stop(self):
+        self.stopping = True
+        self._wake()
+
+    def _wake(self):
+        waiters, self._waiters = self._waiters, []
+        for waiter in waiters:
+            waiter.callback(None)
+
+    def _work(self):
+        while True:
+            if self.pending:
+                key, device = self.pending.popleft()
+                self._keys[id(device)] = key
+                yield self.runner._process(device)
+            elif self.stopping:
+                return
+            else:
+                waiter = Deferred()
+                self._waiters.append(waiter)
+                yield waiter
+
+    def _result(self, device, res):
+        key = self._keys.pop(id(device))
+        if not isinstance(res, Failure):
+            try:
+                self.send(('result', key, res))
+                return
+            except Exception as e:
+                res = Failure(WorkerError('The result can not be pickled: %s' % e))
+        try:
+            self.send(('failure', key, res.value))
+        except Exception:
+            self.send(('failure', key, '%s: %s' % (res.type.__name__, res.getErrorMessage())))
+
+    def connectionLost(self, reason):
+        self.stopping = True
+        self._wake()
+        if self.reactor.running:
+            self.reactor.stop()
+
+
+def worker_main():
+    """The entry point of a worker process."""
+    from twisted.internet import reactor
+    from twisted.internet.stdio import StandardIO
+    StandardIO(_Worker(reactor))
+    reactor.run()
+
+
+if __name__ == '__main__':
+    # So that the exceptions are pickled as texpect_cisco.shard.*, not __main__.*
+    from texpect_cisco.shard import worker_main
+    worker_main()
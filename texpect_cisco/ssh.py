@@ -0,0 +1,395 @@
+'''
+@author: shylent
+'''
+from twisted.python import log
+from twisted.python.failure import Failure
+from twisted.internet.defer import Deferred, succeed, fail
+from twisted.internet.error import ConnectionDone
+from twisted.internet.protocol import ClientFactory
+from twisted.conch.ssh import session
+from twisted.conch.ssh.channel import SSHChannel
+from twisted.conch.ssh.connection import SSHConnection
+from twisted.conch.ssh.transport import SSHClientTransport
+from twisted.conch.ssh.userauth import SSHUserAuthClient
+from texpect_cisco.cisco import Cisco, TExpectCiscoError, LoginFailed, Disconnected
+from texpect_cisco.compat import native, to_bytes, monotonic
+
+
+class HostKeyMismatch(TExpectCiscoError):
+    """The host key of the device does not match the 'host_key_fingerprint'"""
+
+
+class ChannelRejected(TExpectCiscoError):
+    """The device has refused to open a session channel on the connection"""
+
+
+class _ShellChannel(SSHChannel):
+    """An interactive shell on the device. Serves as the transport of the
+    session: the data, received on the channel, is handed to the session and
+    whatever the session writes is sent over the channel.
+
+    """
+    name = b'session'
+
+    def __init__(self, protocol, opened, terminal=('vt100', 24, 80), **kwargs):
+        SSHChannel.__init__(self, **kwargs)
+        self.protocol = protocol
+        self.opened = opened
+        self.terminal = terminal
+        self.paused = False
+        self.disconnecting = False
+        self._released = False
+
+    def channelOpen(self, specificData):
+        term, rows, columns = self.terminal
+        d = self.conn.sendRequest(self, b'pty-req', session.packRequest_pty_req(
+            to_bytes(term), (rows, columns, 0, 0), b''), wantReply=True)
+        d.addCallback(lambda ign: self.conn.sendRequest(self, b'shell', b'',
+                                                        wantReply=True))
+        def started(ign):
+            self.protocol.makeConnection(self)
+            opened, self.opened = self.opened, None
+            opened.callback(self.protocol)
+        d.addCallbacks(started, self._failed)
+
+    def openFailed(self, reason):
+        # The channel has never been opened, so there is nothing to close
+        self._release()
+        if self.opened is not None:
+            opened, self.opened = self.opened, None
+            opened.errback(Failure(ChannelRejected(
+                'The device has refused to open a session channel: %s' % (reason,))))
+
+    def _release(self):
+        if not self._released:
+            self._released = True
+            self.conn.channel_closed(self)
+
+    def _failed(self, failure):
+        if self.opened is not None:
+            opened, self.opened = self.opened, None
+            opened.errback(failure)
+            self.loseConnection()
+
+    def dataReceived(self, data):
+        self.protocol.dataReceived(data)
+
+    def loseConnection(self):
+        self.disconnecting = True
+        SSHChannel.loseConnection(self)
+
+    def closed(self):
+        self._release()
+        if self.opened is not None:
+            self._failed(Failure(Disconnected('The channel has been closed')))
+        elif self.protocol.transport is self:
+            self.protocol.connectionLost(Failure(ConnectionDone()))
+
+    def pauseProducing(self):
+        """Stop receiving: the window of this channel is not replenished, so the
+        device stops sending on it, while the rest of the channels go on.
+
+        """
+        self.paused = True
+
+    def resumeProducing(self):
+        self.paused = False
+        self.conn.adjustWindow(self, self.localWindowSize - self.localWindowLeft)
+
+    stopProducing = loseConnection
+
+
+class _Connection(SSHConnection):
+    """The connection service: the shell channels of the sessions share it."""
+
+    def __init__(self, connector, key, ready):
+        SSHConnection.__init__(self)
+        self.connector = connector
+        self.key = key
+        self.ready = ready
+        self.open_channels = 0
+        # The number of the channels the device allows, once it has refused one
+        self.capacity = None
+        self.idle_call = None
+
+    def serviceStarted(self):
+        SSHConnection.serviceStarted(self)
+        ready, self.ready = self.ready, None
+        ready.callback(self)
+
+    def serviceStopped(self):
+        SSHConnection.serviceStopped(self)
+        self.connector._forget(self)
+
+    def adjustWindow(self, channel, bytesToAdd):
+        if getattr(channel, 'paused', False):
+            return
+        if bytesToAdd > 0:
+            SSHConnection.adjustWindow(self, channel, bytesToAdd)
+
+    def open_shell(self, protocol, terminal):
+        self._cancel_idle()
+        self.open_channels += 1
+        opened = Deferred()
+        self.openChannel(_ShellChannel(protocol, opened, terminal, conn=self))
+        return opened
+
+    def channel_closed(self, channel):
+        self.open_channels -= 1
+        if not self.open_channels:
+            self.connector._idle(self)
+
+    def _cancel_idle(self):
+        if self.idle_call is not None and self.idle_call.active():
+            self.idle_call.cancel()
+        self.idle_call = None
+
+    def close(self):
+        self._cancel_idle()
+        self.transport.loseConnection()
+
+
+class _UserAuth(SSHUserAuthClient):
+    """Authenticates with the 'password' of the device (the password and the
+    keyboard-interactive methods), trying it only once.
+
+    """
+
+    def __init__(self, user, instance, password):
+        SSHUserAuthClient.__init__(self, user, instance)
+        self.password = password
+        self._tried = set()
+
+    def _once(self, method):
+        if method in self._tried or self.password is None:
+            return None
+        self._tried.add(method)
+        return succeed(to_bytes(self.password))
+
+    def getPassword(self, prompt=None):
+        return self._once('password')
+
+    def getGenericAnswers(self, name, instruction, prompts):
+        answers = self._once('keyboard-interactive')
+        if answers is None:
+            return fail(LoginFailed('Authentication failed'))
+        return answers.addCallback(lambda password: [password] * len(prompts))
+
+    def getPublicKey(self):
+        return None
+
+
+class _Transport(SSHClientTransport):
+
+    def verifyHostKey(self, hostKey, fingerprint):
+        expected = self.factory.device.get('host_key_fingerprint')
+        fingerprint = native(fingerprint)
+        if expected is None:
+            log.msg('WARNING: the host key of %s (%s) is not verified, since '
+                    'there is no host_key_fingerprint for it' %
+                    (self.factory.device.get('id'), fingerprint))
+        elif expected != fingerprint:
+            exc = HostKeyMismatch('Host key of %s is %s, expected %s' %
+                                  (self.factory.device.get('id'), fingerprint, expected))
+            self.factory.failed(exc)
+            return fail(exc)
+        return succeed(True)
+
+    def connectionSecure(self):
+        device = self.factory.device
+        self.connection = _Connection(self.factory.connector, self.factory.key,
+                                      self.factory.ready)
+        self.requestService(_UserAuth(to_bytes(device['username']), self.connection,
+                                      device.get('password')))
+
+    def connectionLost(self, reason):
+        SSHClientTransport.connectionLost(self, reason)
+        # Only matters if it never got as far as the connection service
+        self.factory.failed(LoginFailed(
+            'Failed to establish an SSH connection to %s: %s' %
+            (self.factory.device.get('id'), reason.getErrorMessage())))
+
+
+class _TransportFactory(ClientFactory):
+    protocol = _Transport
+
+    def __init__(self, connector, key, device, ready):
+        self.connector = connector
+        self.key = key
+        self.device = device
+        self.ready = ready
+
+    def failed(self, exc):
+        ready, self.ready = self.ready, None
+        if ready is not None and not ready.called:
+            ready.errback(Failure(exc))
+
+    def clientConnectionFailed(self, connector, reason):
+        ready, self.ready = self.ready, None
+        if ready is not None and not ready.called:
+            ready.errback(reason)
+
+
+class SSHConnector(object):
+    """Opens the sessions as shell channels over SSH connections. The connections
+    are reused: a session to a device, that already has a connection (with the
+    same address, port and user name), is opened on that connection, so the key
+    exchange and the authentication are only done once. A connection, that has
+    no sessions left, is kept open for L{idle_timeout} seconds.
+
+    Many devices allow fewer sessions per connection, than L{max_channels} (a
+    single one, quite often). When a device refuses to open a channel on a
+    connection, that already has sessions, the connection is not used for more
+    sessions, than it has, and the session is opened on another connection.
+
+    @ivar max_channels: The maximum number of sessions on a single connection
+    (when there are more, another connection is established)
+    @type max_channels: C{int}
+
+    @ivar idle_timeout: Number of seconds a connection without sessions is kept
+    open for
+    @type idle_timeout: C{float}
+
+    """
+
+    def __init__(self, max_channels=8, idle_timeout=60, terminal=('vt100', 24, 80),
+                 reactor=None):
+        """
+        @param max_channels: See L{max_channels}. Default: 8
+        @param idle_timeout: See L{idle_timeout}. Default: 60
+        @param terminal: C{(type, rows, columns)} of the pseudo-terminal, that is
+        requested for every session. Default: C{('vt100', 24, 80)}
+        @param reactor: The reactor to use. Default: the global reactor
+
+        """
+        if reactor is None:
+            from twisted.internet import reactor
+        self.max_channels = max_channels
+        self.idle_timeout = idle_timeout
+        self.terminal = terminal
+        self.reactor = reactor
+        self._connections = {}
+        self._connecting = {}
+
+    def connections(self, device):
+        """@return: The established connections to the device
+        @rtype: C{list}"""
+        return list(self._connections.get(self._key(device), ()))
+
+    def _key(self, device):
+        return (device['address'], device.get('ssh_port', 22), device.get('username'))
+
+    def connect(self, device, protocol=Cisco, metrics=None):
+        """Open a session to the device.
+
+        @param device: A L{Device<texpect_cisco.cisco.Device>} instance. The
+        'username' and 'password' keys are used to authenticate, 'ssh_port' is
+        the port to connect to.
+        @type device: C{dict}
+
+        @param protocol: The protocol class to instantiate. Default: L{Cisco}
+        @type protocol: C{type}
+
+        @param metrics: See L{connect<texpect_cisco.fleet.connect>}
+
+        @return: A L{Deferred}, that will be fired with the connected L{Cisco}
+        instance. Errback argument types: the connection errors, L{LoginFailed},
+        L{HostKeyMismatch} and L{ChannelRejected}.
+        @rtype: L{Deferred}
+
+        """
+        started = monotonic()
+        if metrics is None:
+            inst = protocol(device)
+        else:
+            inst = protocol(device, metrics=metrics)
+        d = self._connection(device)
+        d.addCallback(self._open_shell, device, inst)
+        if metrics is not None:
+            def record(res):
+                if isinstance(res, Failure):
+                    metrics.count(device.get('id'), 'connect_failed')
+                else:
+                    metrics.record(device.get('id'), 'connect', monotonic() - started)
+                return res
+            d.addBoth(record)
+        return d
+
+    def _open_shell(self, conn, device, inst):
+        d = conn.open_shell(inst, self.terminal)
+        def rejected(failure):
+            failure.trap(ChannelRejected)
+            if not conn.open_channels:
+                # Not because of the other sessions
+                return failure
+            conn.capacity = conn.open_channels
+            d = self._connection(device)
+            d.addCallback(self._open_shell, device, inst)
+            return d
+        d.addErrback(rejected)
+        return d
+
+    def _connection(self, device):
+        key = self._key(device)
+        for conn in self._connections.get(key, ()):
+            if conn.open_channels < min(self.max_channels, conn.capacity or self.max_channels):
+                return succeed(conn)
+        connecting = self._connecting.get(key)
+        if connecting is not None and connecting[1] < self.max_channels:
+            # Share the connection, that is being established
+            connecting[1] += 1
+            d = Deferred()
+            connecting[0].append(d)
+            return d
+        waiters = [Deferred()]
+        self._connecting[key] = [waiters, 1]
+        ready = Deferred()
+        def done(res):
+            if self._connecting.get(key, [None])[0] is waiters:
+                del self._connecting[key]
+            if not isinstance(res, Failure):
+                self._connections.setdefault(key, []).append(res)
+            for waiter in waiters:
+                waiter.callback(res)
+        ready.addBoth(done)
+        factory = _TransportFactory(self, key, device, ready)
+        self.reactor.connectTCP(device['address'], device.get('ssh_port', 22),
+                                factory, device.get('connect_timeout', 30))
+        return waiters[0]
+
+    def _idle(self, conn):
+        if conn.idle_call is None:
+            conn.idle_call = self.reactor.callLater(self.idle_timeout, conn.close)
+
+    def _forget(self, conn):
+        conn._cancel_idle()
+        connections = self._connections.get(conn.key, [])
+        if conn in connections:
+            connections.remove(conn)
+        if not connections:
+            self._connections.pop(conn.key, None)
+
+    def close(self):
+        """Close every connection (and thus every session)."""
+        for connections in list(self._connections.values()):
+            for conn in list(connections):
+                conn.close()
+
+
+_connectors = {}
+
+
+def connect(device, protocol=Cisco, reactor=None, metrics=None):
+    """Open an SSH session to the device, reusing the connections (there is an
+    L{SSHConnector} per reactor). The same as L{connect<texpect_cisco.fleet.connect>},
+    but over SSH.
+
+    @rtype: L{Deferred}
+
+    """
+    if reactor is None:
+        from twisted.internet import reactor
+    connector = _connectors.get(reactor)
+    if connector is None:
+        connector = _connectors[reactor] = SSHConnector(reactor=reactor)
+    return connector.connect(device, protocol, metrics)
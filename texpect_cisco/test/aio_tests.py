@@ -0,0 +1,52 @@
+'''
+@author: shylent
+
+Python 3 only, like L{texpect_cisco.aio} itself.
+'''
+import asyncio
+from twisted.trial import unittest
+from twisted.internet.defer import Deferred
+from texpect_cisco import aio
+from texpect_cisco.test.simulator import SimulatedDevice, listen
+
+
+class AsyncSessionTestCase(unittest.TestCase):
+
+    def setUp(self):
+        from twisted.internet import reactor
+        if type(reactor).__name__ != 'AsyncioSelectorReactor':
+            raise unittest.SkipTest('Needs the asyncio reactor (trial --reactor=asyncio)')
+        self.loop = reactor._asyncioEventloop
+        config = SimulatedDevice(hostname='sim')
+        port = listen(config)
+        self.addCleanup(port.stopListening)
+        self.device = config.device('127.0.0.1', port.getHost().port, command_timeout=2)
+
+    def go(self, coroutine):
+        return Deferred.fromFuture(asyncio.ensure_future(coroutine, loop=self.loop))
+
+    def test_session(self):
+        async def session():
+            async with aio.session(self.device) as inst:
+                self.assertTrue(inst.enabled)
+                self.assertEqual(await inst.run_command('show clock'),
+                                 '*10:00:00.000 UTC Mon Mar 1 1993')
+            self.assertTrue(inst.eof)
+        return self.go(session())
+
+    def test_stream(self):
+        async def stream():
+            async with aio.session(self.device) as inst:
+                output = inst.stream('show synthetic 10000', lines=True, max_pending=4)
+                lines = [line async for line in output]
+            self.assertEqual(len(lines), 135)
+            self.assertTrue(output.count)
+        return self.go(stream())
+
+    def test_error_closes(self):
+        async def failing():
+            with self.assertRaises(ZeroDivisionError):
+                async with aio.session(self.device) as inst:
+                    1 / 0
+            self.assertTrue(inst.session.transport.disconnecting)
+        return self.go(failing())
@@ -0,0 +1,124 @@
+'''
+@author: shylent
+'''
+from twisted.trial import unittest
+from twisted.internet.defer import succeed, fail
+from texpect_cisco.cisco import CiscoCommandError
+from texpect_cisco.backup import ConfigStore, DirectoryConfigStore, StoredConfig, \
+    collect_config, config_digest
+
+
+CONFIG = """Building configuration...
+
+Current configuration : 1024 bytes
+!
+! Last configuration change at 10:00:00 UTC Mon Mar 1 1993
+!
+hostname switch
+!
+interface Gi0/1
+ description uplink
+!
+end"""
+
+
+class FakeSession(object):
+
+    def __init__(self, outputs, **device):
+        self.device = dict(device, id='switch')
+        self.outputs = outputs
+        self.commands = []
+
+    def run_command(self, command):
+        self.commands.append(command)
+        output = self.outputs[command]
+        if isinstance(output, Exception):
+            return fail(output)
+        return succeed(output)
+
+
+class DigestTestCase(unittest.TestCase):
+
+    def test_volatile_lines(self):
+        changed = CONFIG.replace('1024', '1025').replace('10:00:00', '11:00:00')
+        self.assertEqual(config_digest(CONFIG), config_digest(changed + '\r\n'))
+        self.assertNotEqual(config_digest(CONFIG),
+                            config_digest(CONFIG.replace('uplink', 'downlink')))
+
+
+class CollectTestCase(unittest.TestCase):
+
+    probe = 'show running-config | include ^! Last configuration change'
+
+    def setUp(self):
+        self.store = ConfigStore()
+        self.session = FakeSession({
+            self.probe:'! Last configuration change at 10:00:00 UTC Mon Mar 1 1993',
+            'show running-config':CONFIG,
+        }, config_probe_command=self.probe, config_probe_pattern='^! Last configuration')
+
+    def collect(self, **kwargs):
+        results = []
+        collect_config(self.session, self.store, **kwargs).addCallback(results.append)
+        return results[0]
+
+    def test_first(self):
+        res = self.collect()
+        self.failUnless(res.changed and res.fetched)
+        self.assertEqual(self.store.get('switch').config, CONFIG)
+        self.assertEqual(self.session.commands, [self.probe, 'show running-config'])
+
+    def test_probe_unchanged(self):
+        self.collect()
+        self.session.commands = []
+        res = self.collect()
+        self.failIf(res.changed or res.fetched)
+        self.assertEqual(self.session.commands, [self.probe])
+
+    def test_probe_changed(self):
+        self.collect()
+        self.session.outputs[self.probe] = '! Last configuration change at 11:00:00'
+        res = self.collect()
+        self.failUnless(res.fetched)
+        self.failIf(res.changed)
+        self.assertEqual(self.store.get('switch').fingerprint,
+                         '! Last configuration change at 11:00:00')
+        self.session.outputs['show running-config'] = CONFIG.replace('uplink', 'core')
+        res = self.collect(force=True)
+        self.failUnless(res.changed)
+        self.assertEqual(self.store.get('switch').config,
+                         self.session.outputs['show running-config'])
+
+    def test_probe_unknown(self):
+        for output in ['', '\r\n', 'garbage',
+                       CiscoCommandError('Invalid input', command=self.probe)]:
+            self.session.outputs[self.probe] = output
+            self.collect()
+            self.session.commands = []
+            res = self.collect()
+            self.failUnless(res.fetched)
+            self.assertEqual(self.session.commands, [self.probe, 'show running-config'])
+            self.failUnlessIdentical(self.store.get('switch').fingerprint, None)
+
+    def test_no_probe(self):
+        del self.session.device['config_probe_command']
+        self.collect()
+        res = self.collect()
+        self.failIf(res.changed)
+        self.assertEqual(self.session.commands, ['show running-config'] * 2)
+
+
+class DirectoryConfigStoreTestCase(unittest.TestCase):
+
+    def test_roundtrip(self):
+        store = DirectoryConfigStore(self.mktemp())
+        d = store.put('switch', StoredConfig(CONFIG, 'abc', 'probe', 1, 2))
+        d.addCallback(lambda ign: store.get('switch'))
+        def check(stored):
+            self.assertEqual(stored.config, CONFIG)
+            self.assertEqual(stored.metadata(), {'digest':'abc', 'fingerprint':'probe',
+                                                 'changed':1, 'checked':2})
+        d.addCallback(check)
+        d.addCallback(lambda ign: store.get('router'))
+        d.addCallback(self.failUnlessIdentical, None)
+        return d
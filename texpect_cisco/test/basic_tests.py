@@ -3,9 +3,15 @@
 '''
 from twisted.trial import unittest
 from texpect_cisco.cisco import Cisco, UnexpectedResultError, Disconnected,\
-    NotConnected, LoginFailed
+    NotConnected, LoginFailed, CiscoCommandError, StreamInProgress
 import re
 from twisted.internet.protocol import Protocol, ServerFactory, ClientCreator
+from twisted.test.proto_helpers import StringTransport
+from twisted.internet.defer import Deferred, succeed
+from twisted.internet.error import ConnectionDone
+from twisted.python.failure import Failure
+from texpect_cisco.compat import native, to_bytes
+from texpect import RequestTimeout
 
 device = {'id':'device', 'address':'localhost', 'port':2300, 'command_timeout':1,
           'password_prompt':'Password:', 'password':'p4ssw0rD',
@@ -20,12 +26,12 @@ class CiscoTestCase(unittest.TestCase):
 class OneShotServer(Protocol):
 
     def connectionMade(self):
-        self.transport.write(self.factory.greeting)
+        self.transport.write(to_bytes(self.factory.greeting))
         
     def dataReceived(self, data):
-        for byte in data:
-            self.transport.write(byte)
-        self.transport.write(self.factory.response)
+        for i in range(len(data)):
+            self.transport.write(data[i:i + 1])
+        self.transport.write(to_bytes(self.factory.response))
         if self.factory._disconnect:
             self.loseConnection(self)
     
@@ -156,6 +162,11 @@ class CommandResultTestCase(unittest.TestCase):
     
     def setUp(self):
         self.c = Cisco(device)
+        self.c.makeConnection(StringTransport())
+    
+    def received(self, data, prompt):
+        self.c.dataReceived(data)
+        return self.successResultOf(self.c.expect([prompt]))
     
     def test_return_as_is(self):
         self.assertEqual(self.c._process_command_result((0, None, '\ta line\r\nanother line\n '), 'show run',
@@ -163,25 +174,134 @@ class CommandResultTestCase(unittest.TestCase):
     
     def test_strip_prompt(self):
         prompt = re.compile('bar>$')
-        self.c._buf = '\ta line\r\nanother line\n bar>'
-        result = self.c._process_buffer([prompt])
+        result = self.received('\ta line\r\nanother line\n bar>', prompt)
         self.assertEqual(self.c._process_command_result(result, 'show run', strip_command=False, strip_prompt=True, process_errors=False),
                          'a line\r\nanother line')
 
     def test_strip_command(self):
         prompt = re.compile('bar>$')
-        self.c._buf = 'show run\ta line\r\nanother line\n bar>'
-        result = self.c._process_buffer([prompt])
+        result = self.received('show run\ta line\r\nanother line\n bar>', prompt)
         self.assertEqual(self.c._process_command_result(result, 'show run', strip_command=True, strip_prompt=False, process_errors=False),
                          'a line\r\nanother line\n bar>')
     
     def test_strip_command_and_prompt(self):
         prompt = re.compile('bar>$')
-        self.c._buf = 'show run\ta line\r\nanother line\n bar>'
-        result = self.c._process_buffer([prompt])
+        result = self.received('show run\ta line\r\nanother line\n bar>', prompt)
         self.assertEqual(self.c._process_command_result(result, 'show run', strip_command=True, strip_prompt=True, process_errors=False),
                          'a line\r\nanother line')
     
+    def test_as_output(self):
+        prompt = re.compile('bar>$')
+        result = self.received('show run\ta line\r\nanother line\n bar>', prompt)
+        output = self.c._process_command_result(result, 'show run', strip_command=True,
+                strip_prompt=True, process_errors=True, as_output=True)
+        self.assertEqual(output, 'a line\r\nanother line')
+        self.assertEqual(output.prompt, 'bar>')
+    
+    def test_as_output_error(self):
+        prompt = re.compile('bar>$')
+        result = self.received('foo\r\n% Unknown command or computer name\r\nbar>', prompt)
+        res = self.c._process_command_result(result, 'foo', strip_command=True,
+                strip_prompt=True, process_errors=True, as_output=True)
+        res.trap(CiscoCommandError)
+        self.assertEqual(res.value.data, '% Unknown command or computer name')
+    
+class OffloadTestCase(unittest.TestCase):
+    
+    def setUp(self):
+        self.c = Cisco(device)
+        self.offloaded = []
+        def offload(func, *args, **kwargs):
+            self.offloaded.append(func)
+            return succeed(func(*args, **kwargs))
+        self.c._offload = offload
+    
+    def test_disabled(self):
+        res = self.c._on_command_result((0, None, 'x' * 100), 'foo', False, False, False)
+        self.assertEqual(res, 'x' * 100)
+        self.assertEqual(self.offloaded, [])
+    
+    def test_threshold(self):
+        self.c.offload_threshold = 10
+        self.assertEqual(self.c._on_command_result((0, None, 'x' * 9), 'foo',
+                                                   False, False, False), 'x' * 9)
+        self.assertEqual(self.offloaded, [])
+        d = self.c._on_command_result((0, None, 'x' * 10), 'foo', False, False, False)
+        d.addCallback(self.assertEqual, 'x' * 10)
+        self.assertEqual(len(self.offloaded), 1)
+        return d
+    
+    def test_device_key(self):
+        self.assertEqual(Cisco(dict(device, offload_threshold=1024)).offload_threshold, 1024)
+    
+    def test_thread_pool(self):
+        from twisted.python.threadpool import ThreadPool
+        class CountingPool(ThreadPool):
+            calls = 0
+            def callInThreadWithCallback(self, *args, **kwargs):
+                self.calls += 1
+                return ThreadPool.callInThreadWithCallback(self, *args, **kwargs)
+        pool = CountingPool(1, 1)
+        pool.start()
+        self.addCleanup(pool.stop)
+        c = Cisco(dict(device, offload_threshold=64))
+        c.threadpool = pool
+        c.makeConnection(StringTransport())
+        d = c.run_command('show clock', prompt='device>$')
+        c.dataReceived('show clock\r\n10:00:00\r\ndevice>')
+        self.assertEqual(self.successResultOf(d), '10:00:00')
+        self.assertEqual(pool.calls, 0)
+        d = c.run_command('show run', prompt='device>$')
+        c.dataReceived('show run\r\n' + 'x' * 64 + '\r\ndevice>')
+        # The result is delivered to the reactor thread, when the pool is done
+        self.assertNoResult(d)
+        self.assertEqual(pool.calls, 1)
+        d.addCallback(self.assertEqual, 'x' * 64)
+        return d
+    
+class IncrementalScanTestCase(unittest.TestCase):
+    
+    def setUp(self):
+        self.c = Cisco(device)
+        self.c.makeConnection(StringTransport())
+        self.c.scan_window = 16
+    
+    def test_search_from_scanned(self):
+        from texpect_cisco.cisco import _IncrementalPattern
+        pattern = _IncrementalPattern(re.compile('bar>'), 16)
+        self.failIf(pattern.search('x' * 100))
+        # Already scanned data is not scanned again
+        self.assertEqual(pattern.search('bar>' + 'x' * 96 + 'bar>').start(), 100)
+        self.assertEqual(pattern.pattern, 'bar>')
+    
+    def test_shorter(self):
+        from texpect_cisco.cisco import _IncrementalPattern
+        pattern = _IncrementalPattern(re.compile('bar>'), 16)
+        self.failIf(pattern.search('x' * 100))
+        self.assertEqual(pattern.search('bar>').start(), 0)
+    
+    def test_incremental(self):
+        positions = []
+        class Pattern(object):
+            pattern = 'bar>'
+            def search(self, string, pos=0, endpos=None):
+                positions.append(pos)
+                return re.compile('bar>').search(string, pos)
+        d = self.c.expect([Pattern()])
+        for _ in range(3):
+            self.c.dataReceived('x' * 100)
+        self.c.dataReceived('bar>')
+        d.addCallback(lambda res: self.assertEqual(res[1].start(), 300))
+        d.addCallback(lambda ign: self.assertEqual(positions[-3:], [84, 184, 284]))
+        return d
+    
+    def test_each_expect_scans_anew(self):
+        self.c.dataReceived('bar>' + 'x' * 100)
+        d = self.failUnlessFailure(self.c.expect(['foo>'], timeout=0.01), RequestTimeout)
+        d.addCallback(lambda ign: self.c.read_until('bar>'))
+        d.addCallback(self.assertEqual, 'bar>')
+        return d
+    
 class DeviceErrorsTestCase(unittest.TestCase):
     
     def setUp(self):
@@ -235,4 +355,304 @@ rest of data"""
 rest of the output"""
         self.assertEqual(self.c._process_device_errors(data),
                          (['% Unknown command or computer name, or unable to find computer address'],
-                          ['rest of the output']))
\ No newline at end of file
+                          ['rest of the output']))
+
+class BatchTestCase(unittest.TestCase):
+    
+    def setUp(self):
+        self.transport = StringTransport()
+        self.c = Cisco(device)
+        self.c.makeConnection(self.transport)
+    
+    def test_pipeline_pattern(self):
+        pattern = self.c._pipeline_pattern(re.compile('device>$', re.I), 'show users')
+        self.failUnless(pattern.search('10:00\r\nDEVICE>show users\r\n'))
+        self.failUnless(pattern.flags & re.I)
+    
+    def test_pipeline_pattern_anchors(self):
+        for prompt in (r'device#\s*$', r'device#\s+$', r'device# *\Z', r'device#\s?$'):
+            pattern = self.c._pipeline_pattern(prompt, 'show users')
+            self.failUnless(pattern.search('10:00\r\ndevice#show users\r\n'), prompt)
+            self.failUnless(pattern.search('10:00\r\ndevice# show users\r\n'), prompt)
+            self.failIf(pattern.search('10:00\r\ndevice#\r\nshow users\r\n'), prompt)
+        # An escaped dollar sign is a part of the prompt
+        pattern = self.c._pipeline_pattern(r'device\$', 'show users')
+        self.failUnless(pattern.search('device$show users'))
+    
+    def test_not_connected(self):
+        self.c.connectionLost(Failure(ConnectionDone()))
+        failure = self.failureResultOf(self.c.run_pipelined(['show clock', 'show users']),
+                                       NotConnected)
+        self.assertEqual(failure.value.command, 'show clock; show users')
+    
+    def test_pipelined(self):
+        d = self.c.run_commands(['show clock', 'show users '], prompt=re.compile('device>$'))
+        self.assertEqual(native(self.transport.value()), 'show clock\nshow users\n')
+        self.c.dataReceived('show clock\r\n10:00:00\r\ndevice>show users\r\n'
+                            'nobody\r\ndevice>')
+        d.addCallback(self.assertEqual, ['10:00:00', 'nobody'])
+        return d
+    
+    def test_error_in_batch(self):
+        d = self.c.run_commands(['foo', 'show users'], prompt='device>$')
+        self.c.dataReceived("foo\r\n% Unknown command or computer name\r\n"
+                            "device>show users\r\nnobody\r\ndevice>")
+        self.failUnlessFailure(d, CiscoCommandError)
+        return d
+    
+    def test_collect_errors(self):
+        d = self.c.run_commands(['foo', 'show users'], prompt='device>$',
+                                collect_errors=True)
+        self.c.dataReceived("foo\r\n% Unknown command or computer name\r\n"
+                            "device>show users\r\nnobody\r\ndevice>")
+        def check(res):
+            res[0].trap(CiscoCommandError)
+            self.assertEqual(res[1], 'nobody')
+        d.addCallback(check)
+        return d
+    
+    def test_run_pipelined(self):
+        d = self.c.run_pipelined(['show clock', 'show users'], prompt='device>$',
+                                 as_output=True)
+        self.c.dataReceived('show clock\r\n10:00:00\r\ndevice>show users\r\n'
+                            'nobody\r\ndevice>')
+        def check(res):
+            self.assertEqual([str(output) for output in res], ['10:00:00', 'nobody'])
+            self.assertEqual([output.prompt for output in res],
+                             ['device>show users', 'device>'])
+        d.addCallback(check)
+        return d
+
+class StreamTestCase(unittest.TestCase):
+    
+    def setUp(self):
+        self.transport = StringTransport()
+        self.c = Cisco(device)
+        self.c.makeConnection(self.transport)
+        self.chunks = []
+    
+    def test_stream(self):
+        d = self.c.stream_command('show tech', self.chunks.append, prompt='device>$',
+                                  window=16)
+        self.c.dataReceived('show tech\r\n' + 'x' * 38 + '\r\n' + 'x' * 16)
+        self.assertEqual(''.join(self.chunks), 'x' * 38 + '\r\n')
+        self.c.dataReceived('y' * 10 + '\r\ndevice>')
+        self.assertEqual(''.join(self.chunks), 'x' * 38 + '\r\n' + 'x' * 16 + 'y' * 10)
+        d.addCallback(self.assertEqual, 66)
+        return d
+    
+    def test_stream_lines(self):
+        d = self.c.stream_command('show run', self.chunks.extend, prompt='device>$',
+                                  lines=True, window=8)
+        self.c.dataReceived('show run\r\nline one\r\nline two\r\nline th')
+        self.assertEqual(self.chunks, ['line one'])
+        self.c.dataReceived('ree\r\nend\r\ndevice>')
+        self.assertEqual(self.chunks, ['line one', 'line two', 'line three', 'end'])
+        return d
+    
+    def test_split_echo(self):
+        d = self.c.stream_command('show version', self.chunks.append, prompt='device>$',
+                                  window=32)
+        self.c.dataReceived('show version')
+        self.c.dataReceived('\r\n')
+        self.assertEqual(self.chunks, [])
+        self.c.dataReceived('IOS 15\r\n' + 'x' * 10)
+        self.assertEqual(self.chunks, ['IOS 15\r\n'])
+        self.c.dataReceived('\r\ndevice>')
+        return d
+    
+    def test_long_first_line(self):
+        d = self.c.stream_command('show tech', self.chunks.append, prompt='device>$',
+                                  window=16)
+        self.c.dataReceived('show tech\r\n' + 'x' * 100)
+        # Held back no longer, than the window allows
+        self.assertEqual(self.chunks, ['x' * 84])
+        self.c.dataReceived('\r\ndevice>')
+        d.addCallback(self.assertEqual, 100)
+        return d
+    
+    def test_busy(self):
+        d = self.c.stream_command('show tech', self.chunks.append, prompt='device>$')
+        self.failUnlessFailure(self.c.stream_command('show run', self.chunks.append),
+                               StreamInProgress)
+        self.c.dataReceived('show tech\r\nx\r\ndevice>')
+        d.addCallback(self.assertEqual, 1)
+        return d
+    
+    def test_backpressure(self):
+        pending = []
+        def consumer(chunk):
+            self.chunks.append(chunk)
+            pending.append(Deferred())
+            return pending[-1]
+        d = self.c.stream_command('show tech', consumer, prompt='device>$', window=8)
+        self.c.dataReceived('show tech\r\n' + 'x' * 5 + '\r\n' + 'x' * 10)
+        self.assertEqual(self.transport.producerState, 'paused')
+        self.c.dataReceived('x' * 10 + 'device>')
+        self.assertEqual(len(self.chunks), 1)
+        pending[0].callback(None)
+        self.assertEqual(self.chunks, ['x' * 5 + '\r\nxx', 'x' * 18])
+        pending[1].callback(None)
+        self.assertEqual(self.transport.producerState, 'producing')
+        d.addCallback(self.assertEqual, 27)
+        return d
+    
+    def test_stream_error(self):
+        d = self.c.stream_command('show qwerty', self.chunks.append, prompt='device>$')
+        self.c.dataReceived("show qwerty\r\n        ^\r\n"
+                            "% Invalid input detected at '^' marker.\r\n\r\ndevice>")
+        self.failUnlessFailure(d, CiscoCommandError)
+        d.addCallback(lambda ign: self.assertEqual(self.chunks, []))
+        return d
+    
+    def test_split_error(self):
+        d = self.c.stream_command('show qwerty', self.chunks.append, prompt='device>$',
+                                  window=64)
+        self.c.dataReceived('show qwerty\r\n' + ' ' * 20)
+        self.c.dataReceived("^\r\n% Invalid input detected at '^' marker.\r\n" + 'x' * 20)
+        self.failUnlessFailure(d, CiscoCommandError)
+        d.addCallback(lambda ign: self.assertEqual(self.chunks, []))
+        return d
+
+class PagerTestCase(unittest.TestCase):
+    
+    pager = ' --More-- '
+    erase = '\x08' * 10 + ' ' * 10 + '\x08' * 10
+    
+    def setUp(self):
+        self.transport = StringTransport()
+        self.c = Cisco(dict(device, pager_prompt=r' ?--More-- ?$', pager_key=' ', pager=True))
+        self.c.makeConnection(self.transport)
+    
+    def test_pager(self):
+        d = self.c.run_command('show run', prompt='device>$')
+        self.transport.clear()
+        self.c.dataReceived('show run\r\none\r\n' + self.pager)
+        self.assertEqual(native(self.transport.value()), ' ')
+        self.c.dataReceived(self.erase + '  two\r\n' + self.pager)
+        self.c.dataReceived(self.erase[:15])
+        self.c.dataReceived(self.erase[15:] + 'three\r\ndevice>')
+        d.addCallback(self.assertEqual, 'one\r\n  two\r\nthree')
+        return d
+    
+    def test_split_marker(self):
+        d = self.c.run_command('show run', prompt='device>$')
+        self.transport.clear()
+        self.c.dataReceived('show run\r\none\r\n --Mo')
+        self.assertEqual(native(self.transport.value()), '')
+        self.c.dataReceived('re-- ')
+        self.assertEqual(native(self.transport.value()), ' ')
+        self.c.dataReceived(self.erase + 'two\r\ndevice>')
+        d.addCallback(self.assertEqual, 'one\r\ntwo')
+        return d
+    
+    def test_carriage_return_erase(self):
+        d = self.c.run_command('show run', prompt='device>$')
+        self.c.dataReceived('show run\r\none\r\n' + self.pager)
+        self.c.dataReceived('\r' + ' ' * 10 + '\rtwo\r\ndevice>')
+        d.addCallback(self.assertEqual, 'one\r\ntwo')
+        return d
+    
+    def test_stream(self):
+        chunks = []
+        d = self.c.stream_command('show run', chunks.append, prompt='device>$', window=8)
+        self.c.dataReceived('show run\r\none\r\n' + self.pager)
+        self.c.dataReceived(self.erase + 'two\r\ndevice>')
+        d.addCallback(lambda ign: self.assertEqual(''.join(chunks), 'one\r\ntwo'))
+        return d
+    
+    def test_off_by_default(self):
+        self.transport = StringTransport()
+        self.c = Cisco(device)
+        self.c.makeConnection(self.transport)
+        d = self.c.run_command('show run', prompt='device>$')
+        self.transport.clear()
+        self.c.dataReceived('show run\r\none\r\n' + self.pager)
+        self.assertEqual(native(self.transport.value()), '')
+        self.c.dataReceived('device>')
+        d.addCallback(self.assertEqual, 'one\r\n' + self.pager.rstrip())
+        return d
+
+
+class TelnetTestCase(unittest.TestCase):
+    
+    def setUp(self):
+        self.transport = StringTransport()
+        self.c = Cisco(dict(device, window_size=(80, 0)))
+        self.c.makeConnection(self.transport)
+    
+    def test_negotiation(self):
+        self.c.dataReceived('\xff\xfd\x1f\xff\xfb\x01\xff\xfb\x03\xff\xfd\x18Pass')
+        self.assertEqual(native(self.transport.value()),
+                         '\xff\xfb\x1f\xff\xfa\x1f\x00\x50\x00\x00\xff\xf0'
+                         '\xff\xfd\x01\xff\xfd\x03\xff\xfc\x18')
+        self.assertEqual(self.successResultOf(self.c.read_until('Pass')), 'Pass')
+        self.failUnless(self.c._telnet.paging_disabled)
+    
+    def test_split(self):
+        self.c.dataReceived('one\xff')
+        self.c.dataReceived('\xfd')
+        self.assertEqual(native(self.transport.value()), '')
+        self.c.dataReceived('\x1ftwo\xff\xff\xff\xfa\x18\x01\xff')
+        self.c.dataReceived('\xf0three')
+        self.assertEqual(self.successResultOf(self.c.read_until('three')), 'onetwo\xffthree')
+        self.failUnless(self.c._telnet.naws_sent)
+    
+    def test_escaped_size(self):
+        self.c._telnet.window_size = (255, 24)
+        self.c.dataReceived('\xff\xfd\x1f')
+        self.assertEqual(native(self.transport.value()),
+                         '\xff\xfb\x1f\xff\xfa\x1f\x00\xff\xff\x00\x18\xff\xf0')
+        self.failIf(self.c._telnet.paging_disabled)
+    
+    def test_refused(self):
+        self.c._telnet.window_size = None
+        self.c.dataReceived('\xff\xfd\x1f')
+        self.assertEqual(native(self.transport.value()), '\xff\xfc\x1f')
+        self.failIf(self.c._telnet.paging_disabled)
+
+
+class BringUpTestCase(unittest.TestCase):
+    
+    def setUp(self):
+        self.transport = StringTransport()
+        self.c = Cisco(dict(device, speculative_bring_up=True, disable_paging=True,
+                            disable_paging_command='terminal length 0'))
+        self.c.makeConnection(self.transport)
+    
+    def test_speculative(self):
+        self.c.device.update(enable_command='enable', enable_password_prompt='Password:',
+                             enable_password='s3cr3t', enabled_prompt='device#')
+        d = self.c.bring_up()
+        self.c.dataReceived('Password:')
+        self.assertEqual(native(self.transport.value()), 'p4ssw0rD\n')
+        self.c.dataReceived('\r\ndevice>')
+        self.assertEqual(native(self.transport.value()),
+                         'p4ssw0rD\nterminal length 0\nenable\n')
+        self.c.dataReceived('terminal length 0\r\ndevice>enable\r\nPassword:')
+        self.assertEqual(native(self.transport.value()),
+                         'p4ssw0rD\nterminal length 0\nenable\ns3cr3t\n')
+        self.c.dataReceived('\r\ndevice#')
+        d.addCallback(lambda ign: self.failUnless(self.c.enabled))
+        return d
+    
+    def test_wrong_password(self):
+        d = self.c.bring_up(enable=False)
+        self.c.dataReceived('Password:')
+        self.c.dataReceived('\r\nPassword:')
+        # Nothing is typed ahead until the password has been accepted
+        self.assertEqual(native(self.transport.value()), 'p4ssw0rD\n')
+        return self.failUnlessFailure(d, LoginFailed)
+    
+    def test_fallback(self):
+        from twisted.internet import reactor
+        d = self.c.bring_up(enable=False, timeout=0.1)
+        self.c.dataReceived('Password:')
+        self.c.dataReceived('\r\ndevice>')
+        # The command, that was typed ahead, is discarded by the device
+        self.transport.clear()
+        def step_by_step():
+            self.assertEqual(native(self.transport.value()), 'terminal length 0\n')
+            self.c.dataReceived('terminal length 0\r\ndevice>')
+        reactor.callLater(0.3, step_by_step)
+        return d
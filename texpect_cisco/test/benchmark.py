@@ -0,0 +1,130 @@
+'''
+@author: shylent
+
+Benchmark L{Cisco<texpect_cisco.cisco.Cisco>} against simulated devices (see
+L{simulator<texpect_cisco.test.simulator>}). Run it as::
+
+    python -m texpect_cisco.test.benchmark --devices 200 --commands 10
+
+Every run prints a JSON document with the results. Use C{--output} to append
+it to a file, so that the results of different releases can be compared.
+'''
+import gc
+import json
+import sys
+import time
+import resource
+from optparse import OptionParser
+from texpect_cisco.fleet import FleetRunner, command_job, connect
+from texpect_cisco.metrics import Metrics
+from texpect_cisco.test.simulator import listen_many
+
+
+def max_rss():
+    """@return: Maximum resident set size of this process, in kilobytes
+    @rtype: C{int}"""
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        rss //= 1024
+    return rss
+
+
+def run_benchmark(devices=100, commands=10, concurrency=50, output_size=10000,
+                  latency=0, bandwidth=None, reactor=None):
+    """Run the benchmark: every device is logged in to, the privileged EXEC mode is
+    entered, the commands are run and the session is closed.
+
+    @param devices: Number of simulated devices
+    @param commands: Number of commands to run on every device
+    @param concurrency: Number of sessions open at the same time
+    @param output_size: Size of the output of every command, in characters
+    @param latency: Simulated latency of every response, in seconds
+    @param bandwidth: Simulated bandwidth, characters per second (C{None} - unlimited)
+
+    @return: A L{Deferred}, that fires with the results (a C{dict}). The memory
+    figures are the growth of the peak resident set size of the whole process,
+    which runs the simulated devices as well, so 'rss_per_session_max_kb' is
+    only an upper bound of the memory a session takes
+    @rtype: L{Deferred}
+
+    """
+    if reactor is None:
+        from twisted.internet import reactor
+    simulated = listen_many(devices, reactor, latency=latency, bandwidth=bandwidth)
+    metrics = Metrics(per_device=False)
+    job = command_job(['show synthetic %d' % output_size] * commands)
+    peak = {'sessions':0}
+    def on_result(device, res):
+        if not isinstance(res, list):
+            metrics.count(device['id'], 'job_failed')
+    def counting_connect(device):
+        d = connect(device, reactor=reactor, metrics=metrics)
+        def connected(inst):
+            peak['sessions'] = max(peak['sessions'], sum(
+                port.factory.sessions for port, _ in simulated))
+            return inst
+        d.addCallback(connected)
+        return d
+    runner = FleetRunner(job, concurrency, connect=counting_connect,
+                         on_result=on_result)
+    gc.collect()
+    rss_before = max_rss()
+    started = time.time()
+    d = runner.run([dict(device) for _, device in simulated])
+    def done(res):
+        elapsed = time.time() - started
+        succeeded, failed = res
+        for port, _ in simulated:
+            port.stopListening()
+        command = metrics.fleet.get('command')
+        return {
+            'devices':devices,
+            'commands_per_device':commands,
+            'concurrency':concurrency,
+            'output_size':output_size,
+            'latency':latency,
+            'bandwidth':bandwidth,
+            'elapsed':elapsed,
+            'succeeded':succeeded,
+            'failed':failed,
+            'sessions_per_sec':succeeded / elapsed,
+            'commands_per_sec':command and command.count / elapsed,
+            'command_p50':command and command.quantile(0.5),
+            'command_p99':command and command.quantile(0.99),
+            'rss_growth_kb':max_rss() - rss_before,
+            'rss_per_session_max_kb':float(max_rss() - rss_before) / max(1, peak['sessions']),
+            'peak_sessions':peak['sessions'],
+            'timestamp':time.time(),
+        }
+    d.addCallback(done)
+    return d
+
+
+def main(argv=None):
+    from twisted.internet import reactor
+    from twisted.python import log
+    parser = OptionParser()
+    parser.add_option('--devices', type='int', default=100)
+    parser.add_option('--commands', type='int', default=10)
+    parser.add_option('--concurrency', type='int', default=50)
+    parser.add_option('--output-size', type='int', default=10000)
+    parser.add_option('--latency', type='float', default=0)
+    parser.add_option('--bandwidth', type='int', default=None)
+    parser.add_option('--output', help='append the results to this file')
+    options, _ = parser.parse_args(argv)
+    d = run_benchmark(options.devices, options.commands, options.concurrency,
+                      options.output_size, options.latency, options.bandwidth)
+    def report(results):
+        text = json.dumps(results, sort_keys=True)
+        print(text)
+        if options.output:
+            with open(options.output, 'a') as f:
+                f.write(text + '\n')
+    d.addCallback(report)
+    d.addErrback(log.err)
+    d.addBoth(lambda ign: reactor.stop())
+    reactor.run()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+'''
+@author: shylent
+'''
+from twisted.trial import unittest
+from twisted.internet.task import Clock
+from twisted.internet.defer import Deferred, succeed
+from texpect_cisco.cache import ResultCache
+
+
+class ResultCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.cache = ResultCache([(r'^show clock', 1), (r'^show ', 10)],
+                                 max_entries=2, clock=self.clock)
+        self.fetched = []
+
+    def fetch(self, result='output'):
+        self.fetched.append(result)
+        return succeed(result)
+
+    def results(self, d):
+        results = []
+        d.addBoth(results.append)
+        return results
+
+    def test_ttl(self):
+        self.cache.get('a', 'show  version', self.fetch)
+        res = self.results(self.cache.get('a', 'show version', self.fetch, 'other'))
+        self.assertEqual(res, ['output'])
+        self.cache.get('a', 'show clock', self.fetch)
+        self.clock.advance(2)
+        self.cache.get('a', 'show clock', self.fetch)
+        self.assertEqual(len(self.fetched), 3)
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 3))
+
+    def test_not_cached(self):
+        self.cache.get('a', 'configure terminal', self.fetch)
+        self.cache.get('a', 'configure terminal', self.fetch)
+        self.assertEqual(len(self.fetched), 2)
+
+    def test_per_device(self):
+        self.cache.get('a', 'show version', self.fetch)
+        self.cache.get('b', 'show version', self.fetch)
+        self.assertEqual(len(self.fetched), 2)
+
+    def test_kwargs(self):
+        self.cache.get('a', 'show version', self.fetch, result='text')
+        res = self.results(self.cache.get('a', 'show version', self.fetch, result='output'))
+        self.assertEqual(res, ['output'])
+        self.cache.get('a', 'show version', self.fetch, result='text')
+        self.assertEqual(self.fetched, ['text', 'output'])
+        self.cache.invalidate('a', 'show version')
+        self.cache.get('a', 'show version', self.fetch, result='output')
+        self.assertEqual(len(self.fetched), 3)
+        # Unhashable, not cached
+        self.cache.get('a', 'show version', self.fetch, result=['x'])
+        self.cache.get('a', 'show version', self.fetch, result=['x'])
+        self.assertEqual(len(self.fetched), 5)
+
+    def test_lru(self):
+        self.cache.get('a', 'show version', self.fetch)
+        self.cache.get('a', 'show users', self.fetch)
+        self.cache.get('a', 'show version', self.fetch)
+        self.cache.get('a', 'show inventory', self.fetch)
+        self.cache.get('a', 'show version', self.fetch)
+        self.assertEqual(len(self.fetched), 3)
+        self.cache.get('a', 'show users', self.fetch)
+        self.assertEqual(len(self.fetched), 4)
+
+    def test_single_flight(self):
+        pending = Deferred()
+        first = self.results(self.cache.get('a', 'show version', lambda: pending))
+        second = self.results(self.cache.get('a', 'show version', self.fetch))
+        self.assertEqual((first, second, self.fetched), ([], [], []))
+        pending.callback('output')
+        self.assertEqual((first, second), (['output'], ['output']))
+        self.assertEqual(self.cache.shared, 1)
+
+    def test_failure_not_cached(self):
+        pending = Deferred()
+        first = self.results(self.cache.get('a', 'show version', lambda: pending))
+        second = self.results(self.cache.get('a', 'show version', self.fetch))
+        pending.errback(ValueError())
+        first[0].trap(ValueError)
+        second[0].trap(ValueError)
+        self.cache.get('a', 'show version', self.fetch)
+        self.assertEqual(self.fetched, ['output'])
+
+    def test_invalidate(self):
+        self.cache.get('a', 'show version', self.fetch)
+        self.cache.get('a', 'show users', self.fetch)
+        self.cache.invalidate('a', 'show  version')
+        self.cache.get('a', 'show version', self.fetch)
+        self.cache.get('a', 'show users', self.fetch)
+        self.assertEqual(len(self.fetched), 3)
+        pending = Deferred()
+        self.cache.get('a', 'show clock', lambda: pending)
+        self.cache.invalidate('a')
+        pending.callback('stale')
+        self.cache.get('a', 'show clock', self.fetch)
+        self.assertEqual(len(self.fetched), 4)
@@ -0,0 +1,68 @@
+'''
+@author: shylent
+'''
+from twisted.trial import unittest
+from texpect_cisco.conf import LazyDevice, ImproperlyConfigured, process_hooks
+
+
+class LazyDeviceTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.calls = []
+        def hostname(device):
+            self.calls.append('hostname')
+            return device['id'].split('.')[0]
+        def prompt(device):
+            self.calls.append('prompt')
+            return '%s>$' % device['hostname']
+        def enabled_prompt(device):
+            self.calls.append('enabled_prompt')
+            return '%s#$' % device['hostname']
+        self.hooks = [('hostname', hostname, ('id',)),
+                      ('prompt', prompt, ('hostname',)),
+                      ('enabled_prompt', enabled_prompt, ('hostname',))]
+        self.device = LazyDevice({'id':'switch.example.com'}, self.hooks,
+                                 defaults={'prompt':'>$', 'command_timeout':3})
+
+    def test_lazy(self):
+        self.failUnless('enabled_prompt' in self.device)
+        self.assertEqual(self.calls, [])
+        self.assertEqual(self.device['prompt'], 'switch>$')
+        self.assertEqual(self.device.get('prompt'), 'switch>$')
+        self.assertEqual(self.calls, ['hostname', 'prompt'])
+        self.assertEqual(sorted(self.device.pending()), ['enabled_prompt'])
+        self.assertEqual(self.device['command_timeout'], 3)
+        self.assertEqual(self.device.get('nonsense', 1), 1)
+        self.assertRaises(KeyError, lambda: self.device['nonsense'])
+
+    def test_present(self):
+        device = LazyDevice({'id':'switch', 'hostname':'sw'}, self.hooks)
+        self.assertEqual(device['prompt'], 'sw>$')
+        self.assertEqual(self.calls, ['prompt'])
+
+    def test_evaluate(self):
+        self.device.evaluate()
+        self.assertEqual(sorted(self.calls), ['enabled_prompt', 'hostname', 'prompt'])
+        self.assertEqual(self.device.pending(), [])
+        self.assertEqual(self.device.setdefault('prompt', 'x'), 'switch>$')
+
+    def test_missing_input(self):
+        device = LazyDevice({}, self.hooks)
+        self.assertRaises(ImproperlyConfigured, device.get, 'prompt')
+        self.assertEqual(self.calls, [])
+
+    def test_cycle(self):
+        device = LazyDevice({}, [('a', lambda dev: dev['b'], ('b',)),
+                                 ('b', lambda dev: dev['c']),
+                                 ('c', lambda dev: dev['a'])])
+        e = self.assertRaises(ImproperlyConfigured, lambda: device['a'])
+        self.failUnless('a -> b -> c -> a' in str(e))
+
+    def test_hook_exception(self):
+        device = LazyDevice({}, [('a', lambda dev: 1 // 0)])
+        self.assertRaises(ImproperlyConfigured, lambda: device['a'])
+        self.assertEqual(device.pending(), ['a'])
+
+    def test_process_hooks(self):
+        device = process_hooks(self.hooks, {'id':'switch'})
+        self.assertEqual(device['enabled_prompt'], 'switch#$')
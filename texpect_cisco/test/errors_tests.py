@@ -0,0 +1,41 @@
+'''
+@author: shylent
+'''
+from twisted.trial import unittest
+from texpect_cisco.errors import ErrorScanner, get_error_scanner
+
+
+class ErrorScannerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.scanner = get_error_scanner()
+
+    def test_kinds(self):
+        for data, kind in [("% Invalid input detected at '^' marker.", 'invalid input'),
+                           ('% Incomplete command.', 'incomplete command'),
+                           ('% Ambiguous command:  "sh"', 'ambiguous command'),
+                           ('% Unknown command or computer name', 'unknown command'),
+                           ('% Bad IP address or host name', 'other')]:
+            self.assertEqual(self.scanner.scan('switch>foo\n' + data).kind, kind)
+
+    def test_not_at_line_start(self):
+        self.failUnlessIdentical(self.scanner.scan('description 100% uptime\nfoo'), None)
+
+    def test_marker(self):
+        data = "line\nsh ip foo\n      ^\n% Invalid input detected at '^' marker.\n\nswitch#"
+        error = self.scanner.scan(data)
+        self.assertEqual(error.text(), "      ^\n% Invalid input detected at '^' marker.\n")
+        self.assertEqual(error.remaining_lines(), ['line', 'sh ip foo', 'switch#'])
+
+    def test_custom_table(self):
+        scanner = ErrorScanner([('invalid input', 'Invalid input')])
+        self.failUnlessIdentical(scanner.scan('% Bad IP address or host name'), None)
+        self.failUnless(scanner.scan('foo\n% Invalid input detected'))
+
+    def test_prefix(self):
+        scanner = get_error_scanner(prefix=r'(?:ERROR:[ \t]*)?%')
+        error = scanner.scan("fw# foo\nERROR: % Invalid input detected at '^' marker.")
+        self.assertEqual(error.kind, 'invalid input')
+
+    def test_cached(self):
+        self.failUnlessIdentical(get_error_scanner(), self.scanner)
@@ -0,0 +1,71 @@
+'''
+@author: shylent
+'''
+from twisted.trial import unittest
+from twisted.internet.defer import Deferred, succeed
+from texpect_cisco.fleet import FleetRunner, prepare_device
+
+
+class FakeSession(object):
+    eof = True
+    transport = None
+
+    def __init__(self, device):
+        self.device = device
+
+
+class FleetRunnerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.running = 0
+        self.max_running = 0
+        self.results = []
+
+    def job(self, inst):
+        from twisted.internet import reactor
+        self.running += 1
+        self.max_running = max(self.running, self.max_running)
+        d = Deferred()
+        def done(res):
+            self.running -= 1
+            return res
+        d.addBoth(done)
+        if inst.device['id'] == 'bad':
+            reactor.callLater(0.05, d.errback, ValueError('bad device'))
+        else:
+            reactor.callLater(0.01, d.callback, inst.device['id'])
+        return d
+
+    def on_result(self, device, res):
+        self.results.append((device['id'], res, self.running))
+
+    def runner(self, concurrency):
+        return FleetRunner(self.job, concurrency,
+                           connect=lambda device: succeed(FakeSession(device)),
+                           on_result=self.on_result)
+
+    def test_concurrency_cap(self):
+        inventory = ({'id':'dev%d' % i} for i in range(10))
+        d = self.runner(3).run(inventory)
+        d.addCallback(lambda res: self.assertEqual(res, (10, 0)))
+        d.addCallback(lambda ign: self.assertEqual(self.max_running, 3))
+        d.addCallback(lambda ign: self.assertEqual(len(self.results), 10))
+        return d
+
+    def test_results_streamed(self):
+        inventory = [{'id':'bad'}, {'id':'good'}]
+        d = self.runner(2).run(inventory)
+        def check(res):
+            self.assertEqual(res, (1, 1))
+            # the quick device is reported while the slow one is still running
+            self.assertEqual(self.results[0][:3], ('good', 'good', 1))
+            self.results[1][1].trap(ValueError)
+        d.addCallback(check)
+        return d
+
+    def test_prepare_device(self):
+        device = prepare_device({'id':'switch', 'port':2323},
+                                hooks=[('prompt', lambda dev: '%s>' % dev['id'])])
+        self.assertEqual(device['port'], 2323)
+        self.assertEqual(device['command_timeout'], 3)
+        self.assertEqual(device['prompt'], 'switch>')
@@ -0,0 +1,103 @@
+'''
+@author: shylent
+'''
+import sqlite3
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+from twisted.trial import unittest
+from texpect_cisco.conf import ImproperlyConfigured
+from texpect_cisco.platforms import ASA
+from texpect_cisco.inventory import InventoryLoader, read_csv, read_jsonl, \
+    read_json, read_sqlite, memoized, load_inventory
+
+
+def site_prompt(device):
+    if 'site' not in device:
+        raise ImproperlyConfigured('No site for %s' % device['id'])
+    return '%s-[\\w]+>$' % device['site']
+
+
+class ReadersTestCase(unittest.TestCase):
+
+    def test_csv(self):
+        rows = list(read_csv(StringIO('id,address,port,platform\n'
+                                      'a,10.0.0.1,23,\n'
+                                      'b,10.0.0.2,,asa\n')))
+        self.assertEqual(rows, [(2, {'id':'a', 'address':'10.0.0.1', 'port':'23'}),
+                                (3, {'id':'b', 'address':'10.0.0.2', 'platform':'asa'})])
+
+    def test_jsonl(self):
+        rows = list(read_jsonl(StringIO('{"id": "a", "port": 23}\n\n[1]\n{"id": \n')))
+        self.assertEqual(rows[0], (1, {'id':'a', 'port':23}))
+        self.assertEqual([number for number, _ in rows], [1, 3, 4])
+        self.failUnless(isinstance(rows[1][1], ImproperlyConfigured))
+        self.failUnless(isinstance(rows[2][1], ImproperlyConfigured))
+
+    def test_json(self):
+        rows = list(read_json(StringIO('[{"id": "a", "port": 23}, [1], {"id": "b"}]')))
+        self.assertEqual(rows[0], (1, {'id':'a', 'port':23}))
+        self.assertEqual(rows[2], (3, {'id':'b'}))
+        self.failUnless(isinstance(rows[1][1], ImproperlyConfigured))
+        self.assertRaises(ValueError, list, read_json(StringIO('{"id": "a"}')))
+
+    def test_sqlite(self):
+        path = self.mktemp()
+        connection = sqlite3.connect(path)
+        connection.execute('CREATE TABLE devices (id TEXT, address TEXT, port INTEGER)')
+        connection.executemany('INSERT INTO devices VALUES (?, ?, ?)',
+                               [('a', '10.0.0.1', 23), ('b', '10.0.0.2', None)])
+        connection.commit()
+        connection.close()
+        rows = list(read_sqlite(path, batch_size=1))
+        self.assertEqual(rows, [(1, {'id':'a', 'address':'10.0.0.1', 'port':23}),
+                                (2, {'id':'b', 'address':'10.0.0.2'})])
+
+
+class InventoryLoaderTestCase(unittest.TestCase):
+
+    def test_load(self):
+        hook = memoized(site_prompt, ['site'])
+        loader = InventoryLoader(hooks=[('login_prompt', hook)], batch_size=2)
+        rows = [(1, {'id':'a', 'site':'msk', 'port':'23'}),
+                (2, {'id':'b', 'site':'msk', 'platform':'asa'}),
+                (3, {'id':'c'}),
+                (4, {'id':'d', 'site':'spb', 'platform':'nonsense'}),
+                (5, {'id':'e', 'site':'spb', 'port':'x'}),
+                (6, {'id':'f', 'site':'spb'})]
+        devices = list(loader.load(rows))
+        self.assertEqual([device['id'] for device in devices], ['a', 'b', 'f'])
+        self.assertEqual(devices[0]['port'], 23)
+        self.assertEqual(devices[1]['login_prompt'], 'msk-[\\w]+>$')
+        self.failUnlessIdentical(devices[1].platform, ASA)
+        self.assertEqual(devices[1]['disable_paging_command'], 'terminal pager 0')
+        self.assertEqual((hook.calls, hook.hits), (4, 1))
+        self.assertEqual(loader.loaded, 3)
+        self.assertEqual(sorted([number for number, _ in loader.errors]), [3, 4, 5])
+        for _, exc in loader.errors:
+            self.failUnless(isinstance(exc, ImproperlyConfigured))
+
+    def test_platform_defaults(self):
+        loader = InventoryLoader(hooks=[('prompt', lambda device: '%s>$' % device['id'])])
+        devices = list(loader.load([(1, {'id':'sw1', 'prompt':'sw1#$'}),
+                                    (2, {'id':'sw2', 'platform':'ios'})]))
+        self.assertEqual(devices[0]['prompt'], 'sw1#$')
+        self.assertEqual(devices[1]['prompt'], 'sw2>$')
+
+    def test_hook_exception(self):
+        loader = InventoryLoader(hooks=[('x', lambda device: 1 // 0)])
+        self.assertEqual(list(loader.load([(1, {'id':'a'})])), [])
+        self.failUnless(isinstance(loader.errors[0][1], ImproperlyConfigured))
+
+    def test_load_inventory(self):
+        path = self.mktemp() + '.jsonl'
+        with open(path, 'w') as f:
+            f.write('{"id": "a", "address": "10.0.0.1"}\n')
+        devices = list(load_inventory(path))
+        self.assertEqual(devices[0]['address'], '10.0.0.1')
+        path = self.mktemp() + '.json'
+        with open(path, 'w') as f:
+            f.write('[{"id": "a", "address": "10.0.0.1"}, {"id": "b"}]')
+        self.assertEqual([device['id'] for device in load_inventory(path)], ['a', 'b'])
+        self.assertRaises(ValueError, load_inventory, 'inventory.xls')
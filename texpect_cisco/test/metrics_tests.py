@@ -0,0 +1,85 @@
+'''
+@author: shylent
+'''
+from twisted.trial import unittest
+from twisted.python.failure import Failure
+from twisted.test.proto_helpers import StringTransport
+from twisted.internet.error import ConnectionDone
+from texpect_cisco.cisco import Cisco, Disconnected
+from texpect_cisco.metrics import Histogram, Metrics
+
+
+class HistogramTestCase(unittest.TestCase):
+
+    def test_observe(self):
+        h = Histogram((1, 2, 5))
+        for value in (0.5, 1.5, 1.7, 4, 10):
+            h.observe(value)
+        self.assertEqual(h.counts, [1, 2, 1, 1])
+        self.assertEqual(h.count, 5)
+        self.assertEqual(h.min, 0.5)
+        self.assertEqual(h.max, 10)
+        self.assertEqual(h.quantile(0.5), 2)
+        self.assertEqual(h.quantile(0.99), 10)
+
+    def test_empty(self):
+        h = Histogram()
+        self.failUnlessIdentical(h.quantile(0.5), None)
+        self.failUnlessIdentical(h.snapshot()['mean'], None)
+
+
+class MetricsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.metrics = Metrics()
+
+    def test_rollup(self):
+        self.metrics.record('a', 'command', 0.2)
+        self.metrics.record('b', 'command', 0.4)
+        self.metrics.count('a', 'bytes_received', 100)
+        dump = self.metrics.dump()
+        self.assertEqual(dump['fleet']['command']['count'], 2)
+        self.assertEqual(dump['devices']['a']['phases']['command']['count'], 1)
+        self.assertEqual(dump['devices']['a']['counters'], {'bytes_received':100})
+        self.assertEqual(dump['counters'], {'bytes_received':100})
+        self.metrics.forget('a')
+        self.failIf('a' in self.metrics.dump()['devices'])
+
+    def test_exposition(self):
+        self.metrics.record('a', 'login', 0.3)
+        self.metrics.count('a', 'bytes_received', 10)
+        text = self.metrics.exposition()
+        self.failUnless('texpect_cisco_login_seconds_bucket{le="0.5"} 1' in text)
+        self.failUnless('texpect_cisco_login_seconds_count 1' in text)
+        self.failUnless('texpect_cisco_bytes_received_total 10' in text)
+
+    def test_session(self):
+        c = Cisco({'id':'switch'}, metrics=self.metrics)
+        self.assertEqual(c._record('enable', 0, 'result'), 'result')
+        failure = Failure(ValueError())
+        self.failUnlessIdentical(c._record('enable', 0, failure), failure)
+        self.assertEqual(self.metrics.fleet['enable'].count, 1)
+        self.assertEqual(self.metrics.counters['enable_failed'], 1)
+
+    def test_command(self):
+        c = Cisco({'id':'switch', 'prompt':'switch>'}, metrics=self.metrics)
+        c.makeConnection(StringTransport())
+        d = c.run_command('show clock')
+        c.dataReceived('show cl')
+        c.dataReceived('ock\r\n')
+        # The echo is not the output
+        self.failIf('first_byte' in self.metrics.fleet)
+        c.dataReceived('10:00:00\r\nswitch>')
+        self.assertEqual(self.successResultOf(d), '10:00:00')
+        self.assertEqual(self.metrics.fleet['first_byte'].count, 1)
+        self.assertEqual(self.metrics.fleet['command'].count, 1)
+        self.failUnless(self.metrics.fleet['first_byte'].max <=
+                        self.metrics.fleet['command'].max)
+        self.assertEqual(self.metrics.counters['bytes_received'], 29)
+        d = c.run_command('show clock')
+        c.dataReceived('show clock\r\n')
+        c.connectionLost(Failure(ConnectionDone()))
+        self.failureResultOf(d, Disconnected)
+        self.assertEqual(self.metrics.counters['command_failed'], 1)
+        self.assertEqual(self.metrics.fleet['first_byte'].count, 1)
+        self.assertEqual(self.metrics.devices['switch']['command'].count, 1)
@@ -0,0 +1,31 @@
+'''
+@author: shylent
+'''
+from twisted.trial import unittest
+from texpect_cisco.output import CommandOutput, strip_span
+from texpect_cisco.compat import to_bytes
+
+
+class CommandOutputTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.buf = 'show run\r\nline one\r\n\r\nline three\r\nswitch#'
+        self.output = CommandOutput(self.buf, 10, 32, 'show run', 'switch#', 1.0, 3.5)
+
+    def test_text(self):
+        self.assertEqual(str(self.output), 'line one\r\n\r\nline three')
+        self.assertEqual(len(self.output), 22)
+        self.assertEqual(self.output, 'line one\r\n\r\nline three')
+        self.failIfEqual(self.output, 'line one')
+        self.assertEqual(self.output.duration, 2.5)
+
+    def test_lines(self):
+        self.assertEqual(list(self.output.lines()), ['line one', '', 'line three'])
+        self.assertEqual(list(CommandOutput('').lines()), [])
+
+    def test_view(self):
+        self.assertEqual(self.output.view().tobytes(), to_bytes(str(self.output)))
+
+    def test_strip_span(self):
+        self.assertEqual(strip_span(' \tfoo \r\n', 0, 8), (2, 5))
+        self.assertEqual(strip_span('   ', 0, 3), (3, 3))
@@ -0,0 +1,136 @@
+'''
+@author: shylent
+'''
+from twisted.trial import unittest
+from twisted.test.proto_helpers import StringTransport
+from twisted.internet.defer import Deferred
+from texpect_cisco.cisco import Cisco
+from texpect_cisco.output import CommandOutput
+from texpect_cisco.parsing import Template, ParserRegistry, NoParserError,\
+    RECORD, NEW, default_registry, run_parsed
+
+ARP = """Protocol  Address          Age (min)  Hardware Addr   Type   Interface
+Internet  10.0.0.1                -   0011.2233.4455  ARPA   Vlan10
+Internet  10.0.0.2               12   0011.2233.4466  ARPA   Vlan10
+Internet  10.0.0.3                0   Incomplete      ARPA"""
+
+INTERFACES = """GigabitEthernet0/1 is up, line protocol is up (connected)
+  Hardware is Gigabit Ethernet, address is 0011.2233.4455 (bia 0011.2233.4455)
+  Description: uplink
+  MTU 1500 bytes, BW 1000000 Kbit/sec, DLY 10 usec,
+     0 input errors, 0 CRC, 0 frame, 0 overrun, 0 ignored
+GigabitEthernet0/2 is administratively down, line protocol is down (disabled)
+  Hardware is Gigabit Ethernet, address is 0011.2233.4456 (bia 0011.2233.4456)
+  MTU 1500 bytes, BW 100000 Kbit/sec, DLY 100 usec,"""
+
+
+class TemplateTestCase(unittest.TestCase):
+
+    def test_arp(self):
+        records = list(default_registry.parse('show ip arp', ARP))
+        self.assertEqual(len(records), 3)
+        self.assertEqual(records[1]['age'], '12')
+        self.assertEqual(records[0]['interface'], 'Vlan10')
+        self.assertEqual(records[2]['mac'], 'Incomplete')
+        self.failUnlessIdentical(records[2]['interface'], None)
+
+    def test_interfaces(self):
+        records = list(default_registry.parse('show interfaces', INTERFACES))
+        self.assertEqual([r['interface'] for r in records],
+                         ['GigabitEthernet0/1', 'GigabitEthernet0/2'])
+        self.assertEqual(records[0]['description'], 'uplink')
+        self.assertEqual(records[0]['input_errors'], '0')
+        self.assertEqual(records[1]['status'], 'administratively down')
+        self.failUnlessIdentical(records[1]['description'], None)
+
+    def test_command_output(self):
+        output = CommandOutput('show ip arp\r\n' + ARP.replace('\n', '\r\n'), 13)
+        self.assertEqual(len(list(default_registry.parse('show ip arp', output))), 3)
+
+    def test_incremental(self):
+        parser = default_registry.get('show interfaces').parser()
+        lines = INTERFACES.splitlines()
+        self.assertEqual(parser.feed(lines[:5]), [])
+        self.assertEqual(len(parser.feed(lines[5:])), 1)
+        self.assertEqual(len(parser.close()), 1)
+
+    def test_states(self):
+        template = Template('states', {
+            'Start':[(r'^Header', None, 'Body')],
+            'Body':[(r'^(?P<value>\d+)$', RECORD), (r'^Footer', None, 'Start')],
+        })
+        records = list(template.parse('1\nHeader\n2\n3\nFooter\n4'))
+        self.assertEqual(records, [{'value':'2'}, {'value':'3'}])
+
+    def test_compiled_once(self):
+        template = Template('once', [(r'^(?P<x>\w+)', NEW)])
+        self.failUnlessIdentical(template.compiled(), template.compiled())
+
+    def test_unknown_state(self):
+        template = Template('bad', [(r'foo', None, 'Nowhere')])
+        self.assertRaises(ValueError, template.compiled)
+
+
+class RegistryTestCase(unittest.TestCase):
+
+    def test_abbreviations(self):
+        template = default_registry.get('sh ip arp')
+        self.failUnlessIdentical(template, default_registry.get('SHOW IP ARP'))
+        self.assertRaises(NoParserError, default_registry.get, 'show ip route')
+
+    def test_ambiguous(self):
+        registry = ParserRegistry([('show interfaces', Template('a', [])),
+                                   ('show inventory', Template('b', []))])
+        self.assertRaises(NoParserError, registry.get, 'sh in')
+        self.assertEqual(registry.get('sh int').name, 'a')
+
+    def test_bounded(self):
+        registry = ParserRegistry([('show interfaces', Template('a', []))],
+                                  max_entries=2)
+        registry.get('sh int')
+        registry.get('show int')
+        registry.get('sh int')
+        registry.get('show interfaces')
+        self.assertEqual(list(registry._lookup_cache),
+                         [('sh', 'int'), ('show', 'interfaces')])
+
+
+class RunParsedTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.transport = StringTransport()
+        self.c = Cisco({'id':'device', 'address':'localhost', 'prompt':'device>'})
+        self.c.makeConnection(self.transport)
+
+    def test_records(self):
+        d = run_parsed(self.c, 'sh ip arp', prompt='device>$', window=16)
+        lines = ARP.replace('\n', '\r\n').splitlines(True)
+        self.c.dataReceived('show ip arp\r\n' + ''.join(lines[:2]))
+        self.c.dataReceived(''.join(lines[2:]) + '\r\ndevice>')
+        records = self.successResultOf(d)
+        self.assertEqual([r['address'] for r in records],
+                         ['10.0.0.1', '10.0.0.2', '10.0.0.3'])
+
+    def test_consumer(self):
+        batches = []
+        waiting = Deferred()
+        def consumer(records):
+            batches.append(records)
+            if len(batches) == 1:
+                return waiting
+        d = run_parsed(self.c, 'show interfaces', consumer=consumer,
+                       prompt='device>$', window=16)
+        lines = INTERFACES.replace('\n', '\r\n').splitlines(True)
+        self.c.dataReceived('show interfaces\r\n' + ''.join(lines))
+        self.assertEqual([[r['interface'] for r in b] for b in batches],
+                         [['GigabitEthernet0/1']])
+        self.assertEqual(self.transport.producerState, 'paused')
+        self.c.dataReceived('\r\ndevice>')
+        self.assertNoResult(d)
+        waiting.callback(None)
+        self.assertEqual(self.successResultOf(d), 2)
+        self.assertEqual(batches[1][0]['interface'], 'GigabitEthernet0/2')
+
+    def test_no_parser(self):
+        self.failureResultOf(run_parsed(self.c, 'show ip route'), NoParserError)
+        self.assertEqual(self.transport.value(), b'')
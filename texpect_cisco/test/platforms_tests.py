@@ -0,0 +1,78 @@
+'''
+@author: shylent
+'''
+from twisted.trial import unittest
+from texpect_cisco.cisco import Cisco
+from texpect_cisco.conf import process_hooks
+from texpect_cisco.platforms import Platform, IOS, ASA, NX_OS
+
+
+class CompactDeviceTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.device = IOS.device(id='switch', address='10.0.0.5', password='p4ssw0rD')
+
+    def test_lookup(self):
+        self.assertEqual(self.device['id'], 'switch')
+        self.assertEqual(self.device['port'], 23)
+        self.failUnlessIdentical(self.device['prompt'], IOS.settings['prompt'])
+        self.failUnless(self.device['prompt'].search('switch>'))
+        self.failUnless(self.device['enabled_prompt'].search('switch(config-if)#'))
+        self.assertRaises(KeyError, lambda: self.device['enable_password'])
+        self.assertEqual(self.device.get('enable_password'), None)
+
+    def test_no_instance_dict(self):
+        self.failIf(hasattr(self.device, '__dict__'))
+        self.failUnlessIdentical(self.device._extra, None)
+
+    def test_override(self):
+        self.device['command_timeout'] = 30
+        self.assertEqual(self.device['command_timeout'], 30)
+        self.assertEqual(IOS.settings['command_timeout'], 3)
+        self.assertEqual(self.device.overrides(),
+                         {'id':'switch', 'address':'10.0.0.5', 'password':'p4ssw0rD',
+                          'command_timeout':30})
+        del self.device['command_timeout']
+        self.assertEqual(self.device['command_timeout'], 3)
+        def delete():
+            del self.device['port']
+        self.assertRaises(KeyError, delete)
+
+    def test_mapping(self):
+        self.failUnless('port' in self.device)
+        self.failIf('nonexistent' in self.device)
+        self.assertEqual(len(self.device), len(dict(self.device)))
+        self.assertEqual(dict(self.device)['id'], 'switch')
+
+    def test_equality(self):
+        self.assertEqual(self.device, dict(self.device))
+        self.assertEqual(self.device, IOS.device(**self.device.overrides()))
+        self.assertNotEqual(self.device, IOS.device(id='router'))
+        self.assertNotEqual(self.device, None)
+        self.assertNotEqual(self.device, 'switch')
+        self.failIf(self.device == 42)
+
+    def test_nx_os(self):
+        device = NX_OS.device(id='nexus')
+        self.failUnless(device['prompt'].search('nexus# '))
+        self.failIf(device['prompt'].search('nexus>'))
+        self.failUnless(device['enabled_prompt'].search('nexus(config-if)#'))
+        self.assertEqual(device['transport'], 'ssh')
+        self.assertNotEqual(device['config_probe_command'],
+                            IOS.settings['config_probe_command'])
+
+    def test_hooks(self):
+        process_hooks([('prompt', lambda dev: '%s>' % dev['id'])], self.device, force=True)
+        self.assertEqual(self.device['prompt'], 'switch>')
+        self.failIf(isinstance(ASA.device(id='fw')['prompt'], str))
+
+    def test_session(self):
+        c = Cisco(self.device)
+        self.assertEqual(c.timeout, 3)
+
+    def test_custom_platform(self):
+        platform = Platform('custom', {'port':2323, 'prompt':'foo>$'}, base=None)
+        device = platform.device(id='foo')
+        self.assertEqual(device['port'], 2323)
+        self.failUnless(device['prompt'].search('foo>'))
+        self.failIf('command_timeout' in device)
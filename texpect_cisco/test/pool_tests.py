@@ -0,0 +1,119 @@
+'''
+@author: shylent
+'''
+from twisted.trial import unittest
+from twisted.internet.defer import succeed
+from twisted.internet.task import Clock
+from texpect_cisco.pool import SessionPool, PoolClosed
+
+
+class FakeTransport(object):
+
+    def __init__(self, session):
+        self.session = session
+
+    def loseConnection(self):
+        self.session.eof = True
+
+
+class FakeSession(object):
+
+    def __init__(self, device):
+        self.device = device
+        self.eof = False
+        self.enabled = False
+        self.debug = False
+        self.transport = FakeTransport(self)
+        self.commands = []
+
+    def login(self):
+        return succeed(None)
+
+    def enable(self):
+        self.enabled = True
+        return succeed(None)
+
+    def bring_up(self, enable=True):
+        if enable:
+            self.enabled = True
+        return succeed(None)
+
+    def run_command(self, command):
+        self.commands.append(command)
+        return succeed('')
+
+
+class SessionPoolTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.connected = []
+        self.pool = SessionPool(connect=self.connect, max_per_device=1, max_total=2,
+                                idle_timeout=100, keepalive_interval=10,
+                                clock=self.clock)
+        self.addCleanup(self.pool.close)
+
+    def connect(self, device):
+        session = FakeSession(device)
+        self.connected.append(session)
+        return succeed(session)
+
+    def acquire(self, dev_id):
+        result = []
+        self.pool.acquire({'id':dev_id}).addBoth(result.append)
+        return result
+
+    def test_reuse(self):
+        first = self.acquire('a')
+        self.failUnless(first[0].enabled)
+        self.pool.release(first[0])
+        second = self.acquire('a')
+        self.failUnlessIdentical(first[0], second[0])
+        self.assertEqual(len(self.connected), 1)
+
+    def test_per_device_cap(self):
+        first = self.acquire('a')
+        second = self.acquire('a')
+        self.assertEqual(second, [])
+        self.pool.release(first[0])
+        self.failUnlessIdentical(second[0], first[0])
+
+    def test_total_cap_evicts_idle(self):
+        a = self.acquire('a')
+        b = self.acquire('b')
+        self.pool.release(a[0])
+        c = self.acquire('c')
+        self.failUnless(a[0].eof)
+        self.failIfIdentical(c[0], a[0])
+        self.pool.release(b[0])
+        self.pool.release(c[0])
+
+    def test_broken_not_reused(self):
+        first = self.acquire('a')
+        first[0].eof = True
+        self.pool.release(first[0])
+        second = self.acquire('a')
+        self.failIfIdentical(first[0], second[0])
+
+    def test_disconnected_while_idle(self):
+        first = self.acquire('a')
+        self.pool.release(first[0])
+        first[0].eof = True
+        second = self.acquire('a')
+        self.failIfIdentical(first[0], second[0])
+        self.failIf(second[0].eof)
+        self.assertEqual(len(self.connected), 2)
+
+    def test_keepalive_and_expiry(self):
+        session = self.acquire('a')[0]
+        self.pool.release(session)
+        self.clock.advance(10)
+        self.assertEqual(session.commands, [''])
+        self.failIf(session.eof)
+        self.clock.pump([10] * 10)
+        self.failUnless(session.eof)
+
+    def test_closed(self):
+        self.pool.close()
+        d = self.pool.acquire({'id':'a'})
+        return self.failUnlessFailure(d, PoolClosed)
@@ -0,0 +1,98 @@
+'''
+@author: shylent
+'''
+from twisted.trial import unittest
+from twisted.test.proto_helpers import StringTransport
+from texpect_cisco.cisco import Cisco, UnexpectedResultError
+from texpect_cisco.compat import native
+from texpect_cisco.fleet import connect
+from texpect_cisco.push import ConfigPushError, push_config
+from texpect_cisco.test.simulator import SimulatedDevice, listen
+
+
+CONFIG = """!
+interface Gi0/1
+ description uplink
+ invalid line
+!
+interface Gi0/2
+ description access
+exit
+ip domain-name example.com
+"""
+
+
+class PushTestCase(unittest.TestCase):
+
+    def start(self, **kwargs):
+        config = SimulatedDevice(hostname='sim', **kwargs)
+        port = listen(config)
+        self.addCleanup(port.stopListening)
+        self.factory = port.factory
+        device = config.device('127.0.0.1', port.getHost().port, command_timeout=2)
+        d = connect(device)
+        def connected(inst):
+            self.addCleanup(lambda: inst.eof or inst.transport.loseConnection())
+            d = inst.login()
+            d.addCallback(lambda ign: inst.enable())
+            d.addCallback(lambda ign: inst)
+            return d
+        d.addCallback(connected)
+        return d
+
+    def test_push(self):
+        def push(inst):
+            d = push_config(inst, CONFIG.replace(' invalid line\n', ''), window=3)
+            def check(results):
+                self.assertEqual([(r.number, r.mode) for r in results],
+                                 [(2, 'config'), (3, 'config-if'), (5, 'config-if'),
+                                  (6, 'config-if'), (7, 'config-if'), (8, 'config')])
+                self.failIf([r for r in results if r.error])
+                self.assertEqual(self.factory.configured,
+                                 ['description uplink', 'description access',
+                                  'ip domain-name example.com'])
+            d.addCallback(check)
+            return d
+        return self.start().addCallback(push)
+
+    def test_stop_on_error(self):
+        def push(inst):
+            d = push_config(inst, CONFIG, window=2)
+            self.failUnlessFailure(d, ConfigPushError)
+            def check(e):
+                self.assertEqual(e.line.number, 4)
+                self.assertEqual(e.line.mode, 'config-if')
+                self.assertEqual([r.number for r in e.results], [2, 3, 4, 6])
+                self.assertEqual(self.factory.configured, ['description uplink'])
+            d.addCallback(check)
+            return d
+        return self.start().addCallback(push)
+
+    def test_continue_on_error(self):
+        def push(inst):
+            d = push_config(inst, CONFIG, window=4, stop_on_error=False)
+            def check(results):
+                self.assertEqual([r.number for r in results if r.error], [4])
+                self.assertEqual(len(results), 7)
+                self.assertEqual(len(self.factory.configured), 3)
+            d.addCallback(check)
+            return d
+        return self.start(latency=0.001).addCallback(push)
+
+    def test_timeout_ends(self):
+        inst = Cisco({'id':'device', 'enabled_prompt':r'device(\(config[^)]*\))?#$'})
+        class Transport(StringTransport):
+            def write(self, data):
+                StringTransport.write(self, data)
+                if native(data) == 'end\n':
+                    inst.dataReceived('hostname x\r\ndevice(config)#end\r\ndevice#')
+        transport = Transport()
+        inst.makeConnection(transport)
+        inst.enabled = True
+        d = push_config(inst, 'hostname x', timeout=0.05)
+        inst.dataReceived('configure terminal\r\ndevice(config)#')
+        # The device never answers 'hostname x' in time
+        self.failUnlessFailure(d, UnexpectedResultError)
+        d.addCallback(lambda ign: self.assertEqual(native(transport.value()),
+                                                   'configure terminal\nhostname x\nend\n'))
+        return d
@@ -0,0 +1,95 @@
+'''
+@author: shylent
+'''
+from twisted.trial import unittest
+from twisted.python.failure import Failure
+from twisted.internet.defer import Deferred
+from twisted.internet.error import ProcessTerminated
+from texpect_cisco.cisco import LoginFailed
+from texpect_cisco.shard import ShardedRunner, WorkerLost, _WorkerProcess, _Frames
+from texpect_cisco.test.simulator import listen_many
+
+
+class FakeTransport(object):
+
+    def __init__(self):
+        self.messages = []
+        self._frames = _Frames()
+
+    def write(self, data):
+        self.messages.extend(self._frames.feed(data))
+
+
+class DispatchTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.results = []
+        self.runner = ShardedRunner('job', processes=2, concurrency=2, prefetch=2,
+                                    on_result=lambda device, res:
+                                        self.results.append((device['id'], res)),
+                                    reactor=object())
+        self.runner._inventory = iter([{'id':str(ind)} for ind in range(1, 7)])
+        self.runner._done = Deferred()
+        self.workers = []
+        for number in range(2):
+            worker = _WorkerProcess(self.runner, number)
+            worker.transport = FakeTransport()
+            self.runner._workers.append(worker)
+            self.workers.append(worker)
+            self.runner._started(worker)
+
+    def sent(self, worker):
+        return worker.transport.messages
+
+    def test_batches(self):
+        self.assertEqual(self.sent(self.workers[0])[0][0], 'setup')
+        self.assertEqual([key for key, _ in self.sent(self.workers[0])[1][1]], [1, 2, 3, 4])
+        self.assertEqual([key for key, _ in self.sent(self.workers[1])[1][1]], [5, 6])
+
+    def test_rebalance(self):
+        busy, idle = self.workers
+        self.runner._message(idle, ('result', 5, 'done'))
+        self.assertEqual(self.sent(busy)[-1], ('release',))
+        self.runner._message(busy, ('released', [(3, {'id':'3'}), (4, {'id':'4'})]))
+        self.assertEqual(self.sent(idle)[-1], ('run', [(3, {'id':'3'})]))
+        self.runner._message(idle, ('result', 6, 'done'))
+        self.assertEqual(self.sent(idle)[-1], ('run', [(4, {'id':'4'})]))
+        self.assertEqual(self.results, [('5', 'done'), ('6', 'done')])
+
+    def test_finish(self):
+        for worker in self.workers:
+            for key in list(worker.outstanding):
+                self.runner._message(worker, ('failure', key, LoginFailed('no')))
+        self.assertEqual(self.runner.failed, 6)
+        for worker in self.workers:
+            self.assertEqual(self.sent(worker)[-1], ('stop',))
+
+    def test_worker_lost(self):
+        self.runner._ended(self.workers[0], Failure(ProcessTerminated(1)))
+        self.assertEqual(len(self.results), 4)
+        for _, res in self.results:
+            self.failUnless(res.check(WorkerLost))
+        self.assertEqual(len(self.workers[1].outstanding), 2)
+
+
+class ShardedRunnerTestCase(unittest.TestCase):
+
+    def test_run(self):
+        devices = []
+        for port, device in listen_many(4):
+            self.addCleanup(port.stopListening)
+            devices.append(device)
+        devices[3]['password'] = 'wrong'
+        results = {}
+        runner = ShardedRunner('texpect_cisco.fleet.command_job', (['show clock'],),
+                               processes=2, concurrency=1, prefetch=1,
+                               on_result=lambda device, res:
+                                   results.__setitem__(device['id'], res))
+        d = runner.run(devices)
+        def check(counts):
+            self.assertEqual(counts, (3, 1))
+            for dev_id in ('sim0', 'sim1', 'sim2'):
+                self.assertEqual(results[dev_id], ['*10:00:00.000 UTC Mon Mar 1 1993'])
+            self.failUnless(results['sim3'].check(LoginFailed))
+        d.addCallback(check)
+        return d
@@ -0,0 +1,520 @@
+'''
+@author: shylent
+
+A simulated Cisco device, good enough to exercise L{Cisco<texpect_cisco.cisco.Cisco>}
+(and to benchmark it) without the real hardware: password and enable prompts,
+configuration submodes, C{--More--} paging, telnet option negotiation,
+configurable latency and bandwidth and synthetic outputs of arbitrary size.
+'''
+import struct
+from twisted.internet.protocol import Protocol, ServerFactory
+from texpect_cisco.cisco import device_defaults, IAC, DO, DONT, WILL, WONT, SB, SE, \
+    ECHO, SGA, NAWS
+from texpect_cisco.compat import native, to_bytes
+
+
+PAGER = ' --More-- '
+ERASE_PAGER = '\x08' * len(PAGER) + ' ' * len(PAGER) + '\x08' * len(PAGER)
+
+
+def synthetic_output(size, line_length=72):
+    """Generate approximately C{size} characters of output, in lines.
+
+    @rtype: C{str}
+
+    """
+    line = ('x' * (line_length - 8))
+    lines = ['%06d  %s' % (ind, line) for ind in range(max(1, size // (line_length + 2)))]
+    return '\r\n'.join(lines)
+
+
+class SimulatedDevice(object):
+    """The configuration of a simulated device.
+
+    @ivar hostname: The host name, that is shown in the prompt
+    @ivar password: The login password
+    @ivar enable_password: The enable password
+    @ivar commands: Command to output mapping. The output may be a callable, that
+    takes the command arguments (a list) and returns the output
+    @ivar latency: Number of seconds to wait before responding to a line
+    @ivar bandwidth: Number of characters per second the device sends or C{None}
+    (unlimited)
+    @ivar page_length: Number of lines per page, until paging is disabled with
+    C{'terminal length 0'}
+    @ivar allow_disable_paging: If C{False}, C{'terminal length 0'} is rejected
+    (as with some restricted AAA command sets)
+    @ivar telnet: If C{True}, the device negotiates the telnet options, like the
+    real ones do: asks for the window size (the rows of which become the page
+    length) and offers to echo and to suppress go-ahead
+
+    """
+
+    def __init__(self, hostname='sim', password='cisco', enable_password='enable',
+                 commands=None, latency=0, bandwidth=None, page_length=24,
+                 allow_disable_paging=True, telnet=False):
+        self.hostname = hostname
+        self.password = password
+        self.enable_password = enable_password
+        self.commands = {
+            'show version':'Cisco IOS Software, C2960 Software (C2960-LANBASEK9-M), '
+                           'Version 12.2(55)SE7, RELEASE SOFTWARE (fc1)\r\n'
+                           '%s uptime is 1 week, 2 days, 3 hours, 4 minutes' % hostname,
+            'show clock':'*10:00:00.000 UTC Mon Mar 1 1993',
+            'show synthetic':lambda args: synthetic_output(int(args[0]) if args else 1000),
+        }
+        if commands:
+            self.commands.update(commands)
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.page_length = page_length
+        self.allow_disable_paging = allow_disable_paging
+        self.telnet = telnet
+
+    def device(self, address, port, **kwargs):
+        """A device dictionary, that can be used to talk to this device
+
+        @rtype: C{dict}
+
+        """
+        device = dict(device_defaults)
+        device.update({
+            'id':self.hostname,
+            'address':address,
+            'port':port,
+            'password':self.password,
+            'enable_password':self.enable_password,
+            'password_prompt':'Password: $',
+            'enable_password_prompt':'Password: $',
+            'prompt':'%s>$' % self.hostname,
+            'enabled_prompt':r'%s(\(config[^)]*\))?#$' % self.hostname,
+        })
+        device.update(kwargs)
+        return device
+
+
+class SimulatorProtocol(Protocol):
+    """The server side of a simulated session."""
+
+    logged_in = False
+
+    def connectionMade(self):
+        self.config = self.factory.config
+        self.state = self.logged_in and 'exec' or 'password'
+        self.mode = ''
+        self.enabled = False
+        self.page_length = self.config.page_length
+        self._line = ''
+        self._lines = []
+        self._busy = False
+        self._pending_pages = None
+        self._send_queue = []
+        self._sending = False
+        self._telnet = None
+        self.factory.sessions += 1
+        if self.config.telnet and not self.logged_in:
+            self._telnet = ''
+            self.transport.write(to_bytes(IAC + DO + NAWS + IAC + WILL + ECHO + IAC + WILL + SGA))
+        if self.logged_in:
+            self.send('\r\n' + self.prompt())
+        else:
+            self.send('\r\nUser Access Verification\r\n\r\nPassword: ')
+
+    def connectionLost(self, reason):
+        self.factory.sessions -= 1
+
+    # Output
+
+    def send(self, data):
+        if not data:
+            return
+        if self.config.bandwidth is None:
+            self.transport.write(to_bytes(data))
+            return
+        self._send_queue.append(data)
+        if not self._sending:
+            self._sending = True
+            self._send_some()
+
+    def _send_some(self):
+        from twisted.internet import reactor
+        tick = 0.01
+        budget = max(1, int(self.config.bandwidth * tick))
+        while budget and self._send_queue:
+            data = self._send_queue[0]
+            chunk, rest = data[:budget], data[budget:]
+            self.transport.write(to_bytes(chunk))
+            budget -= len(chunk)
+            if rest:
+                self._send_queue[0] = rest
+            else:
+                self._send_queue.pop(0)
+        if self._send_queue:
+            reactor.callLater(tick, self._send_some)
+        else:
+            self._sending = False
+
+    def prompt(self):
+        if self.state in ('password', 'enable_password'):
+            return 'Password: '
+        return '%s%s%s' % (self.config.hostname, self.mode, self.enabled and '#' or '>')
+
+    # Input
+
+    def dataReceived(self, data):
+        data = native(data)
+        if self._telnet is not None:
+            data = self._telnet_commands(data)
+        for char in data:
+            if self._pending_pages is not None:
+                self._page_key(char)
+            elif char == '\n':
+                line, self._line = self._line.rstrip('\r'), ''
+                self._lines.append(line)
+            elif char in '\x08\x7f':
+                self._line = self._line[:-1]
+            else:
+                self._line += char
+        self._next_line()
+
+    def _telnet_commands(self, data):
+        """Strip the telnet commands, applying the window size, that is received.
+        The replies to the options, offered by the device, are not checked."""
+        data = self._telnet + data
+        self._telnet = ''
+        out = []
+        pos = 0
+        while pos < len(data):
+            ind = data.find(IAC, pos)
+            if ind == -1:
+                out.append(data[pos:])
+                break
+            out.append(data[pos:ind])
+            command = data[ind + 1:ind + 2]
+            if command == SB:
+                end = data.find(IAC + SE, ind)
+                if end == -1:
+                    self._telnet = data[ind:]
+                    break
+                self._subnegotiation(data[ind + 2:end].replace(IAC + IAC, IAC))
+                pos = end + 2
+            elif command in (DO, DONT, WILL, WONT):
+                if ind + 2 >= len(data):
+                    self._telnet = data[ind:]
+                    break
+                pos = ind + 3
+            elif command == IAC:
+                out.append(IAC)
+                pos = ind + 2
+            elif not command:
+                self._telnet = data[ind:]
+                break
+            else:
+                pos = ind + 2
+        return ''.join(out)
+
+    def _subnegotiation(self, data):
+        if data[:1] == NAWS and len(data) == 5:
+            columns, rows = struct.unpack('>HH', to_bytes(data[1:]))
+            self.page_length = rows
+
+    def _next_line(self):
+        if self._busy or self._pending_pages is not None or not self._lines:
+            return
+        self._busy = True
+        line = self._lines.pop(0)
+        if self.config.latency:
+            from twisted.internet import reactor
+            reactor.callLater(self.config.latency, self._respond, line)
+        else:
+            self._respond(line)
+
+    def _respond(self, line):
+        self._busy = False
+        if self.state in ('password', 'enable_password'):
+            self.send('\r\n')
+            self._password(line)
+        else:
+            self.send(line + '\r\n')
+            output = self.execute(line.strip())
+            if output is None:
+                # The connection was closed
+                return
+            self._output(output)
+        if self._pending_pages is None:
+            self._next_line()
+
+    def _password(self, line):
+        if self.state == 'password':
+            if line == self.config.password:
+                self.state = 'exec'
+                self.send(self.prompt())
+            else:
+                self.send('Password: ')
+        else:
+            self.state = 'exec'
+            if line == self.config.enable_password:
+                self.enabled = True
+            else:
+                self.send('% Access denied\r\n\r\n')
+            self.send(self.prompt())
+
+    def _output(self, output):
+        lines = output.split('\r\n') if output else []
+        if self.page_length and len(lines) > self.page_length:
+            self._pending_pages = lines
+            self._send_page(self.page_length)
+        else:
+            self.send(''.join([line + '\r\n' for line in lines]) + self.prompt())
+
+    def _send_page(self, count):
+        lines, self._pending_pages = self._pending_pages[:count], self._pending_pages[count:]
+        self.send(''.join([line + '\r\n' for line in lines]))
+        if self._pending_pages:
+            self.send(PAGER)
+        else:
+            self._pending_pages = None
+            self.send(self.prompt())
+            self._next_line()
+
+    def _page_key(self, char):
+        self.send(ERASE_PAGER)
+        if char == ' ':
+            self._send_page(self.page_length)
+        elif char in '\r\n':
+            self._send_page(1)
+        else:
+            self._pending_pages = None
+            self.send(self.prompt())
+            self._next_line()
+
+    # Commands
+
+    def execute(self, line):
+        """Run the command.
+
+        @return: The output or C{None} if the connection has been closed
+        @rtype: C{str}
+
+        """
+        if not line:
+            return ''
+        words = line.split()
+        command = ' '.join(words)
+        self.factory.executed.append(command)
+        if command == 'exit':
+            return self._exit()
+        if command == 'enable':
+            if self.enabled:
+                return ''
+            # The output is followed by the prompt, which is the password prompt now
+            self.state = 'enable_password'
+            return ''
+        if words[:2] == ['terminal', 'length'] and len(words) == 3:
+            if not self.config.allow_disable_paging:
+                return "% Authorization failed."
+            self.page_length = int(words[2])
+            return ''
+        if self.enabled and command in ('configure terminal', 'conf t'):
+            self.mode = '(config)'
+            return 'Enter configuration commands, one per line.  End with CNTL/Z.'
+        if self.mode:
+            return self._configure(words)
+        handler = self.config.commands.get(command)
+        args = []
+        if handler is None:
+            for ind in range(len(words) - 1, 0, -1):
+                handler = self.config.commands.get(' '.join(words[:ind]))
+                if handler is not None:
+                    args = words[ind:]
+                    break
+        if handler is None:
+            return self._invalid(line)
+        if callable(handler):
+            return handler(args)
+        return handler
+
+    def _exit(self):
+        if self.mode == '(config)':
+            self.mode = ''
+            return ''
+        if self.mode:
+            self.mode = '(config)'
+            return ''
+        self.transport.loseConnection()
+        return None
+
+    def _configure(self, words):
+        if words == ['end']:
+            self.mode = ''
+            return ''
+        if words[0] in ('interface', 'line', 'router', 'vlan'):
+            self.mode = '(config-%s)' % {'interface':'if', 'line':'line',
+                                         'router':'router', 'vlan':'vlan'}[words[0]]
+            return ''
+        if words[0] == 'invalid':
+            return self._invalid(' '.join(words))
+        self.factory.configured.append(' '.join(words))
+        return ''
+
+    def _invalid(self, line):
+        return "%s^\r\n%% Invalid input detected at '^' marker.\r\n" % (
+            ' ' * (len(self.prompt()) + len(line.split()[0])))
+
+
+class SimulatorFactory(ServerFactory):
+    """Creates the simulated sessions for a single device.
+
+    @ivar sessions: The number of open sessions
+    @ivar configured: The configuration lines, that were accepted by the device
+    @ivar executed: Every line, that was entered (except for the passwords)
+
+    """
+    protocol = SimulatorProtocol
+
+    def __init__(self, config):
+        self.config = config
+        self.sessions = 0
+        self.configured = []
+        self.executed = []
+
+
+def listen(config, reactor=None, interface='127.0.0.1'):
+    """Start a simulated device on an ephemeral port.
+
+    @type config: L{SimulatedDevice}
+
+    @return: The listening port
+    @rtype: L{IListeningPort<twisted.internet.interfaces.IListeningPort>}
+
+    """
+    if reactor is None:
+        from twisted.internet import reactor
+    return reactor.listenTCP(0, SimulatorFactory(config), interface=interface)
+
+
+def listen_ssh(config, reactor=None, interface='127.0.0.1', username='cisco',
+               max_channels=None):
+    """Start a simulated device, that is reachable over SSH, on an ephemeral port.
+    The user authenticates with the login password of the device, the session
+    starts at the prompt.
+
+    @type config: L{SimulatedDevice}
+    @param max_channels: The number of session channels, that the device allows
+    per connection, the rest are refused. C{None} - no limit.
+
+    @return: The listening port. Its factory has the C{simulator} attribute with
+    the L{SimulatorFactory}, and C{connections}, the number of SSH connections,
+    that were accepted.
+    @rtype: L{IListeningPort<twisted.internet.interfaces.IListeningPort>}
+
+    """
+    from zope.interface import implementer
+    from twisted.cred.checkers import InMemoryUsernamePasswordDatabaseDontUse
+    from twisted.cred.portal import IRealm, Portal
+    from twisted.python import components
+    from twisted.conch.avatar import ConchUser
+    from twisted.conch.error import ConchError
+    from twisted.conch.interfaces import IConchUser, ISession
+    from twisted.conch.ssh.connection import OPEN_ADMINISTRATIVELY_PROHIBITED
+    from twisted.conch.ssh.factory import SSHFactory
+    from twisted.conch.ssh.keys import Key
+    from twisted.conch.ssh.session import SSHSession, wrapProtocol
+    from twisted.conch.test import keydata
+    from twisted.internet.error import ProcessDone
+    from twisted.python.failure import Failure
+    from twisted.test.proto_helpers import StringTransport
+    if reactor is None:
+        from twisted.internet import reactor
+    simulator = SimulatorFactory(config)
+
+    @implementer(ISession)
+    class Session(object):
+
+        def __init__(self, avatar):
+            self.avatar = avatar
+
+        def getPty(self, term, windowSize, modes):
+            pass
+
+        def openShell(self, transport):
+            protocol = simulator.buildProtocol(None)
+            protocol.logged_in = True
+            protocol.makeConnection(transport)
+            transport.makeConnection(wrapProtocol(protocol))
+
+        def execCommand(self, protocol, command):
+            # As in 'ssh device command': the output, without the prompt, then
+            # the channel is closed
+            reactor.callLater(0, self._exec, protocol, command)
+
+        def _exec(self, protocol, command):
+            session = simulator.buildProtocol(None)
+            session.logged_in = True
+            session.makeConnection(StringTransport())
+            output = session.execute(native(command).strip())
+            session.connectionLost(None)
+            if output:
+                protocol.write(to_bytes(''.join([line + '\r\n' for line in output.split('\r\n')])))
+            protocol.processEnded(Failure(ProcessDone(0)))
+
+        def windowChanged(self, newWindowSize):
+            pass
+
+        def eofReceived(self):
+            pass
+
+        def closed(self):
+            pass
+
+    class Avatar(ConchUser):
+
+        def __init__(self):
+            ConchUser.__init__(self)
+            self.channelLookup[b'session'] = SSHSession
+            self.channels = 0
+
+        def lookupChannel(self, channelType, windowSize, maxPacket, data):
+            if max_channels is not None and self.channels >= max_channels:
+                raise ConchError('too many sessions', OPEN_ADMINISTRATIVELY_PROHIBITED)
+            self.channels += 1
+            return ConchUser.lookupChannel(self, channelType, windowSize, maxPacket, data)
+
+    @implementer(IRealm)
+    class Realm(object):
+
+        def requestAvatar(self, avatarId, mind, *interfaces):
+            return IConchUser, Avatar(), lambda: None
+
+    class Factory(SSHFactory):
+
+        def buildProtocol(self, addr):
+            self.connections += 1
+            return SSHFactory.buildProtocol(self, addr)
+
+    components.registerAdapter(Session, Avatar, ISession)
+    factory = Factory()
+    factory.connections = 0
+    factory.simulator = simulator
+    checker = InMemoryUsernamePasswordDatabaseDontUse()
+    checker.addUser(to_bytes(username), to_bytes(config.password))
+    factory.portal = Portal(Realm(), [checker])
+    factory.publicKeys = {b'ssh-rsa':Key.fromString(keydata.publicRSA_openssh)}
+    factory.privateKeys = {b'ssh-rsa':Key.fromString(keydata.privateRSA_openssh)}
+    return reactor.listenTCP(0, factory, interface=interface)
+
+
+def listen_many(count, reactor=None, interface='127.0.0.1', **kwargs):
+    """Start a number of simulated devices, each one on its own port.
+
+    @param kwargs: Passed to L{SimulatedDevice}
+
+    @return: A list of C{(listening port, device dictionary)} pairs
+    @rtype: C{list}
+
+    """
+    result = []
+    for ind in range(count):
+        config = SimulatedDevice(hostname='sim%d' % ind, **kwargs)
+        port = listen(config, reactor, interface)
+        result.append((port, config.device(interface, port.getHost().port)))
+    return result
@@ -0,0 +1,136 @@
+'''
+@author: shylent
+'''
+from twisted.trial import unittest
+from texpect_cisco.cisco import CiscoCommandError, LoginFailed
+from texpect_cisco.fleet import connect
+from texpect_cisco.test.simulator import SimulatedDevice, listen
+
+
+class SimulatorTestCase(unittest.TestCase):
+
+    def start(self, **kwargs):
+        config = SimulatedDevice(hostname='sim', **kwargs)
+        port = listen(config)
+        self.addCleanup(port.stopListening)
+        self.factory = port.factory
+        device = config.device('127.0.0.1', port.getHost().port, command_timeout=2)
+        d = connect(device)
+        def connected(inst):
+            self.addCleanup(lambda: inst.eof or inst.transport.loseConnection())
+            return inst
+        d.addCallback(connected)
+        return d
+
+    def test_session(self):
+        def interact(inst):
+            d = inst.login()
+            d.addCallback(lambda ign: inst.enable())
+            d.addCallback(lambda ign: self.failUnless(inst.enabled))
+            d.addCallback(lambda ign: inst.run_command('show clock'))
+            d.addCallback(self.assertEqual, '*10:00:00.000 UTC Mon Mar 1 1993')
+            d.addCallback(lambda ign: inst.exit())
+            d.addCallback(lambda ign: self.failUnless(inst.eof))
+            return d
+        return self.start().addCallback(interact)
+
+    def test_wrong_password(self):
+        def interact(inst):
+            inst.device['password'] = 'wrong'
+            return self.failUnlessFailure(inst.login(), LoginFailed)
+        return self.start().addCallback(interact)
+
+    def test_synthetic_output(self):
+        def interact(inst):
+            d = inst.login()
+            d.addCallback(lambda ign: inst.run_command('show synthetic 100000'))
+            d.addCallback(lambda output: self.assertEqual(len(output.splitlines()), 1351))
+            return d
+        return self.start().addCallback(interact)
+
+    def test_speculative_bring_up(self):
+        def interact(inst):
+            inst.device['speculative_bring_up'] = True
+            d = inst.bring_up()
+            d.addCallback(lambda ign: self.failUnless(inst.enabled))
+            d.addCallback(lambda ign: self.assertEqual(self.factory.executed,
+                                                       ['terminal length 0', 'enable']))
+            d.addCallback(lambda ign: inst.run_command('show clock'))
+            d.addCallback(self.assertEqual, '*10:00:00.000 UTC Mon Mar 1 1993')
+            return d
+        return self.start().addCallback(interact)
+
+    def test_speculative_wrong_password(self):
+        def interact(inst):
+            inst.device.update(speculative_bring_up=True, password='wrong')
+            return self.failUnlessFailure(inst.bring_up(), LoginFailed)
+        return self.start().addCallback(interact)
+
+    def test_invalid_command(self):
+        def interact(inst):
+            d = inst.login()
+            d.addCallback(lambda ign: inst.run_command('show qwerty'))
+            return self.failUnlessFailure(d, CiscoCommandError)
+        return self.start().addCallback(interact)
+
+    def test_configure(self):
+        def interact(inst):
+            d = inst.login()
+            d.addCallback(lambda ign: inst.enable())
+            d.addCallback(lambda ign: inst.run_command('configure terminal'))
+            d.addCallback(lambda ign: inst.run_command('interface Gi0/1'))
+            d.addCallback(lambda ign: inst.run_command('description uplink'))
+            d.addCallback(lambda ign: inst.run_command('end'))
+            d.addCallback(lambda ign: self.assertEqual(self.factory.configured,
+                                                       ['description uplink']))
+            return d
+        return self.start().addCallback(interact)
+
+    def test_pipelined(self):
+        def interact(inst):
+            d = inst.login()
+            d.addCallback(lambda ign: inst.run_commands(['show clock', 'show version']))
+            def check(res):
+                self.assertEqual(res[0], '*10:00:00.000 UTC Mon Mar 1 1993')
+                self.failUnless(res[1].endswith('sim uptime is 1 week, 2 days, 3 hours, 4 minutes'))
+            d.addCallback(check)
+            return d
+        return self.start(latency=0.01).addCallback(interact)
+
+    def test_paging(self):
+        def interact(inst):
+            d = inst.login()
+            d.addCallback(lambda ign: inst.run_command('show synthetic 10000'))
+            def check(output):
+                lines = output.splitlines()
+                self.assertEqual(len(lines), 135)
+                self.assertEqual(lines, [line.strip() for line in lines])
+                self.failIf('More' in output or '\x08' in output)
+            d.addCallback(check)
+            return d
+        return self.start(allow_disable_paging=False).addCallback(interact)
+
+    def test_window_size(self):
+        def interact(inst):
+            d = inst.login()
+            d.addCallback(lambda ign: inst.run_command('show synthetic 10000'))
+            def check(output):
+                self.assertEqual(len(output.splitlines()), 135)
+                self.failIf('More' in output)
+                self.failIf('terminal length 0' in self.factory.executed)
+            d.addCallback(check)
+            return d
+        return self.start(telnet=True, allow_disable_paging=False).addCallback(interact)
+
+
+class BenchmarkTestCase(unittest.TestCase):
+
+    def test_smoke(self):
+        from texpect_cisco.test.benchmark import run_benchmark
+        d = run_benchmark(devices=3, commands=2, concurrency=2, output_size=1000)
+        def check(results):
+            self.assertEqual((results['succeeded'], results['failed']), (3, 0))
+            self.failUnless(results['commands_per_sec'] > 0)
+            self.failUnless(results['rss_per_session_max_kb'] >= 0)
+        d.addCallback(check)
+        return d
@@ -0,0 +1,124 @@
+'''
+@author: shylent
+'''
+from twisted.trial import unittest
+from twisted.internet.defer import Deferred, gatherResults
+from twisted.internet.error import ProcessDone
+from twisted.conch.error import ConchError
+from twisted.conch.interfaces import IConchUser, ISession
+from texpect_cisco.cisco import LoginFailed
+from texpect_cisco.compat import native
+from texpect_cisco.ssh import SSHConnector, HostKeyMismatch, ChannelRejected
+from texpect_cisco.test.simulator import SimulatedDevice, listen_ssh
+
+
+class ExecProtocol(object):
+
+    def __init__(self):
+        self.data = []
+        self.ended = Deferred()
+
+    def write(self, data):
+        self.data.append(data)
+
+    def processEnded(self, reason):
+        self.reason = reason
+        self.ended.callback(None)
+
+
+class SSHTestCase(unittest.TestCase):
+
+    def setUp(self):
+        config = SimulatedDevice(hostname='sim')
+        port = listen_ssh(config, username='admin')
+        self.addCleanup(port.stopListening)
+        self.factory = port.factory
+        self.device = config.device('127.0.0.1', None, transport='ssh', username='admin',
+                                    ssh_port=port.getHost().port, command_timeout=2)
+        self.connector = SSHConnector(max_channels=2, idle_timeout=10)
+        self.addCleanup(self.connector.close)
+
+    def session(self, inst):
+        self.addCleanup(lambda: inst.eof or inst.transport.loseConnection())
+        d = inst.login()
+        d.addCallback(lambda ign: inst.enable())
+        d.addCallback(lambda ign: inst.run_command('show clock'))
+        d.addCallback(self.assertEqual, '*10:00:00.000 UTC Mon Mar 1 1993')
+        return d
+
+    def test_session(self):
+        d = self.connector.connect(self.device)
+        d.addCallback(self.session)
+        return d
+
+    def test_multiplexed(self):
+        d = gatherResults([self.connector.connect(self.device).addCallback(self.session)
+                           for _ in range(3)])
+        def check(ign):
+            self.assertEqual(self.factory.connections, 2)
+            self.assertEqual(len(self.connector.connections(self.device)), 2)
+        d.addCallback(check)
+        return d
+
+    def test_reused(self):
+        d = self.connector.connect(self.device)
+        d.addCallback(lambda inst: self.session(inst).addCallback(lambda ign: inst.exit()))
+        d.addCallback(lambda ign: self.connector.connect(self.device))
+        d.addCallback(self.session)
+        d.addCallback(lambda ign: self.assertEqual(self.factory.connections, 1))
+        return d
+
+    def test_speculative(self):
+        self.device['speculative_bring_up'] = True
+        def bring_up(inst):
+            self.addCleanup(lambda: inst.eof or inst.transport.loseConnection())
+            d = inst.bring_up()
+            d.addCallback(lambda ign: inst.run_command('show clock'))
+            d.addCallback(self.assertEqual, '*10:00:00.000 UTC Mon Mar 1 1993')
+            return d
+        return self.connector.connect(self.device).addCallback(bring_up)
+
+    def limited(self, max_channels):
+        config = SimulatedDevice(hostname='sim')
+        port = listen_ssh(config, username='admin', max_channels=max_channels)
+        self.addCleanup(port.stopListening)
+        self.factory = port.factory
+        self.device['ssh_port'] = port.getHost().port
+
+    def test_rejected(self):
+        self.limited(1)
+        d = self.connector.connect(self.device)
+        d.addCallback(self.session)
+        d.addCallback(lambda ign: self.connector.connect(self.device))
+        d.addCallback(self.session)
+        def check(ign):
+            self.flushLoggedErrors(ConchError)
+            self.assertEqual(self.factory.connections, 2)
+            self.assertEqual([conn.capacity for conn in self.connector.connections(self.device)],
+                             [1, None])
+        d.addCallback(check)
+        return d
+
+    def test_rejected_first(self):
+        self.limited(0)
+        d = self.failUnlessFailure(self.connector.connect(self.device), ChannelRejected)
+        d.addCallback(lambda ign: self.flushLoggedErrors(ConchError))
+        return d
+
+    def test_wrong_password(self):
+        self.device['password'] = 'wrong'
+        return self.failUnlessFailure(self.connector.connect(self.device), LoginFailed)
+
+    def test_host_key(self):
+        self.device['host_key_fingerprint'] = '00:11'
+        return self.failUnlessFailure(self.connector.connect(self.device), HostKeyMismatch)
+
+    def test_exec(self):
+        _, avatar, _ = self.factory.portal.realm.requestAvatar('admin', None, IConchUser)
+        protocol = ExecProtocol()
+        ISession(avatar).execCommand(protocol, 'show clock')
+        def check(ign):
+            protocol.reason.trap(ProcessDone)
+            self.assertEqual(native(b''.join(protocol.data)), '*10:00:00.000 UTC Mon Mar 1 1993\r\n')
+        protocol.ended.addCallback(check)
+        return protocol.ended
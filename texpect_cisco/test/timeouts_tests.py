@@ -0,0 +1,100 @@
+'''
+@author: shylent
+'''
+from twisted.trial import unittest
+from twisted.internet.task import Clock
+from twisted.internet.error import ConnectionLost
+from twisted.python.failure import Failure
+from twisted.test.proto_helpers import StringTransport
+from texpect_cisco.cisco import Cisco, UnexpectedResultError
+from texpect_cisco.timeouts import AdaptiveTimeouts
+
+
+class AdaptiveTimeoutsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.timeouts = AdaptiveTimeouts(minimum=1, maximum=100, clock=Clock())
+
+    def test_unknown(self):
+        self.failUnlessIdentical(self.timeouts.timeout('a', 'show run'), None)
+
+    def test_learn(self):
+        self.timeouts.observe('a', 'show run', 10)
+        self.assertEqual(self.timeouts.timeout('a', 'show run'), 30)
+        for _ in range(50):
+            self.timeouts.observe('a', 'show run', 10)
+        self.failUnless(10 < self.timeouts.timeout('a', 'show run') < 12)
+        self.timeouts.observe('a', 'show run', 20)
+        self.failUnless(self.timeouts.timeout('a', 'show run') > 20)
+
+    def test_clamped(self):
+        self.timeouts.observe('a', 'show clock', 0.01)
+        self.assertEqual(self.timeouts.timeout('a', 'show clock'), 1)
+        self.timeouts.observe('a', 'show tech', 1000)
+        self.assertEqual(self.timeouts.timeout('a', 'show tech'), 100)
+
+    def test_fleet_fallback(self):
+        self.timeouts.observe('a', 'show run', 10)
+        self.timeouts.observe('b', 'show run', 2)
+        self.assertEqual(self.timeouts.stats('c', 'SHOW  run').count, 2)
+        self.assertEqual(self.timeouts.stats('b', 'show run').mean, 2)
+        self.timeouts.forget('b')
+        self.assertEqual(self.timeouts.stats('b', 'show run').count, 2)
+
+    def test_bounded(self):
+        timeouts = AdaptiveTimeouts(clock=Clock(), max_entries=2)
+        timeouts.observe('a', 'show run', 10)
+        timeouts.observe('a', 'show clock', 1)
+        # Used, so it is not the one to go
+        timeouts.stats('a', 'show run')
+        timeouts.stats('c', 'show run')
+        timeouts.observe('b', 'show tech', 100)
+        self.assertEqual(list(timeouts.fleet), ['show run', 'show tech'])
+        self.assertEqual(list(timeouts.devices), [('a', 'show run'), ('b', 'show tech')])
+        self.failUnlessIdentical(timeouts.timeout('a', 'show clock'), None)
+
+
+class WatchdogTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.timeouts = AdaptiveTimeouts(clock=self.clock)
+        self.timeouts.observe('device', 'show run', 2)
+        self.transport = StringTransport()
+        self.c = Cisco({'id':'device', 'prompt':'device>$'}, timeouts=self.timeouts)
+        self.c.makeConnection(self.transport)
+
+    def test_extended(self):
+        d = self.c.run_command('show run')
+        self.clock.advance(5)
+        self.c.dataReceived('show run\r\nline\r\n')
+        self.clock.advance(5)
+        self.c.dataReceived('line\r\n')
+        self.clock.advance(5)
+        self.failIf(self.transport.disconnecting)
+        self.c.dataReceived('device>')
+        d.addCallback(self.assertEqual, 'line\r\nline')
+        d.addCallback(lambda ign: self.assertEqual(
+            self.timeouts.stats('device', 'show run').count, 2))
+        # Timed with the same clock as the watchdog: 15 seconds
+        d.addCallback(lambda ign: self.assertAlmostEqual(
+            self.timeouts.stats('device', 'show run').mean, 2 * 0.875 + 15 * 0.125))
+        return d
+
+    def test_silent(self):
+        # The period is 6 seconds: the first check is at 6, the data received
+        # before it extends the deadline to 12
+        d = self.c.run_command('show run')
+        self.clock.advance(5)
+        self.c.dataReceived('show run\r\n')
+        self.clock.advance(1)
+        self.failIf(self.transport.disconnecting)
+        self.clock.advance(5)
+        self.failIf(self.transport.disconnecting)
+        self.clock.advance(1)
+        self.failUnless(self.transport.disconnecting)
+        self.c.connectionLost(Failure(ConnectionLost()))
+        self.failUnlessFailure(d, UnexpectedResultError)
+        d.addCallback(lambda ign: self.assertEqual(
+            self.timeouts.stats('device', 'show run').count, 1))
+        return d
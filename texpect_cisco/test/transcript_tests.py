@@ -0,0 +1,147 @@
+'''
+@author: shylent
+'''
+from twisted.trial import unittest
+from twisted.internet.task import Clock
+from twisted.internet.error import ConnectionDone, ConnectionLost
+from twisted.python.failure import Failure
+from twisted.test.proto_helpers import StringTransport
+from texpect_cisco.cisco import Cisco
+from texpect_cisco.transcript import Transcript, TranscriptRecorder, \
+    load_transcripts, replay, RECEIVED, SENT, MASKED
+
+
+class TranscriptTestCase(unittest.TestCase):
+
+    def test_bounded(self):
+        t = Transcript('switch', max_bytes=10)
+        t.record(RECEIVED, 'abcd')
+        t.record(SENT, 'efgh')
+        t.record(RECEIVED, 'ijkl')
+        self.assertEqual([data for _, _, data in t.events], ['efgh', 'ijkl'])
+        self.assertEqual(t.size, 8)
+        self.assertEqual(t.dropped, 4)
+        t.record(RECEIVED, 'x' * 15)
+        self.assertEqual([data for _, _, data in t.events], ['x' * 10])
+        self.assertEqual(t.dropped, 17)
+
+    def test_serialization(self):
+        t = Transcript('switch')
+        t.record(RECEIVED, 'Password: \xff\x08')
+        t.record(SENT, 'cisco\n')
+        loaded = Transcript.from_dict(t.to_dict())
+        self.assertEqual(list(loaded.events), list(t.events))
+        self.assertEqual(loaded.device_id, 'switch')
+
+
+class RecorderTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.path = self.mktemp()
+        self.recorder = TranscriptRecorder(self.path, flush_interval=0, batch_size=2)
+
+    def tearDown(self):
+        return self.recorder.stop()
+
+    def test_session(self):
+        c = Cisco({'id':'switch'}, recorder=self.recorder)
+        c.makeConnection(StringTransport())
+        c.write('show clock\n')
+        c.dataReceived('show clock\r\n10:00\r\nswitch#')
+        c.connectionLost(Failure(ConnectionDone()))
+        self.failUnlessIdentical(c.transcript, None)
+        d = self.recorder.flush()
+        def check(ign):
+            transcripts = list(load_transcripts(self.path))
+            self.assertEqual(len(transcripts), 1)
+            self.assertEqual([(direction, data) for _, direction, data in transcripts[0].events],
+                             [(SENT, 'show clock\n'),
+                              (RECEIVED, 'show clock\r\n10:00\r\nswitch#')])
+        d.addCallback(check)
+        return d
+
+    def test_password(self):
+        c = Cisco({'id':'switch', 'password_prompt':'Password:', 'password':'secret',
+                   'prompt':'switch>$'}, recorder=self.recorder)
+        c.makeConnection(StringTransport())
+        d = c.login()
+        c.dataReceived('Password: ')
+        c.dataReceived('\r\nswitch>')
+        d.addCallback(lambda ign: c.write('secret\nshow clock\n', password=True))
+        def check(ign):
+            self.assertEqual([data for _, direction, data in c.transcript.events
+                              if direction == SENT],
+                             [MASKED + '\n', MASKED + '\nshow clock\n'])
+        d.addCallback(check)
+        return d
+
+    def test_batches(self):
+        self.recorder.finish(Transcript('a'))
+        self.failIf(self.recorder._writing)
+        self.recorder.finish(Transcript('b'))
+        d = self.recorder._writing
+        self.failUnless(d)
+        d.addCallback(lambda ign: self.assertEqual(
+            [t.device_id for t in load_transcripts(self.path)], ['a', 'b']))
+        return d
+
+    def test_failed_only(self):
+        self.recorder.failed_only = True
+        c = Cisco({'id':'ok'}, recorder=self.recorder)
+        c.makeConnection(StringTransport())
+        c.connectionLost(Failure(ConnectionDone()))
+        c = Cisco({'id':'lost'}, recorder=self.recorder)
+        c.makeConnection(StringTransport())
+        c.connectionLost(Failure(ConnectionLost()))
+        self.assertEqual([t.device_id for t in self.recorder._pending], ['lost'])
+
+
+class ReplayTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.transcript = Transcript('switch')
+        self.transcript.record(SENT, 'show clock\n')
+        self.transcript.record(RECEIVED, 'show clock\r\n')
+        self.transcript.record(RECEIVED, '10:00\r\nswitch>')
+        self.clock = Clock()
+
+    def _replay(self, device, command):
+        d = replay(self.transcript, device, lambda c: c.run_command(command),
+                   clock=self.clock)
+        for _ in range(5):
+            self.clock.advance(0)
+        return d
+
+    def test_replay(self):
+        d = self._replay({'id':'switch', 'prompt':'switch>$'}, 'show clock')
+        def check(res):
+            output, transport = res
+            self.assertEqual(output, '10:00')
+            self.assertEqual(transport.mismatches, [])
+        d.addCallback(check)
+        return d
+
+    def test_mismatch(self):
+        d = self._replay({'id':'switch', 'prompt':'switch>$'}, 'show users')
+        def check(res):
+            output, transport = res
+            self.assertEqual(transport.mismatches, [('show clock\n', 'show users\n')])
+        d.addCallback(check)
+        return d
+
+    def test_masked_password(self):
+        transcript = Transcript('switch')
+        transcript.record(RECEIVED, 'Password: ')
+        transcript.record(SENT, MASKED + '\n')
+        transcript.record(RECEIVED, '\r\nswitch>')
+        d = replay(transcript, {'id':'switch', 'password_prompt':'Password:',
+                                'password':'secret', 'prompt':'switch>$'},
+                   lambda c: c.login(), clock=self.clock)
+        for _ in range(5):
+            self.clock.advance(0)
+        def check(res):
+            res, transport = res
+            self.failIf(isinstance(res, Failure))
+            self.assertEqual(transport.mismatches, [])
+        d.addCallback(check)
+        return d
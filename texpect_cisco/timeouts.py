@@ -0,0 +1,160 @@
+'''
+@author: shylent
+'''
+from collections import OrderedDict
+
+
+class CommandStats(object):
+    """Smoothed duration of a command and its mean deviation.
+
+    @ivar mean: The smoothed duration, in seconds
+    @type mean: C{float}
+
+    @ivar deviation: The smoothed mean deviation of the duration, in seconds
+    @type deviation: C{float}
+
+    @ivar count: Number of observations
+    @type count: C{int}
+
+    """
+    __slots__ = ('mean', 'deviation', 'count')
+
+    def __init__(self):
+        self.mean = None
+        self.deviation = None
+        self.count = 0
+
+    def observe(self, seconds, alpha, beta):
+        if self.mean is None:
+            self.mean = seconds
+            self.deviation = seconds / 2.0
+        else:
+            self.deviation = (1 - beta) * self.deviation + beta * abs(self.mean - seconds)
+            self.mean = (1 - alpha) * self.mean + alpha * seconds
+        self.count += 1
+
+
+class AdaptiveTimeouts(object):
+    """Learns how long the commands take on every device and derives the command
+    timeouts from that, the same way TCP derives its retransmission timeout from
+    the round-trip times: the smoothed duration plus a few smoothed mean
+    deviations.
+
+    The timeout is not a hard deadline: when it expires, but the output is still
+    arriving, it is extended by the same amount (see
+    L{Cisco.run_command<texpect_cisco.cisco.Cisco.run_command>}). Only a session,
+    that has been silent for the whole period, is considered dead.
+
+    A single instance is meant to be shared by all the sessions (pass it to
+    L{Cisco<texpect_cisco.cisco.Cisco>} as the C{timeouts} argument or put it at
+    the 'timeouts' key of the device dictionary). Until a command has been
+    observed on the device, the fleet-wide statistics of the command are used,
+    and until it has been observed at all, the usual 'command_timeout' is.
+
+    @ivar minimum: The timeout is never shorter than this, in seconds
+    @type minimum: C{float}
+
+    @ivar maximum: The timeout is never longer than this, in seconds. This is
+    also the hard deadline for a command, that keeps producing output.
+    @type maximum: C{float}
+
+    @ivar fleet: Command to the fleet-wide L{CommandStats} mapping, the least
+    recently used first
+    @type fleet: C{OrderedDict}
+
+    @ivar devices: C{(device id, command)} to L{CommandStats} mapping, the least
+    recently used first
+    @type devices: C{OrderedDict}
+
+    """
+
+    def __init__(self, alpha=0.125, beta=0.25, deviations=4, minimum=1, maximum=300,
+                 clock=None, max_entries=10000):
+        """
+        @param alpha: The weight of a new observation in the smoothed duration.
+        Default: 0.125
+        @type alpha: C{float}
+
+        @param beta: The weight of a new observation in the smoothed deviation.
+        Default: 0.25
+        @type beta: C{float}
+
+        @param deviations: Number of deviations added to the duration. Default: 4
+        @type deviations: C{float}
+
+        @param minimum: See L{minimum}. Default: 1
+        @param maximum: See L{maximum}. Default: 300
+
+        @param clock: An object, providing C{IReactorTime}, that is used for the
+        timeouts and to time the commands. Default: the global reactor
+
+        @param max_entries: The maximum number of the statistics in L{fleet} and,
+        separately, in L{devices}, the least recently used ones are forgotten
+        (the commands are arbitrary strings, there is no telling how many
+        distinct ones there will be). Default: 10000
+        @type max_entries: C{int}
+
+        """
+        if clock is None:
+            from twisted.internet import reactor as clock
+        self.alpha = alpha
+        self.beta = beta
+        self.deviations = deviations
+        self.minimum = minimum
+        self.maximum = maximum
+        self.clock = clock
+        self.max_entries = max_entries
+        self.fleet = OrderedDict()
+        self.devices = OrderedDict()
+
+    def normalize(self, command):
+        """@return: The key, that the statistics of the command are kept under
+        @rtype: C{str}"""
+        return ' '.join(command.lower().split())
+
+    def observe(self, device_id, command, seconds):
+        """Record the duration of a command, that has completed."""
+        command = self.normalize(command)
+        for stats, key in ((self.fleet, command), (self.devices, (device_id, command))):
+            entry = self._get(stats, key)
+            if entry is None:
+                entry = stats[key] = CommandStats()
+                while len(stats) > self.max_entries:
+                    stats.popitem(last=False)
+            entry.observe(seconds, self.alpha, self.beta)
+
+    def _get(self, stats, key):
+        entry = stats.pop(key, None)
+        if entry is not None:
+            # Mark as the most recently used
+            stats[key] = entry
+        return entry
+
+    def stats(self, device_id, command):
+        """@return: The statistics of the command on the device, the fleet-wide
+        statistics of the command if it hasn't been observed on this device or
+        C{None} if it hasn't been observed at all
+        @rtype: L{CommandStats}"""
+        command = self.normalize(command)
+        entry = self._get(self.devices, (device_id, command))
+        if entry is None:
+            entry = self._get(self.fleet, command)
+        return entry
+
+    def timeout(self, device_id, command):
+        """@return: The timeout for the command on the device, in seconds, or
+        C{None} if nothing is known about the command
+        @rtype: C{float}"""
+        entry = self.stats(device_id, command)
+        if entry is None:
+            return None
+        timeout = entry.mean + self.deviations * entry.deviation
+        return min(self.maximum, max(self.minimum, timeout))
+
+    def forget(self, device_id):
+        """Drop the statistics of the device (for example, when it is removed
+        from the inventory).
+
+        """
+        for key in [key for key in self.devices if key[0] == device_id]:
+            del self.devices[key]
@@ -0,0 +1,349 @@
+'''
+@author: shylent
+'''
+import json
+import time
+from collections import deque
+from twisted.python import log
+from twisted.internet.defer import Deferred, succeed
+from twisted.internet.task import LoopingCall
+from twisted.internet.threads import deferToThread
+from texpect_cisco.compat import native, to_text
+
+
+RECEIVED = 'in'
+SENT = 'out'
+# What the passwords are recorded as
+MASKED = '********'
+
+
+class Transcript(object):
+    """The record of what was sent to and received from the device during a
+    session. Only the last L{max_bytes} characters are kept (older events are
+    dropped as the newer ones arrive), so the memory used is bounded no matter
+    how long the session is.
+
+    @ivar device_id: The id of the device
+    @type device_id: C{str}
+
+    @ivar started: The time the transcript was started
+    @type started: C{float}
+
+    @ivar events: C{(timestamp, direction, data)} tuples, where direction is
+    either L{RECEIVED} or L{SENT}. The passwords, that were sent, are recorded
+    as L{MASKED}
+    @type events: C{deque}
+
+    @ivar dropped: Number of characters, that were dropped
+    @type dropped: C{int}
+
+    """
+
+    def __init__(self, device_id, max_bytes=65536, started=None):
+        self.device_id = device_id
+        self.max_bytes = max_bytes
+        self.started = started if started is not None else time.time()
+        self.events = deque()
+        self.size = 0
+        self.dropped = 0
+
+    def record(self, direction, data):
+        """Add an event to the transcript."""
+        if len(data) > self.max_bytes:
+            self.dropped += len(data) - self.max_bytes
+            data = data[-self.max_bytes:]
+        self.events.append((time.time(), direction, data))
+        self.size += len(data)
+        while self.size > self.max_bytes:
+            _, _, old = self.events.popleft()
+            self.size -= len(old)
+            self.dropped += len(old)
+
+    def to_dict(self):
+        """@return: A JSON-serializable representation of the transcript
+        @rtype: C{dict}"""
+        return {
+            'device_id':self.device_id,
+            'started':self.started,
+            'dropped':self.dropped,
+            'events':[(t, direction, to_text(data))
+                      for t, direction, data in self.events],
+        }
+
+    @classmethod
+    def from_dict(cls, d):
+        """The reverse of L{to_dict}
+
+        @rtype: L{Transcript}
+
+        """
+        transcript = cls(d['device_id'], max_bytes=float('inf'), started=d['started'])
+        transcript.dropped = d['dropped']
+        for t, direction, data in d['events']:
+            transcript.events.append((t, direction, native(data)))
+            transcript.size += len(data)
+        return transcript
+
+
+class TranscriptRecorder(object):
+    """Keeps the transcripts of the sessions and writes the completed ones to a
+    file (one JSON document per line) in batches. The file is written in a
+    thread, so the reactor thread never waits for the disk.
+
+    Pass it to L{Cisco<texpect_cisco.cisco.Cisco>} as the C{recorder} argument
+    (or put it at the 'recorder' key of the device dictionary).
+
+    @ivar path: The file, that the transcripts are appended to
+    @type path: C{str}
+
+    @ivar max_bytes: The size limit of every transcript
+    @type max_bytes: C{int}
+
+    @ivar failed_only: If C{True}, only the transcripts of the sessions, that
+    have encountered an error, are written
+    @type failed_only: C{bool}
+
+    """
+
+    def __init__(self, path, max_bytes=65536, batch_size=100, flush_interval=5,
+                 max_pending=10000, failed_only=False, clock=None):
+        """
+        @param path: The file, that the transcripts are appended to
+        @type path: C{str}
+
+        @param max_bytes: The size limit of every transcript. Default: 65536
+        @type max_bytes: C{int}
+
+        @param batch_size: The completed transcripts are written when there are at
+        least this many of them. Default: 100
+        @type batch_size: C{int}
+
+        @param flush_interval: The completed transcripts are written at least this
+        often (in seconds). Default: 5
+        @type flush_interval: C{int}
+
+        @param max_pending: If the disk can't keep up, the oldest completed
+        transcripts are dropped when there are more than this many waiting to be
+        written. Default: 10000
+        @type max_pending: C{int}
+
+        @param failed_only: See L{failed_only}. Default: C{False}
+        @type failed_only: C{bool}
+
+        @param clock: An object, providing C{IReactorTime}. Default: the global reactor
+
+        """
+        if clock is None:
+            from twisted.internet import reactor as clock
+        self.path = path
+        self.max_bytes = max_bytes
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self.failed_only = failed_only
+        self.lost = 0
+        self._pending = deque()
+        self._writing = None
+        self._flusher = LoopingCall(self.flush)
+        self._flusher.clock = clock
+        if flush_interval:
+            self._flusher.start(flush_interval, now=False)
+
+    def start(self, device_id):
+        """Start a new transcript.
+
+        @rtype: L{Transcript}
+
+        """
+        return Transcript(device_id, self.max_bytes)
+
+    def finish(self, transcript, failed=False):
+        """Queue the completed transcript for writing.
+
+        @param failed: Whether or not the session has encountered an error
+        @type failed: C{bool}
+
+        """
+        if self.failed_only and not failed:
+            return
+        self._pending.append(transcript)
+        while len(self._pending) > self.max_pending:
+            self._pending.popleft()
+            self.lost += 1
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Write the completed transcripts.
+
+        @return: A L{Deferred}, that fires when they are written
+        @rtype: L{Deferred}
+
+        """
+        if self._writing is not None:
+            # One write at a time, the transcripts that are finished in the
+            # meantime wait for the next flush
+            return self._writing
+        if not self._pending:
+            return succeed(None)
+        batch = [transcript.to_dict() for transcript in self._pending]
+        self._pending.clear()
+        d = self._writing = deferToThread(self._write, batch)
+        def done(res):
+            self._writing = None
+            return res
+        d.addBoth(done)
+        d.addErrback(log.err, "Failed to write the transcripts to %s" % self.path)
+        return d
+
+    def _write(self, batch):
+        with open(self.path, 'a') as f:
+            for transcript in batch:
+                f.write(json.dumps(transcript) + '\n')
+
+    def stop(self):
+        """Stop the periodic flushing and write whatever is left.
+
+        @rtype: L{Deferred}
+
+        """
+        if self._flusher.running:
+            self._flusher.stop()
+        d = Deferred()
+        def again(ign):
+            if self._pending:
+                return self.flush().addCallback(again)
+        (self._writing or succeed(None)).addCallback(again).chainDeferred(d)
+        return d
+
+
+def load_transcripts(path):
+    """Read the transcripts, that were written by L{TranscriptRecorder}.
+
+    @rtype: C{iterator} of L{Transcript}
+
+    """
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                yield Transcript.from_dict(json.loads(line))
+
+
+class ReplayTransport(object):
+    """A transport, that plays the received part of a transcript back to the
+    session. The data, that was received before the session sent something, is
+    only delivered after the session sends it, so the session sees exactly the
+    same sequence of events as it did when talking to the real device.
+
+    @ivar mismatches: C{(expected, actual)} pairs for every write, that didn't
+    match what was sent originally
+    @type mismatches: C{list}
+
+    """
+    disconnecting = False
+
+    def __init__(self, transcript, clock=None):
+        if clock is None:
+            from twisted.internet import reactor as clock
+        self.clock = clock
+        self.events = deque(transcript.events)
+        self.mismatches = []
+        self.protocol = None
+        self._written = ''
+
+    def attach(self, protocol):
+        self.protocol = protocol
+        protocol.makeConnection(self)
+        self._deliver()
+
+    def _deliver(self):
+        """Play the received data back up to the next write of the session."""
+        chunks = []
+        while self.events and self.events[0][1] == RECEIVED:
+            chunks.append(self.events.popleft()[2])
+        if chunks:
+            self.clock.callLater(0, self._feed, ''.join(chunks))
+        elif not self.events:
+            self.clock.callLater(0, self.loseConnection)
+
+    def _feed(self, data):
+        if self.protocol is not None and not self.disconnecting:
+            self.protocol.dataReceived(data)
+
+    def write(self, data):
+        self._written += native(data)
+        while self.events and self.events[0][1] == SENT:
+            expected = self.events[0][2]
+            written = self._written
+            masked = expected.startswith(MASKED)
+            if masked:
+                # The password is not known, so any line matches it
+                end = written.find('\n')
+                if end == -1:
+                    return
+                expected, written = expected[len(MASKED):], written[end:]
+            if len(written) < len(expected):
+                return
+            actual, self._written = written[:len(expected)], written[len(expected):]
+            self.events.popleft()
+            if actual != expected:
+                if masked:
+                    expected, actual = MASKED + expected, MASKED + actual
+                self.mismatches.append((expected, actual))
+        self._deliver()
+
+    def writeSequence(self, seq):
+        self.write(b''.join(seq))
+
+    def loseConnection(self):
+        if self.disconnecting:
+            return
+        self.disconnecting = True
+        from twisted.python.failure import Failure
+        from twisted.internet.error import ConnectionDone
+        self.protocol.connectionLost(Failure(ConnectionDone()))
+
+    def getPeer(self):
+        return None
+
+    def getHost(self):
+        return None
+
+    def pauseProducing(self):
+        pass
+
+    def resumeProducing(self):
+        pass
+
+
+def replay(transcript, device, job, protocol=None, clock=None):
+    """Run the job against the recorded transcript instead of the device.
+
+    @param transcript: The transcript to replay
+    @type transcript: L{Transcript}
+
+    @param device: The device dictionary. It may differ from the one, that was
+    used when the transcript was recorded, for example to try a fixed prompt
+    expression.
+    @type device: C{dict}
+
+    @param job: A callable, that takes the session and returns a L{Deferred}
+    (see L{FleetRunner<texpect_cisco.fleet.FleetRunner>})
+    @type job: C{callable}
+
+    @param protocol: The session class. Default: L{Cisco<texpect_cisco.cisco.Cisco>}
+
+    @return: A L{Deferred}, that fires with a C{(result, transport)} tuple, where the
+    result is the result of the job (or a L{Failure}) and the transport holds the
+    L{mismatches<ReplayTransport.mismatches>}.
+    @rtype: L{Deferred}
+
+    """
+    from twisted.internet.defer import maybeDeferred
+    if protocol is None:
+        from texpect_cisco.cisco import Cisco as protocol
+    inst = protocol(device)
+    transport = ReplayTransport(transcript, clock)
+    transport.attach(inst)
+    d = maybeDeferred(job, inst)
+    d.addBoth(lambda res: (res, transport))
+    return d